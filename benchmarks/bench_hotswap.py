@@ -0,0 +1,410 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Headless benchmarks of reloading modules and updating declarative trees.
+
+Synthetic module graphs and enamldef trees are generated in a temporary
+directory so nothing needs a display. Results are written as json so runs
+of different versions can be compared.
+
+Usage:
+
+    python benchmarks/bench_hotswap.py -o before.json
+    python benchmarks/bench_hotswap.py --full -o after.json --compare before.json
+
+'''
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import importlib.metadata
+from textwrap import dedent
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import enaml
+from hotswap import autoreload
+from hotswap.autoreload import ModuleReloader, reload_code, superreload
+from hotswap.compiler import CodeCache
+from hotswap.core import Hotswapper
+from hotswap.watcher import create_watcher
+
+
+#: Sizes used by default and with --full
+MODULE_COUNTS = [100, 1000]
+FULL_MODULE_COUNTS = [100, 1000, 10000]
+NODE_COUNTS = [10, 100, 1000]
+FULL_NODE_COUNTS = [10, 100, 1000, 10000]
+
+
+class Workspace(object):
+    """ A temporary directory on sys.path that sources are written into.
+
+    Each write moves the mtime forward so changes are always detected
+    without sleeping.
+
+    """
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='hotswap-bench-')
+        self.mtime = time.time()
+        sys.path.insert(0, self.path)
+
+    def write(self, name, source):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'w') as f:
+            f.write(source)
+        self.mtime += 10
+        os.utime(filename, (self.mtime, self.mtime))
+        return filename
+
+    def close(self):
+        sys.path.remove(self.path)
+        for name, module in list(sys.modules.items()):
+            if (getattr(module, '__file__', None) or '').startswith(self.path):
+                del sys.modules[name]
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def swap_source(ws, module, name, source, cache):
+    """ Write the source and reload the module from it like the reloader
+    does. The code is cached so the setup of each run does not recompile
+    the same sources.
+
+    """
+    filename = ws.write(name, source)
+    with enaml.imports():
+        reload_code(module, cache.get(filename, source.encode()))
+
+
+def measure(func, repeat, setup=None):
+    """ Call func repeat times and return the durations in seconds. If
+    given, setup is called before each run and not timed.
+
+    """
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, params, times):
+    return {
+        'name': name,
+        'params': params,
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+    }
+
+
+#------------------------------------------------------------------------------
+# Module graphs
+#------------------------------------------------------------------------------
+def module_source(i, version=0):
+    """ Source of a synthetic module that imports up to two of the
+    previous modules so the graph is a tree with some fan in.
+
+    """
+    lines = ['VERSION = %i' % version]
+    for dep in sorted({i // 2, i // 3}):
+        if 0 <= dep < i:
+            lines.append('import hs_bench_mod%i' % dep)
+    lines.append(dedent('''
+        class Model%(i)i(object):
+            def value(self):
+                return %(i)i + VERSION
+
+        def helper%(i)i(x):
+            return x * %(i)i
+    ''' % {'i': i}))
+    return '\n'.join(lines)
+
+
+def bench_check(count, repeat):
+    """ Latency of check() with no changes, of the first edit which scans
+    the imports of the modules, and with edits of a leaf (no dependents) and
+    of a module in the middle of the graph which has dependents that are
+    reloaded as well.
+
+    """
+    results = []
+    ws = Workspace()
+    try:
+        for i in range(count):
+            ws.write('hs_bench_mod%i.py' % i, module_source(i))
+        __import__('hs_bench_mod%i' % (count - 1))
+        for i in range(count):
+            __import__('hs_bench_mod%i' % i)
+
+        for watch in (False, True):
+            watcher = create_watcher() if watch else None
+            reloader = ModuleReloader(watcher=watcher)
+            kind = type(watcher).__name__ if watch else 'stat'
+            params = {'modules': count, 'watcher': kind}
+
+            results.append(result('check.idle', params,
+                                  measure(reloader.check, repeat)))
+
+            #: The first edit also scans the imports of the tracked modules
+            def first_edit(n):
+                ws.write('hs_bench_mod%i.py' % (count - 1),
+                         module_source(count - 1, -1))
+            results.append(result('check.first_edit', params,
+                                  measure(reloader.check, 1, first_edit)))
+
+            for name, i in (('check.edit_leaf', count - 1),
+                            ('check.edit_mid', count // 4)):
+                def edit(n, i=i):
+                    ws.write('hs_bench_mod%i.py' % i, module_source(i, n + 1))
+                item = result(name, params,
+                              measure(reloader.check, repeat, edit))
+                item['counts'] = reloader.summary.counts
+                results.append(item)
+            if watcher is not None:
+                watcher.close()
+    finally:
+        ws.close()
+    return results
+
+
+def bench_superreload(count, repeat):
+    """ Cost of superreload for a module defining count functions and
+    classes, most of the time is spent patching the old objects.
+
+    """
+    ws = Workspace()
+    try:
+        def source(version):
+            return '\n'.join(
+                'class C%(i)i(object):\n'
+                '    def f(self):\n'
+                '        return %(v)i\n'
+                'def f%(i)i():\n'
+                '    return %(v)i\n' % {'i': i, 'v': version}
+                for i in range(count))
+        ws.write('hs_bench_big.py', source(0))
+        import hs_bench_big
+        old_objects = autoreload.ObjectRegistry()
+        superreload(hs_bench_big, old_objects=old_objects)
+        times = measure(
+            lambda: superreload(hs_bench_big, old_objects=old_objects),
+            repeat, lambda n: ws.write('hs_bench_big.py', source(n + 1)))
+        return [result('superreload', {'definitions': count}, times)]
+    finally:
+        ws.close()
+
+
+#------------------------------------------------------------------------------
+# Declarative trees
+#------------------------------------------------------------------------------
+TREE_HEADER = '''
+from enaml.core.api import Declarative
+
+enamldef Item(Declarative):
+    attr text = ""
+    attr count = 0
+
+enamldef Group(Declarative):
+    attr title = ""
+
+'''
+
+
+def tree_source(count, edit=None, depth=2):
+    """ Source of an enamldef with about count nodes in groups nested to
+    the given depth.
+
+    Parameters
+    -----------
+    count: int
+        Number of nodes
+    edit: str or None
+        The edit pattern to apply, one of 'text', 'insert', 'remove' or
+        'reorder'.
+
+    """
+    fanout = max(2, int(round(count ** (1.0 / depth))))
+    lines = [TREE_HEADER, 'enamldef Main(Declarative): view:',
+             '    attr title = "main"']
+    items = []
+    n = [0]
+
+    def add(level, indent):
+        for i in range(fanout):
+            if n[0] >= count:
+                return
+            n[0] += 1
+            if level < depth - 1:
+                items.append((indent, 'Group:', 'title = "g%i"' % n[0]))
+                add(level + 1, indent + 1)
+            else:
+                text = '"item%i"' % n[0]
+                if edit == 'text' and n[0] == count // 2:
+                    text = '"edited"'
+                items.append((indent, 'Item: item%i:' % n[0],
+                              'text = %s' % text))
+
+    add(0, 1)
+    if edit == 'insert':
+        items.insert(len(items) // 2, (1, 'Item:', 'text = "inserted"'))
+    elif edit == 'remove':
+        del items[len(items) // 2]
+    elif edit == 'reorder':
+        top = [i for i, item in enumerate(items) if item[0] == 1]
+        if len(top) > 1:
+            #: Move the last top level block to the front
+            last = items[top[-1]:]
+            items = last + items[:top[-1]]
+
+    for indent, decl, body in items:
+        lines.append('    ' * indent + decl)
+        lines.append('    ' * (indent + 1) + body)
+    return '\n'.join(lines) + '\n'
+
+
+def bench_update(count, repeat):
+    """ Throughput of Hotswapper.update for typical edits of a tree, from
+    the compiled enamldef (update(view)) and from a new view instance
+    (update(view, new)).
+
+    """
+    results = []
+    ws = Workspace()
+    try:
+        ws.write('hs_bench_view.enaml', tree_source(count))
+        with enaml.imports():
+            import hs_bench_view
+        module = hs_bench_view
+        hotswap = Hotswapper()
+        cache = CodeCache()
+
+        for edit in (None, 'text', 'insert', 'remove', 'reorder'):
+            for mode in ('node', 'instance'):
+                views = []
+
+                def setup(n):
+                    #: Start from a fresh view of the original source
+                    swap_source(ws, module, 'hs_bench_view.enaml',
+                                tree_source(count), cache)
+                    view = module.Main()
+                    view.initialize()
+                    swap_source(ws, module, 'hs_bench_view.enaml',
+                                tree_source(count, edit), cache)
+                    views[:] = [view]
+
+                summaries = []
+
+                def run():
+                    #: Creating the new view is part of an instance update
+                    new = None
+                    if mode == 'instance':
+                        new = module.Main()
+                        new.initialize()
+                    summaries.append(hotswap.update(views[0], new))
+
+                times = measure(run, repeat, setup)
+                item = result('update', {'nodes': count, 'edit': edit or 'none',
+                                         'mode': mode}, times)
+                item['counts'] = summaries[-1].counts
+                results.append(item)
+    finally:
+        ws.close()
+    return results
+
+
+#------------------------------------------------------------------------------
+# Runner
+#------------------------------------------------------------------------------
+def package_version(name):
+    """ Get the installed version of a distribution or None """
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def metadata():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'atom': package_version('atom'),
+        'enaml': package_version('enaml'),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, filename):
+    """ Print the ratio of the median times to a previous run """
+    with open(filename) as f:
+        previous = json.load(f)['results']
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    before = {key(r): r for r in previous}
+    for r in results:
+        other = before.get(key(r))
+        if other is None:
+            continue
+        ratio = r['median'] / other['median'] if other['median'] else 0
+        print('%-18s %-60s %8.2fms -> %8.2fms (x%.2f)' % (
+            r['name'], json.dumps(r['params'], sort_keys=True),
+            other['median']*1000, r['median']*1000, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Headless benchmarks of reloading modules and updating "
+                    "declarative trees.")
+    parser.add_argument('-o', '--output', help="Write the json results here")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help="Number of runs of each benchmark")
+    parser.add_argument('--full', action='store_true',
+                        help="Include the largest sizes (10,000 modules and nodes)")
+    parser.add_argument('--only', choices=['check', 'superreload', 'update'],
+                        action='append', help="Only run the given benchmarks")
+    parser.add_argument('--compare', help="Previous json results to compare to")
+    args = parser.parse_args(argv)
+
+    modules = FULL_MODULE_COUNTS if args.full else MODULE_COUNTS
+    nodes = FULL_NODE_COUNTS if args.full else NODE_COUNTS
+    only = set(args.only or ['check', 'superreload', 'update'])
+
+    results = []
+    if 'check' in only:
+        for count in modules:
+            results.extend(bench_check(count, args.repeat))
+    if 'superreload' in only:
+        for count in modules:
+            results.extend(bench_superreload(count, args.repeat))
+    if 'update' in only:
+        for count in nodes:
+            results.extend(bench_update(count, args.repeat))
+
+    for r in results:
+        print('%-18s %-60s %8.2fms' % (
+            r['name'], json.dumps(r['params'], sort_keys=True),
+            r['median']*1000))
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': metadata(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
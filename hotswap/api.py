@@ -1,2 +1,14 @@
+from .core import Hotswapper
+from .scope import Scope
+from .snapshot import Snapshot
+from .compiler import CodeCache
+from .remote import HotswapClient, HotswapServer
 
-from .core import Hotswapper
\ No newline at end of file
+
+def __getattr__(name):
+    #: The driver imports asyncio which is slow to import and only needed
+    #: by apps running an event loop
+    if name == 'AsyncDriver':
+        from .driver import AsyncDriver
+        return AsyncDriver
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -127,17 +127,63 @@ skip_doctest = True
 
 import os
 import sys
+import site
+import hashlib
+import sysconfig
 import traceback
+import multiprocessing
 import types
 import weakref
+from time import perf_counter, time_ns
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from importlib import import_module
 from imp import reload
-from atom.api import Atom, Bool, Dict, Instance, List
-from . import openpy
+from atom.api import (
+    Atom, Bool, Dict, ForwardTyped, Instance, Int, List, Typed
+)
+from .compiler import CodeCache, Precompiler, compile_source
+from .depgraph import DependencyGraph
+from .index import ModuleIndex
+from .scope import Scope
+from .snapshot import Snapshot
+from .sources import SourceProvider
+from .summary import SwapSummary
+from .watcher import Watcher
 #------------------------------------------------------------------------------
 # Autoreload functionality
 #------------------------------------------------------------------------------
 
+#: Directories of the stdlib and installed packages. Modules in these do not
+#: import the app's modules so their imports are not tracked. The prefixes
+#: themselves are not used since apps may live under them (ex /usr/src/app).
+LIBRARY_PREFIXES = tuple({
+    os.path.join(os.path.normcase(os.path.abspath(p)), '')
+    for p in [sysconfig.get_paths().get(key) for key in (
+        'stdlib', 'platstdlib', 'purelib', 'platlib')] + [
+        site.getusersitepackages()] if p
+})
+
+
+@lru_cache(maxsize=None)
+def is_library(filename):
+    """Check whether the file is part of the stdlib or an installed
+    package"""
+    path = os.path.normcase(os.path.abspath(filename))
+    return path.startswith(LIBRARY_PREFIXES)
+
+
+def file_hash(filename):
+    """Return a digest of the contents of a file"""
+    with open(filename, 'rb') as f:
+        return source_hash(f.read())
+
+
+def source_hash(source):
+    """Return a digest of the source bytes"""
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
 class ModuleReloader(Atom):
     #: Whether this reloader is enabled
     enabled = Bool(True)
@@ -145,7 +191,7 @@ class ModuleReloader(Atom):
     #: Autoreload all modules, not just those listed in 'modules'
     check_all = Bool(True)
 
-    #: Modules that failed to reload: {module: mtime-on-failed-reload, ...}
+    #: Modules that failed to reload: {module: key-on-failed-reload, ...}
     failed = Dict()
 
     # Modules specially marked as autoreloadable.
@@ -154,20 +200,109 @@ class ModuleReloader(Atom):
     # Modules specially marked as not autoreloadable.
     skip_modules = Dict()
 
-    # (module-name, name) -> weakref, for replacing old code objects
-    old_objects = Dict()
+    # (module-name, name) -> weakrefs, for replacing old code objects
+    old_objects = ForwardTyped(lambda: ObjectRegistry, ())
 
-    # Module modification timestamps
+    # Module change keys, see SourceProvider.change_key
     modules_mtimes = Dict()
 
+    #: Modules that changed within the same second as the version they were
+    #: last loaded from. Bytecode caches only store the mtime in seconds so
+    #: these are reloaded from their source.
+    stale_bytecode = Typed(set, ())
+
+    #: Names of the globals whose value changed in a reload since they were
+    #: last taken by the hotswapper
+    changed_globals = Typed(set, ())
+
     #: Source extension types
     source_exts = List(default=['.py'])
 
     #: Print when a module is reloaded
     debug = Bool()
 
+    #: Watcher backend reporting changed files. When set, `check` only
+    #: looks at modules whose files changed instead of all of sys.modules.
+    watcher = Instance(Watcher)
+
+    #: Index of module names to source files
+    index = Instance(ModuleIndex)
+
+    #: Only index and check the modules in this scope, so other modules
+    #: such as the stdlib and site-packages are never stat'ed
+    scope = Instance(Scope)
+
+    #: Import graph of the indexed modules
+    graph = Instance(DependencyGraph, ())
+
+    #: Also reload modules that import a changed module
+    reload_dependents = Bool(True)
+
+    #: Only reload when the contents of a file changed, not just the mtime
+    use_hash = Bool()
+
+    # Module content hashes, used when use_hash is enabled
+    modules_hashes = Dict()
+
+    #: Counters of what checks did, such as the number of modules reloaded
+    #: or skipped because only their mtime changed
+    stats = Dict()
+
+    #: Timings and counts of the last check
+    summary = Typed(SwapSummary, ())
+
+    #: Cache of compiled code keyed by the source contents. When set,
+    #: modules are reloaded by executing the cached code instead of
+    #: importing them again.
+    code_cache = Instance(CodeCache)
+
+    #: When at least this many modules are reloaded at once they are
+    #: compiled in a process pool first. Zero disables it.
+    bulk_compile = Int()
+
+    #: Number of processes used to compile, by default one per cpu
+    max_workers = Int()
+
+    #: Process pool used for bulk compiles, it's created on first use and
+    #: kept until the reloader is closed
+    compile_pool = Typed(ProcessPoolExecutor)
+
+    #: Compiles changed files into the code cache from a background thread
+    #: as soon as the watcher sees them. See `start_precompiling`.
+    precompiler = Instance(Precompiler)
+
+    #: Provides the change keys and contents of the source files
+    sources = Typed(SourceProvider, ())
+
+    #: Change keys and hashes saved by a previous run, the first check
+    #: compares the modules against it. This implies lazy.
+    snapshot = Instance(Snapshot)
+
+    #: Do not stat the modules when created but in the first check. Files
+    #: that changed after `started` are reloaded by it. See `restore`.
+    lazy = Bool()
+
+    #: Time the app started in ns, by default when the reloader was created
+    started = Int()
+
+    #: Whether all loaded modules were indexed and their keys cached
+    indexed = Bool()
+
+    #: Modules found changed when they were indexed, reloaded by the check
+    pending = Typed(set, ())
+
+    def _default_index(self):
+        return ModuleIndex(source_exts=self.source_exts, scope=self.scope)
+
     def __init__(self, *args, **kwargs):
         super(ModuleReloader, self).__init__(*args, **kwargs)
+        if not self.started:
+            self.started = time_ns()
+        if self.snapshot is not None:
+            self.snapshot.load()
+            self.lazy = True
+        if self.lazy:
+            return
 
         # Cache module modification times
         self.check(check_all=True, do_reload=False)
@@ -187,6 +322,7 @@ class ModuleReloader(Atom):
         except KeyError:
             pass
         self.modules[module_name] = True
+        self.graph.invalidate(module_name)
 
     def aimport_module(self, module_name):
         """Import a module, and mark it reloadable
@@ -207,76 +343,372 @@ class ModuleReloader(Atom):
         return top_module, top_name
 
     def filename_and_mtime(self, module):
-        if not hasattr(module, '__file__') or module.__file__ is None:
+        """Return the source filename of the module and its change key
+        (see SourceProvider.change_key) or (None, None)."""
+        modname = getattr(module, '__name__', None)
+        if modname is None or sys.modules.get(modname) is not module:
+            py_filename = self.index.resolve(module)
+        else:
+            py_filename = self.index.get(modname)
+        if py_filename is None:
             return None, None
 
-        if getattr(module, '__name__', None) in ['__mp_main__', '__main__']:
-            # we cannot reload(__main__) or reload(__mp_main__)
+        try:
+            key = self.sources.change_key(py_filename)
+        except OSError:
             return None, None
 
-        filename = module.__file__
-        path, ext = os.path.splitext(filename)
-
-        if ext.lower() in self.source_exts:
-            py_filename = filename
-        else:
+        return py_filename, key
+
+    def update_index(self, added=(), removed=()):
+        """Update the module index with modules that were added to or
+        removed from sys.modules and cache the change keys of new ones."""
+        graph = self.graph
+        for modname in removed:
+            self.modules_mtimes.pop(modname, None)
+            self.modules_hashes.pop(modname, None)
+            self.stale_bytecode.discard(modname)
+            self.old_objects.clear(modname)
+            graph.remove(modname)
+        for modname, py_filename in self.index.update(added, removed):
+            graph.invalidate(modname)
             try:
-                py_filename = openpy.source_from_cache(filename)
-            except ValueError:
-                return None, None
+                key = self.sources.change_key(py_filename)
+            except OSError:
+                continue
+            self.restore(modname, py_filename, key)
+            if self.watcher is not None:
+                self.watcher.watch(py_filename)
 
-        try:
-            pymtime = os.stat(py_filename).st_mtime
-        except OSError:
-            return None, None
+    def restore(self, modname, py_filename, key):
+        """Cache the change key and hash of a newly indexed module.
+
+        When lazy, modules indexed by the first check whose files changed
+        after the app started are added to `pending` so the check reloads
+        them. Files that changed while the app was not running were
+        imported with the changes so they are not. The hash is taken from
+        the snapshot when the file did not change.
 
-        return py_filename, pymtime
+        """
+        saved = None
+        if self.snapshot is not None:
+            saved = self.snapshot.get(py_filename)
+        self.modules_mtimes[modname] = key
+        if saved is not None and saved[0] == key:
+            if self.use_hash:
+                if saved[1] is not None:
+                    self.modules_hashes[modname] = saved[1]
+                else:
+                    self.content_changed(modname, py_filename)
+        elif not self.lazy or self.indexed or key[0] < self.started:
+            if saved is not None and not self.indexed:
+                self.count('changed_offline')
+            if self.use_hash:
+                self.content_changed(modname, py_filename)
+        else:
+            self.pending.add(modname)
+            if self.use_hash and saved is not None and saved[1] is not None:
+                self.modules_hashes[modname] = saved[1]
+
+    def save_snapshot(self):
+        """Save the change keys and hashes of the indexed modules to the
+        snapshot so the next run can use them."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return
+        mtimes, hashes = self.modules_mtimes, self.modules_hashes
+        for modname, py_filename in self.index.filenames.items():
+            key = mtimes.get(modname)
+            if key is not None:
+                snapshot.update(py_filename, key, hashes.get(modname))
+        snapshot.save()
+
+    def changed_modules(self):
+        """Return the names of modules whose files the watcher reported
+        as changed since the last check."""
+        modules = []
+        files = self.index.files
+        for path in self.watcher.changes():
+            for modname in files.get(path, ()):
+                if self.check_all or modname in self.modules:
+                    modules.append(modname)
+        return modules
 
     def check(self, check_all=False, do_reload=True):
-        """Check whether some modules need to be reloaded."""
+        """Check whether some modules need to be reloaded.
 
-        if not self.enabled and not check_all:
-            return
+        Returns the names of the modules that were reloaded.
 
-        if check_all or self.check_all:
-            modules = list(sys.modules.keys())
+        """
+
+        if not self.enabled and not check_all:
+            return []
+
+        self.summary = summary = SwapSummary()
+        start = perf_counter()
+        #: Files may have changed before the watcher watched them so the
+        #: first check looks at all of them
+        first = not self.indexed
+        if check_all or first:
+            self.update_index(*self.index.diff())
+            self.indexed = True
+
+        if self.watcher is not None and not check_all and not first:
+            modules = self.changed_modules()
+        elif check_all or self.check_all:
+            modules = list(self.index.filenames)
         else:
             modules = list(self.modules.keys())
 
+        changed = []
+        filenames = self.index.filenames
+        pending = self.pending
         for modname in modules:
 
-            m = sys.modules.get(modname, None)
             if modname in self.skip_modules:
                 continue
 
-            py_filename, pymtime = self.filename_and_mtime(m)
+            py_filename = filenames.get(modname)
             if py_filename is None:
-                continue
+                py_filename = self.index.get(modname)
+                if py_filename is None:
+                    continue
 
             try:
-                if pymtime <= self.modules_mtimes[modname]:
-                    continue
-            except KeyError:
-                self.modules_mtimes[modname] = pymtime
+                key = self.sources.change_key(py_filename)
+            except OSError:
                 continue
-            else:
-                if self.failed.get(py_filename, None) == pymtime:
-                    continue
 
-            self.modules_mtimes[modname] = pymtime
+            last = self.modules_mtimes.get(modname)
+            if last is None:
+                self.modules_mtimes[modname] = key
+                if self.use_hash:
+                    self.content_changed(modname, py_filename)
+                continue
+            if modname in pending:
+                #: Changed before it was indexed, the bytecode may be stale
+                last = key
+            elif key == last or self.failed.get(py_filename, None) == key:
+                continue
+
+            self.modules_mtimes[modname] = key
+            if key[0] // 1000000000 == last[0] // 1000000000:
+                self.stale_bytecode.add(modname)
+
+            if self.use_hash and not self.content_changed(modname,
+                                                          py_filename):
+                self.count('unchanged')
+                continue
 
             # If we've reached this point, we should try to reload the module
             if do_reload:
-                try:
-                    if self.debug:
-                        print("Reloading {}".format(m))
-                    superreload(m, reload, self.old_objects)
-                    if py_filename in self.failed:
-                        del self.failed[py_filename]
-                except:
-                    print("[autoreload of %s failed: %s]" % (
-                        modname, traceback.format_exc(10)))
-                    self.failed[py_filename] = pymtime
+                changed.append(modname)
+
+        pending.clear()
+        summary.add_time('check', perf_counter() - start)
+        summary.count('checked', len(modules))
+        reloaded = self.reload_modules(changed) if changed else []
+        if first and do_reload:
+            #: Later changes are saved when the reloader is closed
+            self.save_snapshot()
+        return reloaded
+
+    def content_changed(self, modname, py_filename):
+        """Update the cached hash of the module's source and return whether
+        it differs from the last one seen."""
+        try:
+            digest = source_hash(self.sources.read(py_filename))
+        except (IOError, OSError):
+            return True
+        last = self.modules_hashes.get(modname)
+        self.modules_hashes[modname] = digest
+        return digest != last
+
+    def count(self, key, n=1):
+        """Increment a counter in stats and the summary of the check"""
+        self.stats[key] = self.stats.get(key, 0) + n
+        self.summary.count(key, n)
+
+    def is_reloadable(self, modname):
+        """Check whether the named module may be reloaded"""
+        if modname in self.skip_modules:
+            return False
+        return self.check_all or modname in self.modules
+
+    def tracked_modules(self):
+        """Return the names of the modules whose imports are tracked by
+        the dependency graph, only reloadable modules can be affected.
+
+        Without a scope the stdlib and installed packages are left out
+        unless their modules were explicitly marked reloadable.
+
+        """
+        filenames = self.index.filenames
+        if self.scope is not None:
+            if self.check_all and not self.skip_modules:
+                return filenames
+            return {m for m in filenames if self.is_reloadable(m)}
+        modules = self.modules
+        return {m for m, f in filenames.items() if self.is_reloadable(m) and
+                (m in modules or not is_library(f))}
+
+    def reload_modules(self, modnames):
+        """Reload the given modules in dependency order. If
+        `reload_dependents` is set any modules importing them are reloaded
+        as well.
+
+        Returns the names of the modules that were reloaded.
+
+        """
+        summary = self.summary
+        graph = self.graph
+        with summary.timed('graph'):
+            if self.reload_dependents or len(modnames) > 1:
+                graph.refresh(self.tracked_modules())
+            if self.reload_dependents:
+                modnames = graph.affected(modnames, self.is_reloadable)
+            if len(modnames) > 1:
+                modnames = graph.order(modnames)
+
+        if 0 < self.bulk_compile <= len(modnames):
+            with summary.timed('compile'):
+                self.compile_modules(modnames)
+
+        start = perf_counter()
+        reloaded = []
+        for modname in modnames:
+            m = sys.modules.get(modname, None)
+            if m is None:
+                continue
+            py_filename = self.index.filenames.get(modname)
+            try:
+                if self.debug:
+                    print("Reloading {}".format(m))
+                self.reload_module(m)
+                self.count('reloaded')
+                reloaded.append(modname)
+                if py_filename in self.failed:
+                    del self.failed[py_filename]
+            except:
+                print("[autoreload of %s failed: %s]" % (
+                    modname, traceback.format_exc(10)))
+                self.failed[py_filename] = self.modules_mtimes.get(modname)
+                self.count('failed')
+            graph.invalidate(modname)
+        summary.add_time('reload', perf_counter() - start)
+        return reloaded
+
+    def compile_modules(self, modnames):
+        """Compile the sources of the modules in a process pool and store
+        the code in the code cache so they only have to be executed.
+
+        """
+        if self.code_cache is None:
+            self.code_cache = CodeCache()
+        filenames = [f for f in (self.index.filenames.get(m)
+                                 for m in modnames) if f is not None]
+        if self.compile_pool is None:
+            #: Forking a process that may be running threads, such as the
+            #: watcher or a gui, is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+            self.compile_pool = ProcessPoolExecutor(
+                self.max_workers or None,
+                mp_context=multiprocessing.get_context(method))
+        count = self.code_cache.compile_many(filenames, self.compile_pool)
+        self.count('compiled', count)
+
+    def start_precompiling(self, executor=None):
+        """Compile files in the background as soon as the watcher reports
+        them changed so a check only has to execute the module code.
+
+        Parameters
+        -----------
+        executor: concurrent.futures.Executor or None
+            Executor used to compile, by default a single worker thread
+
+        """
+        if self.watcher is None:
+            raise RuntimeError("Precompiling requires a watcher")
+        if self.code_cache is None:
+            self.code_cache = CodeCache()
+        if self.precompiler is None:
+            kwargs = {'executor': executor} if executor is not None else {}
+            self.precompiler = Precompiler(cache=self.code_cache,
+                                           source_exts=self.source_exts,
+                                           **kwargs)
+        self.watcher.start(self.precompiler.submit)
+
+    def stop_precompiling(self):
+        """Stop the watcher thread and wait for pending compiles"""
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.precompiler is not None:
+            self.precompiler.shutdown()
+            self.precompiler = None
+
+    def close(self):
+        """Stop precompiling, shut down the compile pool and save the
+        snapshot"""
+        if self.indexed:
+            self.save_snapshot()
+        self.stop_precompiling()
+        if self.compile_pool is not None:
+            self.compile_pool.shutdown()
+            self.compile_pool = None
+
+    def reload_module(self, module):
+        """Reload a single module with superreload.
+
+        If a code cache is set and the module was loaded from a source file
+        the code is taken from the cache, otherwise the module is imported
+        again. Modules whose bytecode may be stale are compiled from their
+        source.
+
+        """
+        cache = self.code_cache
+        filename = self.index.filenames.get(module.__name__)
+        from_source = module.__name__ in self.stale_bytecode
+        self.stale_bytecode.discard(module.__name__)
+        if ((cache is None and not from_source) or filename is None or
+                not self.sources.exists(filename) or
+                getattr(module, '__spec__', None) is None):
+            return superreload(module, reload, self.old_objects,
+                               self.summary, self.changed_globals)
+
+        #: Compile before clearing the module so a syntax error leaves it
+        #: untouched
+        if self.precompiler is not None:
+            self.precompiler.wait(filename)
+        source = self.sources.read(filename)
+        if cache is not None:
+            code = cache.get(filename, source)
+        else:
+            code = compile_source(source, filename)
+        return reload_code(module, code, self.old_objects, self.summary,
+                           self.changed_globals)
+
+
+#: Module attributes set by the import system that are kept when a module
+#: is reloaded from cached code
+MODULE_ATTRS = ('__file__', '__cached__', '__package__', '__path__',
+                '__spec__', '__loader__')
+
+
+def reload_code(module, code, old_objects=None, summary=None, changed=None):
+    """Reload a module by executing the given code object in it instead
+    of importing it again. The old objects are patched like superreload.
+
+    """
+    attrs = {k: module.__dict__[k] for k in MODULE_ATTRS
+             if k in module.__dict__}
+
+    def exec_module(module):
+        module.__dict__.update(attrs)
+        exec(code, module.__dict__)
+        return module
+
+    return superreload(module, exec_module, old_objects, summary, changed)
 
 #------------------------------------------------------------------------------
 # superreload
@@ -296,10 +728,12 @@ def update_function(old, new):
             pass
 
 
-def update_class(old, new):
+def update_class(old, new, skip=()):
     """Replace stuff in the __dict__ of a class, and upgrade
-    method code objects"""
+    method code objects. Any names in skip are left alone."""
     for key in list(old.__dict__.keys()):
+        if key in skip:
+            continue
         old_obj = getattr(old, key)
         try:
             new_obj = getattr(new, key)
@@ -353,6 +787,78 @@ def update_generic(a, b):
     return False
 
 
+class ObjectRegistry(Atom):
+    """ Weak references to the objects previously defined in modules,
+    grouped by (module-name, name).
+
+    Entries are removed as soon as the object they refer to is collected
+    and the same object is only stored once per key so the registry does
+    not grow with the number of reloads.
+
+    """
+    #: (module-name, name) -> {id(obj): weakref}
+    refs = Typed(dict, ())
+
+    #: Maximum number of objects kept per key, the oldest are dropped
+    #: first. Zero means no limit.
+    limit = Int()
+
+    def add(self, key, obj):
+        """ Add a weak reference to the object under the given key.
+
+        Raises
+        -------
+        TypeError:
+            If the object cannot be weakly referenced
+
+        """
+        entries = self.refs.get(key)
+        oid = id(obj)
+        if entries is not None:
+            ref = entries.get(oid)
+            if ref is not None and ref() is obj:
+                return
+        refs = self.refs
+
+        def discard(ref):
+            entries = refs.get(key)
+            if entries is not None and entries.get(oid) is ref:
+                del entries[oid]
+                if not entries:
+                    del refs[key]
+
+        ref = weakref.ref(obj, discard)
+        if entries is None:
+            entries = refs[key] = {}
+        entries[oid] = ref
+        if self.limit and len(entries) > self.limit:
+            del entries[next(iter(entries))]
+
+    def get(self, key):
+        """ Get the objects still alive under the key, oldest first """
+        entries = self.refs.get(key)
+        if not entries:
+            return []
+        return [obj for obj in (ref() for ref in list(entries.values()))
+                if obj is not None]
+
+    def __contains__(self, key):
+        return key in self.refs
+
+    def clear(self, modname=None):
+        """ Remove every entry or only those of the given module """
+        if modname is None:
+            self.refs.clear()
+            return
+        for key in [k for k in self.refs if k[0] == modname]:
+            del self.refs[key]
+
+    def stats(self):
+        """ Return the number of keys and objects in the registry """
+        return {'keys': len(self.refs),
+                'objects': sum(len(e) for e in self.refs.values())}
+
+
 class StrongRef(object):
     def __init__(self, obj):
         self.obj = obj
@@ -360,7 +866,18 @@ class StrongRef(object):
         return self.obj
 
 
-def superreload(module, reload=reload, old_objects={}):
+def value_changed(old, new):
+    """Check whether a global refers to a different value after a reload"""
+    if old is new:
+        return False
+    try:
+        return type(old) is not type(new) or not bool(old == new)
+    except Exception:
+        return True
+
+
+def superreload(module, reload=reload, old_objects=None, summary=None,
+                changed=None):
     """Enhanced version of the builtin reload function.
 
     superreload remembers objects previously in the module, and
@@ -369,7 +886,14 @@ def superreload(module, reload=reload, old_objects={}):
     - upgrades the code object of every old function and method
     - clears the module's namespace before reloading
 
+    old_objects is the ObjectRegistry used to track the previous objects.
+    If not given a registry shared by all calls is used. If a SwapSummary
+    is given the time spent executing the module and patching the old
+    objects is added to it.
+
     """
+    if old_objects is None:
+        old_objects = _old_objects
 
     # collect old objects in the module
     for name, obj in list(module.__dict__.items()):
@@ -377,14 +901,14 @@ def superreload(module, reload=reload, old_objects={}):
             continue
         key = (module.__name__, name)
         try:
-            old_objects.setdefault(key, []).append(weakref.ref(obj))
+            old_objects.add(key, obj)
         except TypeError:
             pass
 
     # reload module
+    old_dict = module.__dict__.copy()
     try:
         # clear namespace first from old cruft
-        old_dict = module.__dict__.copy()
         old_name = module.__name__
         module.__dict__.clear()
         module.__dict__['__name__'] = old_name
@@ -392,32 +916,44 @@ def superreload(module, reload=reload, old_objects={}):
     except (TypeError, AttributeError, KeyError):
         pass
 
+    start = perf_counter()
     try:
         module = reload(module)
     except:
         # restore module dictionary on failed reload
         module.__dict__.update(old_dict)
         raise
+    finally:
+        if summary is not None:
+            summary.add_time('exec', perf_counter() - start)
+
+    if changed is not None:
+        missing = object()
+        for name, new_obj in module.__dict__.items():
+            if value_changed(old_dict.get(name, missing), new_obj):
+                changed.add(name)
 
     # iterate over all objects and update functions & classes
+    start = perf_counter()
+    patched = 0
     for name, new_obj in list(module.__dict__.items()):
         key = (module.__name__, name)
         if key not in old_objects: continue
 
-        new_refs = []
-        for old_ref in old_objects[key]:
-            old_obj = old_ref()
-            if old_obj is None: continue
-            new_refs.append(old_ref)
-            update_generic(old_obj, new_obj)
-
-        if new_refs:
-            old_objects[key] = new_refs
-        else:
-            del old_objects[key]
+        for old_obj in old_objects.get(key):
+            if old_obj is not new_obj:
+                update_generic(old_obj, new_obj)
+                patched += 1
 
+    if summary is not None:
+        summary.add_time('patch', perf_counter() - start)
+        summary.count('patched', patched)
     return module
 
+
+#: Registry used by superreload when none is given
+_old_objects = ObjectRegistry()
+
 #------------------------------------------------------------------------------
 # IPython connectivity
 #------------------------------------------------------------------------------
@@ -537,13 +1073,13 @@ class Autoreloader(Atom):
     def post_execute(self):
         """Cache the modification times of any modules imported in this execution
         """
-        newly_loaded_modules = set(sys.modules) - self.loaded_modules
-        for modname in newly_loaded_modules:
-            _, pymtime = self._reloader.filename_and_mtime(sys.modules[modname])
-            if pymtime is not None:
-                self._reloader.modules_mtimes[modname] = pymtime
+        current_modules = set(sys.modules)
+        newly_loaded_modules = current_modules - self.loaded_modules
+        removed_modules = self.loaded_modules - current_modules
+        self._reloader.update_index(newly_loaded_modules, removed_modules)
 
         self.loaded_modules.update(newly_loaded_modules)
+        self.loaded_modules.difference_update(removed_modules)
 
 
 
@@ -0,0 +1,291 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Compile module sources and cache the result by content.
+
+'''
+import io
+import os
+import sys
+import hashlib
+import marshal
+import tempfile
+import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from tokenize import detect_encoding
+from atom.api import Atom, Dict, Int, List, Str, Typed
+
+
+def cache_tag(filename):
+    """ Get a tag identifying the compiler used for the file. Code compiled
+    by another compiler version must not be reused.
+
+    """
+    if filename.endswith('.enaml'):
+        from enaml.core.import_hooks import MAGIC_TAG
+        return MAGIC_TAG
+    return sys.implementation.cache_tag
+
+
+def compile_source(source, filename):
+    """ Compile the source of a `.py` or `.enaml` file.
+
+    This is a top level function so it can be used from a process pool.
+
+    Parameters
+    -----------
+    source: bytes
+        The source to compile
+    filename: str
+        The filename of the source, it's used in tracebacks
+
+    Returns
+    -------
+    code: CodeType
+        The module code object
+
+    """
+    if filename.endswith('.enaml'):
+        from enaml.core.parser import parse
+        from enaml.core.enaml_compiler import EnamlCompiler
+        if isinstance(source, bytes):
+            #: Decode with universal newlines like the enaml importer
+            encoding, _ = detect_encoding(io.BytesIO(source).readline)
+            source = io.TextIOWrapper(io.BytesIO(source), encoding).read()
+        return EnamlCompiler.compile(parse(source, filename), filename)
+    return compile(source, filename, 'exec', dont_inherit=True)
+
+
+def compile_marshalled(source, filename):
+    """ Compile the source and return the marshalled code. Code objects
+    cannot be pickled so this is what's sent back from a process pool.
+
+    """
+    return marshal.dumps(compile_source(source, filename))
+
+
+def source_key(source, filename):
+    """ Get the key of the compiled code for a source. The filename is
+    included since it's stored in the code object.
+
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(cache_tag(filename).encode())
+    h.update(filename.encode())
+    h.update(b'\0')
+    h.update(source)
+    return h.hexdigest()
+
+
+class CodeCache(Atom):
+    """ A cache of compiled code keyed by a hash of the source.
+
+    Reverting an edit or switching between branches reuses the code that
+    was already compiled instead of parsing the source again. When a
+    directory is given the marshalled code is also stored there so it can
+    be shared between processes.
+
+    """
+    #: Directory to store the marshalled code in, if empty the code is only
+    #: cached in memory
+    directory = Str()
+
+    #: Maximum number of code objects kept in memory. Zero means no limit.
+    limit = Int(256)
+
+    #: Key -> code object
+    codes = Typed(dict, ())
+
+    #: Number of times code was found in the cache
+    hits = Int()
+
+    #: Number of times code had to be compiled
+    misses = Int()
+
+    def path(self, key):
+        """ Get the path the code for the key is stored at """
+        return os.path.join(self.directory, key + '.code')
+
+    def load(self, key):
+        """ Load code from memory or the directory or return None """
+        code = self.codes.get(key)
+        if code is not None or not self.directory:
+            return code
+        try:
+            with open(self.path(key), 'rb') as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        self.store(key, code, save=False)
+        return code
+
+    def store(self, key, code, save=True):
+        """ Add the code to the cache and save it in the directory """
+        codes = self.codes
+        codes[key] = code
+        if self.limit and len(codes) > self.limit:
+            del codes[next(iter(codes))]
+        if not (save and self.directory):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            #: Write a temporary file first so other processes never read
+            #: partially written code
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(tmp, self.path(key))
+        except OSError:
+            pass
+
+    def get(self, filename, source=None):
+        """ Get the compiled code for a source file.
+
+        Parameters
+        -----------
+        filename: str
+            The path of the source file
+        source: bytes or None
+            The source, if None it's read from the file
+
+        Returns
+        -------
+        code: CodeType
+            The module code object
+
+        Raises
+        -------
+        SyntaxError:
+            If the source cannot be compiled
+
+        """
+        if source is None:
+            with open(filename, 'rb') as f:
+                source = f.read()
+        key = source_key(source, filename)
+        code = self.load(key)
+        if code is not None:
+            self.hits += 1
+            return code
+        self.misses += 1
+        code = compile_source(source, filename)
+        self.store(key, code)
+        return code
+
+    def compile_many(self, filenames, executor):
+        """ Compile any of the files that are not cached yet in parallel.
+
+        Files that fail to compile are skipped, the error is raised again
+        when the code is requested with `get`.
+
+        Parameters
+        -----------
+        filenames: iterable
+            Paths of the source files
+        executor: concurrent.futures.Executor
+            Executor to compile with, such as a ProcessPoolExecutor
+
+        Returns
+        -------
+        count: int
+            Number of files that were compiled
+
+        """
+        futures = []
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as f:
+                    source = f.read()
+            except OSError:
+                continue
+            key = source_key(source, filename)
+            if self.load(key) is not None:
+                continue
+            futures.append((key, executor.submit(compile_marshalled,
+                                                 source, filename)))
+        count = 0
+        for key, future in futures:
+            try:
+                code = marshal.loads(future.result())
+            except Exception:
+                continue
+            self.store(key, code)
+            count += 1
+        return count
+
+    def clear(self):
+        """ Remove all code cached in memory """
+        self.codes.clear()
+
+
+class Precompiler(Atom):
+    """ Compiles changed sources into a code cache in the background so
+    the reload only has to execute the module code.
+
+    Errors are printed as soon as the source is compiled and kept in
+    `errors` until the file compiles again.
+
+    """
+    #: The cache compiled code is stored in
+    cache = Typed(CodeCache, ())
+
+    #: Source extension types to compile
+    source_exts = List(default=['.py', '.enaml'])
+
+    #: Executor used to compile the sources
+    executor = Typed(Executor)
+
+    #: Filename -> Future of compiles that were submitted
+    futures = Dict()
+
+    #: Filename -> exception raised when compiling it
+    errors = Dict()
+
+    def _default_executor(self):
+        return ThreadPoolExecutor(max_workers=1,
+                                  thread_name_prefix='hotswap-compile')
+
+    def submit(self, filenames):
+        """ Compile the given files in the background.
+
+        Parameters
+        -----------
+        filenames: iterable
+            Paths of the changed files, any without a source extension
+            are ignored.
+
+        """
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in self.source_exts:
+                continue
+            self.futures[filename] = self.executor.submit(
+                self.compile, filename)
+
+    def compile(self, filename):
+        """ Compile the file into the cache, reporting any errors """
+        try:
+            code = self.cache.get(filename)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.errors[filename] = e
+            print("[hotswap compile of %s failed: %s]" % (
+                filename, traceback.format_exc(0)))
+            return None
+        self.errors.pop(filename, None)
+        return code
+
+    def wait(self, filename):
+        """ Wait for a pending compile of the file to finish """
+        future = self.futures.pop(filename, None)
+        if future is not None:
+            future.result()
+
+    def shutdown(self):
+        """ Stop the executor, waiting for pending compiles """
+        self.executor.shutdown(wait=True)
+        self.futures.clear()
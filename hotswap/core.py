@@ -9,13 +9,35 @@ Created on Sept 10, 2017
 
 @author: jrm
 '''
+import sys
 import enaml
-from atom.api import AtomMeta, Bool, set_default
+import traceback
+from atom.api import (
+    Atom, AtomMeta, Bool, Event, Float, Int, List, Member, Str, Typed,
+    set_default
+)
+from atom.datastructures.api import sortedmap
+from enaml.core.compiler_nodes import DeclarativeNode, new_scope, peek_scope
 from enaml.core.declarative import Declarative
+from enaml.core.looper import Looper
+from enaml.core.pattern import Pattern
+from bisect import bisect_left
+from collections import defaultdict, deque
 from contextlib import contextmanager
+from time import perf_counter, time_ns
+from types import CodeType, ModuleType
 
 from . import autoreload
 from .autoreload import isinstance2
+from .compiler import CodeCache
+from .migrate import (
+    InstanceMigrator, is_reshaped, layout_changes, member_layout,
+    record_layout_change
+)
+from .scope import Scope
+from .snapshot import Snapshot
+from .summary import SwapSummary
+from .watcher import ChangeBatcher, create_watcher
 
 
 class EnamlReloader(autoreload.ModuleReloader):
@@ -35,7 +57,8 @@ class EnamlReloader(autoreload.ModuleReloader):
     def check(self, check_all=False, do_reload=True):
         """Check whether some modules need to be reloaded."""
         with enaml.imports():
-            super(EnamlReloader, self).check(check_all=check_all, do_reload=do_reload)
+            return super(EnamlReloader, self).check(check_all=check_all,
+                                                    do_reload=do_reload)
 
 
 def update_atom_members(old, new):
@@ -70,13 +93,576 @@ def update_atom_members(old, new):
             pass  # skip non-writable attributes
 
 
+#: Names of the functions and attributes that changed on reloaded classes
+#: since the last update. Expressions using them are re-evaluated.
+changed_attributes = set()
+
+
+def attribute_signature(obj):
+    """ Get a comparable signature of a class attribute. Functions are
+    compared by their code and atom members by their type since their
+    values are set by bindings.
+
+    """
+    func = getattr(obj, '_d_func', None) or getattr(obj, '__func__', obj)
+    code = getattr(func, '__code__', None)
+    if isinstance(code, CodeType):
+        return ('code', code_signature(code))
+    if isinstance(obj, property):
+        return ('property',) + tuple(attribute_signature(f) for f in (
+            obj.fget, obj.fset, obj.fdel))
+    if isinstance(obj, Member):
+        return ('member', type(obj))
+    return ('value', obj)
+
+
+def record_changed_attributes(old, new):
+    """ Record the names of the attributes of a reloaded class whose value
+    changed, ignoring the ones set by python such as `__module__`.
+
+    """
+    missing = object()
+    for key in set(old.__dict__).union(new.__dict__):
+        if key.startswith('__') and key.endswith('__'):
+            continue
+        a = old.__dict__.get(key, missing)
+        b = new.__dict__.get(key, missing)
+        if a is b:
+            continue
+        try:
+            if attribute_signature(a) == attribute_signature(b):
+                continue
+        except Exception:
+            pass
+        changed_attributes.add(key)
+
+
 def update_class_by_type(old, new):
-    """ Update declarative classes or fallback on default """
-    autoreload.update_class(old, new)
-    if isinstance2(old, new, AtomMeta):
+    """ Update declarative classes or fallback on default.
+
+    If the members of an atom class changed the members of the old class
+    are left as is since existing instances cannot use the new layout.
+    The change is recorded so the instances can be migrated. The names of
+    changed functions and attributes are recorded so expressions using
+    them are re-evaluated.
+
+    """
+    record_changed_attributes(old, new)
+    if not isinstance2(old, new, AtomMeta):
+        autoreload.update_class(old, new)
+    elif member_layout(old) != member_layout(new):
+        skip = set(old.members())
+        skip.update(('__atom_members__', '__atom_specific_members__'))
+        autoreload.update_class(old, new, skip)
+        record_layout_change(old, new)
+    else:
+        autoreload.update_class(old, new)
         update_atom_members(old, new)
 
 
+def child_identifiers(children):
+    """ Map the id of each child to the identifier it was declared with
+    (ex `Label: label:`) using the local scopes stored on the children.
+
+    """
+    identifiers = {}
+    seen = set()
+    for child in children:
+        storage = child._d_storage
+        if not storage:
+            continue
+        for scope in storage.values():
+            if not isinstance(scope, sortedmap) or id(scope) in seen:
+                continue
+            seen.add(id(scope))
+            for name, obj in scope.items():
+                identifiers[id(obj)] = name
+    return identifiers
+
+
+def child_key(child, identifiers):
+    """ Get the (key, class name) used to match a child. The key is None if
+    the child has no name or identifier.
+
+    """
+    cls = class_key(child.__class__)
+    name = child.name or identifiers.get(id(child))
+    return ((cls, name) if name else None, cls)
+
+
+def class_key(cls):
+    """ Get the class name used to match children. Instances of classes
+    whose members changed and were not migrated never match so they are
+    replaced.
+
+    """
+    if is_reshaped(cls):
+        return (cls.__name__, id(cls))
+    return cls.__name__
+
+
+def longest_increasing_subsequence(seq):
+    """ Find the indexes of a longest strictly increasing subsequence of
+    seq in O(n log n).
+
+    """
+    tails = []
+    tail_indexes = []
+    previous = []
+    for i, value in enumerate(seq):
+        j = bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[j] = value
+            tail_indexes[j] = i
+        previous.append(tail_indexes[j-1] if j else None)
+
+    result = set()
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+
+def code_signature(code):
+    """ Get a hashable signature of a code object that ignores line
+    numbers, so moving an unchanged block within a file does not change it.
+
+    """
+    consts = tuple(code_signature(c) if isinstance(c, CodeType) else
+                   (type(c), c) for c in code.co_consts)
+    return (code.co_code, code.co_names, code.co_varnames,
+            code.co_freevars, code.co_cellvars, consts)
+
+
+def code_names(code):
+    """ Get all names used by a code object and any nested code objects """
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, CodeType):
+            names.update(code_names(c))
+    return names
+
+
+def binding_signatures(engine, cache):
+    """ Get a mapping of the bound attribute name to the signature of its
+    handlers and the names its code uses. Results are cached per engine.
+
+    """
+    key = ('bindings', id(engine))
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        return entry[1]
+    result = {}
+    if engine:
+        for name, handler in engine._handlers.items():
+            signature = []
+            names = set()
+            for pair in handler.all_pairs:
+                for h in (pair.reader, pair.writer):
+                    if h is None:
+                        continue
+                    func = getattr(h, 'func', None)
+                    if func is None:
+                        #: Cannot compare so it's always considered changed
+                        signature.append(object())
+                        continue
+                    signature.append((type(h).__name__,
+                                      code_signature(func.__code__)))
+                    names.update(code_names(func.__code__))
+            result[name] = (tuple(signature), names)
+    if cache is not None:
+        cache[key] = (engine, result)
+    return result
+
+
+def changed_bindings(previous, engine, stale, cache=None):
+    """ Find the bound attributes of engine that need to be re-evaluated.
+
+    An attribute needs to be re-evaluated if its handlers changed, it is
+    new, or its code uses an attribute or scope name that changed.
+
+    Parameters
+    -----------
+    previous: ExpressionEngine or None
+        The engine the node used before
+    engine: ExpressionEngine
+        The new engine
+    stale: iterable
+        Names in the local scope that now refer to different objects
+    cache: dict or None
+        Cache of binding signatures
+
+    Returns
+    -------
+    names: list
+        The attribute names in the order of the engine handlers
+
+    """
+    new = binding_signatures(engine, cache)
+    if previous is engine:
+        old = {}
+        changed = set()
+    else:
+        old = binding_signatures(previous, cache)
+        changed = {k for k, (sig, names) in new.items()
+                   if k not in old or old[k][0] != sig}
+
+    #: Add anything depending on a changed name until nothing else changes
+    dirty = changed.union(stale)
+    while dirty:
+        dirty = {k for k, (sig, names) in new.items()
+                 if k not in changed and not names.isdisjoint(dirty)}
+        changed.update(dirty)
+    return [k for k in new if k in changed]
+
+
+def scope_names(storage):
+    """ Map the identifiers of the local scopes in a node's storage to the
+    objects they refer to.
+
+    """
+    names = {}
+    for scope in storage.values():
+        if isinstance(scope, sortedmap):
+            names.update(scope.items())
+    return names
+
+
+def changed_identifiers(previous, storage, replaced=()):
+    """ Get the identifiers that refer to a different object in the local
+    scopes of storage than in the previous storage, or to an object whose
+    id is in replaced.
+
+    """
+    old = scope_names(previous)
+    return {k for k, v in scope_names(storage).items()
+            if old.get(k) is not v or id(v) in replaced}
+
+
+def engine_signature(engine):
+    """ Get a hashable signature of the code objects in an expression
+    engine or None if it contains handlers that cannot be compared.
+
+    """
+    if not engine:
+        return ()
+    signature = []
+    for name, handler in engine._handlers.items():
+        for pair in handler.all_pairs:
+            for h in (pair.reader, pair.writer):
+                if h is None:
+                    continue
+                func = getattr(h, 'func', None)
+                if func is None:
+                    return None
+                signature.append((name, type(h).__name__,
+                                  code_signature(func.__code__)))
+    return tuple(signature)
+
+
+def class_signature(cls, cache):
+    """ Get a signature of a declarative class and its member layout """
+    signature = cache.get(cls)
+    if signature is None:
+        signature = cache[cls] = (cls.__module__, cls.__qualname__,
+                                  tuple(sorted(cls.members())))
+    return signature
+
+
+def uses_names(engine, names, cache):
+    """ Check whether any bound expression of the engine uses one of the
+    names.
+
+    """
+    if not names:
+        return False
+    for signature, used in binding_signatures(engine, cache).values():
+        if not used.isdisjoint(names):
+            return True
+    return False
+
+
+def reloaded_names(modnames):
+    """ Get the global names in the given modules that refer to a module,
+    class or function defined by one of them. These may behave differently
+    after a reload so expressions using them have to be re-evaluated.
+
+    """
+    modnames = set(modnames)
+    names = set()
+    for modname in modnames:
+        module = sys.modules.get(modname)
+        if module is None:
+            continue
+        for name, obj in list(module.__dict__.items()):
+            if isinstance(obj, ModuleType):
+                defined = obj.__name__
+            else:
+                defined = getattr(obj, '__module__', None)
+            if defined in modnames:
+                names.add(name)
+    return names
+
+
+def cached_engine_signature(engine, cache, stale=()):
+    """ Get the engine signature using the cache. Engines are shared between
+    all instances of the same compiled node. Engines using any of the stale
+    names get a signature that never compares equal.
+
+    """
+    entry = cache.get(id(engine))
+    if entry is None:
+        signature = engine_signature(engine)
+        if signature is None or uses_names(engine, stale, cache):
+            signature = object()
+        #: Keep a reference to the engine so the id is not reused
+        entry = cache[id(engine)] = (engine, signature)
+    return entry[1]
+
+
+def fingerprint(node, cache, stale=()):
+    """ Compute a structural fingerprint of a declarative subtree.
+
+    The fingerprint is derived from the class and member layout of each
+    node and the compiled code of its bound expressions, so two subtrees
+    built from the same enamldef source have the same fingerprint.
+
+    Parameters
+    -----------
+    node: Declarative
+        The root of the subtree
+    cache: dict
+        Cache of previously computed results. Engines and classes are
+        shared between nodes so these are cached as well.
+    stale: set
+        Global names that changed. Subtrees with expressions using them
+        never compare equal.
+
+    Returns
+    -------
+    result: object
+        A hashable fingerprint. Nodes that cannot be compared get a
+        unique object that never compares equal.
+
+    """
+    key = id(node)
+    result = cache.get(key)
+    if result is not None:
+        return result[1]
+
+    children = tuple(fingerprint(c, cache, stale) for c in node.children
+                     if isinstance(c, Declarative))
+    try:
+        result = hash((class_signature(type(node), cache),
+                       cached_engine_signature(node._d_engine, cache, stale),
+                       children))
+    except TypeError:
+        result = object()
+
+    #: Keep a reference to the node so the id is not reused
+    cache[key] = (node, result)
+    return result
+
+
+def node_chain(node):
+    """ Get the compiler node along with the nodes of the enamldefs it
+    inherits from, in the order they populate an instance (base first).
+
+    """
+    chain = []
+    while node is not None:
+        chain.append(node)
+        node = node.super_node
+    chain.reverse()
+    return chain
+
+
+def is_static_chain(chain):
+    """ Check whether the children created by the nodes can be determined
+    from the compiler nodes alone. Templates, patterns (which intercept
+    their children), and closures are only known once instantiated.
+
+    """
+    for node in chain:
+        if node.child_intercept or node.closure_keys is not None:
+            return False
+        for child in node.children:
+            if not isinstance(child, DeclarativeNode):
+                return False
+    return True
+
+
+def node_fingerprint(node, cache, stale=()):
+    """ Compute the fingerprint the subtree created by a compiler node would
+    have (see `fingerprint`) without creating it.
+
+    """
+    key = id(node)
+    result = cache.get(key)
+    if result is not None:
+        return result[1]
+
+    chain = node_chain(node)
+    if not is_static_chain(chain):
+        result = object()
+    else:
+        engine = None
+        for n in chain:
+            if n.engine is not None:
+                engine = n.engine
+        children = tuple(node_fingerprint(c, cache, stale)
+                         for n in chain for c in n.children)
+        try:
+            result = hash((class_signature(node.klass, cache),
+                           cached_engine_signature(engine, cache, stale),
+                           children))
+        except TypeError:
+            result = object()
+
+    cache[key] = (node, result)
+    return result
+
+
+def node_uses_names(node, names, cache):
+    """ Check whether any bound expression of the subtree created by a
+    compiler node uses one of the names.
+
+    """
+    for n in node_chain(node):
+        if n.engine is not None and uses_names(n.engine, names, cache):
+            return True
+        for child in n.children:
+            if node_uses_names(child, names, cache):
+                return True
+    return False
+
+
+def register_identifiers(old, node, f_locals):
+    """ Add the instances of an unchanged subtree to the local scope of the
+    block using the identifiers of the compiler nodes.
+
+    """
+    if node.identifier:
+        f_locals[node.identifier] = old
+    children = old.children
+    offset = len(children) - len(node.children)
+    for child, child_node in zip(children[offset:], node.children):
+        register_identifiers(child, child_node, f_locals)
+
+
+class DeferredUpdates(Atom):
+    """ Updates collected while walking the compiler nodes which must wait
+    until the local scopes are complete.
+
+    """
+    #: (old, new) instances for nodes that had to be created to be diffed
+    replaced = List()
+
+    #: (parent, old children, target children) to arrange
+    arranged = List()
+
+    #: (old, engine, previous storage) expression engines to apply, with
+    #: parents before their children
+    engines = List()
+
+    #: Patterns whose items are recreated from their new nodes
+    refreshed = List()
+
+    #: (old, node, local scope) of subtrees skipped as unchanged
+    skipped = List()
+
+
+def match_keys(old_children, old_keys, new_keys, old_print=None,
+               new_print=None):
+    """ Match up old children with new items using their keys.
+
+    Items are matched by key first. Unnamed items are then matched to old
+    children of the same class with the same subtree fingerprint so moved
+    blocks are reused as is, and finally by class in the order they appear.
+    Lookups use hash maps so this is linear in the number of children.
+
+    Parameters
+    -----------
+    old_children: list
+        The existing children
+    old_keys: list
+        A (key, class name) tuple for each old child. The key may be None.
+    new_keys: list
+        A (key, class name) tuple for each new item. The key may be None.
+    old_print: callable or None
+        Returns the fingerprint of an old child. If None unnamed items are
+        only matched by position.
+    new_print: callable or None
+        Returns the fingerprint of the new item at the given index.
+
+    Returns
+    -------
+    result: tuple
+        A tuple of (matches, removed) where matches is a list with the
+        matching old child (or None) for each new item and removed
+        is a list of old children that were not matched.
+
+    """
+    #: Group old children by key and class
+    keyed = {}
+    by_class = defaultdict(deque)
+    for c, (key, name) in zip(old_children, old_keys):
+        if key is None:
+            by_class[name].append(c)
+        else:
+            keyed.setdefault(key, deque()).append(c)
+
+    #: Match on keys first
+    matches = []
+    unmatched = []
+    for i, (key, name) in enumerate(new_keys):
+        candidates = keyed.get(key) if key is not None else None
+        if candidates:
+            matches.append(candidates.popleft())
+        else:
+            matches.append(None)
+            unmatched.append(i)
+
+    #: Then by class, including old children whose key was removed or
+    #: renamed
+    for candidates in keyed.values():
+        for c in candidates:
+            by_class[class_key(c.__class__)].append(c)
+
+    #: Unchanged subtrees by their fingerprint
+    taken = set()
+    if old_print is not None and unmatched:
+        by_print = {}
+        for name in {new_keys[i][1] for i in unmatched}:
+            for c in by_class.get(name, ()):
+                by_print.setdefault((name, old_print(c)), deque()).append(c)
+        rest = []
+        for i in unmatched:
+            candidates = by_print.get((new_keys[i][1], new_print(i)))
+            if candidates:
+                matches[i] = candidates.popleft()
+                taken.add(id(matches[i]))
+            else:
+                rest.append(i)
+        unmatched = rest
+
+    #: And the rest by position
+    for i in unmatched:
+        candidates = by_class.get(new_keys[i][1])
+        while candidates and id(candidates[0]) in taken:
+            candidates.popleft()
+        if candidates:
+            matches[i] = candidates.popleft()
+
+    used = {id(c) for c in matches if c is not None}
+    removed = [c for c in old_children if id(c) not in used]
+    return matches, removed
+
+
 #: Add new rules for enaml
 autoreload.UPDATE_RULES[0] = (lambda a, b: isinstance2(a, b, type), update_class_by_type)
 
@@ -105,14 +691,119 @@ class Hotswapper(autoreload.Autoreloader):
     #: Print debug statements
     debug = Bool()
 
+    #: Use a file watcher (inotify when available) so checks only look at
+    #: modules whose files changed instead of stat'ing every module
+    watch = Bool()
+
+    #: Skip updating subtrees whose fingerprint did not change
+    skip_unchanged = Bool(True)
+
+    #: Skip reloading files whose contents did not change (ex. when only
+    #: touched or saved without modifications)
+    use_hash = Bool()
+
+    #: Cache of compiled code so reverted or previously seen sources are
+    #: not parsed and compiled again
+    code_cache = Typed(CodeCache)
+
+    #: Only check modules in the scope, ex. the app's own packages
+    scope = Typed(Scope)
+
+    #: Change keys and hashes saved by the previous run so startup does
+    #: not stat every loaded module
+    snapshot = Typed(Snapshot)
+
+    #: Create the reloader and scan the modules on the first check (ex. by
+    #: `poll` or `active`) instead of when created. Files changed in
+    #: between are still reloaded.
+    lazy = Bool()
+
+    #: Collect changes until none were seen for this many seconds and
+    #: reload them as one batch. This uses a watcher even if watch is not
+    #: enabled.
+    debounce = Float()
+
+    #: Compile changed files in a background thread as soon as they are
+    #: saved. This requires watch to be enabled.
+    precompile = Bool()
+
+    #: Compile changed files in a process pool when at least this many
+    #: are reloaded at once, such as after switching branches
+    bulk_compile = Int()
+
+    #: Migrate live instances of classes that gained or lost members to
+    #: the reloaded class instead of re-creating them
+    migrate_instances = Bool()
+
+    #: Migrates instances when migrate_instances is enabled
+    migrator = Typed(InstanceMigrator, ())
+
+    #: Timings and counts of the last update
+    summary = Typed(SwapSummary, ())
+
+    #: Sent with the SwapSummary after every update
+    swapped = Event(SwapSummary)
+
+    #: Errors raised while re-evaluating expressions during the last update
+    #: as (node, name, exception) tuples
+    errors = List()
+
+    #: Fingerprint and signature cache used during an update
+    _cache = Typed(dict)
+
+    #: Ids of the instances created by migrating during an update
+    _replaced = Typed(set, ())
+
+    #: (old, new) subtrees skipped as unchanged when diffing instances
+    _skipped = Typed(list, ())
+
+    #: Ids of the new children inserted when diffing instances
+    _inserted = Typed(set, ())
+
+    #: Names of the modules reloaded since the last update
+    _reloaded = Typed(set, ())
+
+    #: Global names referring to objects of the reloaded modules or whose
+    #: value changed in a reload and names of changed class attributes,
+    #: used during an update
+    _stale_globals = Typed(set, ())
+
+    #: Autoreload mode applied when the reloader is created if lazy
+    _mode = Str()
+
+    #: Time the hotswapper was created in ns
+    _started = Int()
+
     def _default__reloader(self):
         #: Initial check
-        return EnamlReloader(check_all=False, debug=self.debug)
+        watcher = create_watcher() if self.watch or self.debounce else None
+        if self.debounce:
+            watcher = ChangeBatcher(watcher=watcher, quiet=self.debounce)
+        reloader = EnamlReloader(check_all=False, debug=self.debug,
+                                 watcher=watcher, use_hash=self.use_hash,
+                                 code_cache=self.code_cache,
+                                 bulk_compile=self.bulk_compile,
+                                 snapshot=self.snapshot, lazy=self.lazy,
+                                 scope=self.scope,
+                                 started=self._started)
+        if self.lazy:
+            reloader.enabled = self._mode != '0'
+            reloader.check_all = self._mode == '2'
+        if self.precompile and watcher is not None:
+            reloader.start_precompiling()
+        return reloader
+
+    def __init__(self, mode='2', **kwargs):
+        """ Initialize the reloader then configure autoreload right away,
+        or when the reloader is created if lazy.
 
-    def __init__(self, mode='2'):
-        """ Initialize the reloader then configure autoreload right away"""
-        super(Hotswapper, self).__init__()
-        self.autoreload(mode)
+        """
+        super(Hotswapper, self).__init__(**kwargs)
+        self._started = time_ns()
+        if self.lazy:
+            self._mode = mode
+        else:
+            self.autoreload(mode)
 
     @contextmanager
     def active(self):
@@ -120,7 +811,53 @@ class Hotswapper(autoreload.Autoreloader):
         yield
         self.post_execute()
 
-    def update(self, old, new=None):
+    def pre_run_cell(self):
+        if self._reloader.enabled:
+            try:
+                self._reloaded.update(self._reloader.check())
+            except:
+                pass
+
+    def poll(self, view):
+        """ Reload any changed modules and update the view if something was
+        reloaded. This can be called from a timer, with debounce enabled
+        each batch of changes results in a single reload and update.
+
+        Parameters
+        -----------
+        view: Declarative
+            The view to update
+
+        Returns
+        -------
+        reloaded: list
+            The names of the modules that were reloaded
+
+        """
+        reloaded = []
+        if self._reloader.enabled:
+            reloaded = self._reloader.check()
+            self._reloaded.update(reloaded)
+        self.post_execute()
+        if reloaded:
+            summary = SwapSummary()
+            summary.merge(self._reloader.summary)
+            self.update(view, summary=summary)
+        return reloaded
+
+    def close(self):
+        """ Stop precompiling, shut down the compile pool and close the
+        watcher. A reloader that was not created yet is left alone.
+
+        """
+        reloader = Hotswapper._reloader.get_slot(self)
+        if reloader is None:
+            return
+        reloader.close()
+        if reloader.watcher is not None:
+            reloader.watcher.close()
+
+    def update(self, old, new=None, summary=None):
         """ Update given view declaration with new declaration
 
         Parameters
@@ -129,49 +866,563 @@ class Hotswapper(autoreload.Autoreloader):
             The existing view instance that needs to be updated
         new: Declarative or None
             The new or reloaded view instance to that will be used to update the
-            existing view. If none is given, one of the same type as old will be
-            created and initialized with no attributes passed.
+            existing view. If none is given, the view is updated from the
+            compiled enamldef of its class and only nodes that need to be
+            inserted are created. Views that are not an enamldef fall back to
+            creating and initializing a new instance of the same type.
+        summary: SwapSummary or None
+            Summary to record the timings and counts of the update into,
+            for example one holding the timings of the reload.
+
+        Returns
+        -------
+        summary: SwapSummary
+            The timings and counts of the update. This is also sent with
+            the `swapped` event. Its `view` is the updated view, which is a
+            new instance if the view itself was migrated.
 
         """
+        if summary is None:
+            summary = SwapSummary()
+        self.summary = summary
+        start = perf_counter()
 
-        #: Create and initialize
-        if not new:
-            new = type(old)()
-            if not new.is_initialized:
-                 new.initialize()
+        #: Removed children are destroyed once the whole tree is updated
+        removed = []
+        self.errors = []
+        self._cache = {}
+        self._stale_globals = reloaded_names(self._reloaded)
+        if self._reloaded:
+            #: Constants and other values that changed
+            self._stale_globals.update(self._reloader.changed_globals)
+            self._reloader.changed_globals.clear()
+        self._reloaded = set()
+        # Functions and attributes changed on reloaded classes
+        self._stale_globals.update(changed_attributes)
+        changed_attributes.clear()
+        if self.migrate_instances and layout_changes:
+            with summary.timed('migrate'):
+                migrated = self.migrator.migrate()
+            old = migrated.get(old, old)
+            self._replaced = {id(c) for c in migrated.values()}
+            summary.count('migrated', len(migrated))
+        summary.view = old
+        try:
+            node = getattr(type(old), '__node__', None) if new is None else None
+            if is_reshaped(type(old)):
+                #: Unlike its children the view cannot be re-created
+                e = AttributeError("the members of %s changed, re-create "
+                                   "the view or enable migrate_instances" %
+                                   type(old).__name__)
+                self.errors.append((old, None, e))
+                print("[hotswap update of %s failed: %s]" % (old, e))
+            elif node is not None and is_static_chain(node_chain(node)):
+                self.update_from_node(old, node, removed)
+            else:
+                #: Create and initialize
+                with summary.timed('create'):
+                    if new is None:
+                        new = type(old)()
+                    if not new.is_initialized:
+                        new.initialize()
+                with summary.timed('diff'):
+                    self.update_node(old, new, removed)
+            self.revisit_skipped_instances(removed)
+        finally:
+            self._cache = None
+            self._replaced = set()
+            self._skipped = []
+            self._inserted = set()
+            self._stale_globals = set()
+        with summary.timed('destroy'):
+            self.destroy_children(removed)
+        summary.add_time('update', perf_counter() - start)
+        summary.count('errors', len(self.errors))
+        self.swapped(summary)
+        return summary
 
+    def update_from_node(self, old, node, removed):
+        """ Update a view from the compiled enamldef node of its class.
+
+        Instead of creating a complete new view to diff against, the
+        compiler nodes are walked alongside the existing view. Existing
+        instances are reused, new local scopes are built from them, and only
+        nodes that need to be inserted are created.
+
+        Parameters
+        -----------
+        old: Declarative
+            The existing view instance that needs to be updated
+        node: EnamlDefNode
+            The compiler node of the enamldef
+        removed: list
+            List of (parent, children) tuples of children that should be
+            destroyed after the update completes
+
+        """
+        summary = self.summary
+        deferred = DeferredUpdates()
+        with summary.timed('diff'), new_scope(node.scope_key) as scope:
+            self.update_from_compiler_node(old, node, removed, deferred)
+            self.revisit_skipped(scope, removed, deferred)
+
+        #: Local scopes are now complete so expressions can be evaluated.
+        #: The new instances are not initialized, they have no parent to
+        #: look up names in, instead they are diffed into the old ones and
+        #: any new children are initialized once added to them.
+        with summary.timed('create'):
+            for old_child, new_child in deferred.replaced:
+                self.update_node(old_child, new_child, removed)
+                if isinstance(old_child, Pattern):
+                    self.update_pattern(old_child, new_child, deferred)
+        with summary.timed('arrange'):
+            for parent, old_children, targets in deferred.arranged:
+                self.arrange_children(parent, old_children, targets)
+        with summary.timed('bindings'):
+            for old_child, engine, previous in deferred.engines:
+                self.update_engine(old_child, engine, changed_identifiers(
+                    previous, old_child._d_storage, self._replaced))
+        with summary.timed('create'):
+            for pattern in deferred.refreshed:
+                if pattern.is_destroyed:
+                    continue
+                if isinstance(pattern, Looper):
+                    #: Iterations are reused by item unless dropped
+                    del pattern._iter_data
+                pattern.refresh_items()
+
+    def update_pattern(self, old, new, deferred):
+        """ Make an existing pattern create its items from the nodes of the
+        new one. The items are only recreated if the nodes changed.
+
+        Parameters
+        -----------
+        old: Pattern
+            The existing pattern
+        new: Pattern
+            The uninitialized pattern created from the new compiler node
+        deferred: DeferredUpdates
+            Updates to apply once the local scopes are complete
+
+        """
+        cache, stale = self._cache, self._stale_globals
+
+        def signature(pattern):
+            return [node_fingerprint(n, cache, stale)
+                    for nodes, key, f_locals in pattern.pattern_nodes
+                    for n in nodes]
+
+        changed = bool(self._replaced) or signature(old) != signature(new)
+        old.pattern_nodes = new.pattern_nodes
+        if changed:
+            deferred.refreshed.append(old)
+
+    def update_from_compiler_node(self, old, node, removed, deferred,
+                                  skip=True):
+        """ Update an existing instance from the compiler node it would now
+        be created from. This mirrors `DeclarativeNode.populate` but reuses
+        existing instances where they match. It must be called within the
+        local scope of the block the node is in.
+
+        Parameters
+        -----------
+        old: Declarative
+            The existing instance
+        node: DeclarativeNode
+            The compiler node
+        removed: list
+            List of (parent, children) tuples of children that should be
+            destroyed after the update completes
+        deferred: DeferredUpdates
+            Updates to apply once the local scopes are complete
+        skip: bool
+            Whether the node may be skipped if it's unchanged
+
+        """
+        f_locals = peek_scope()
+        chain = node_chain(node)
+
+        #: Children can only be known by creating the node
+        if not is_static_chain(chain):
+            new = node(None)
+            self.summary.count('created')
+            if node.identifier:
+                f_locals[node.identifier] = old
+            deferred.replaced.append((old, new))
+            return
+
+        cache, stale = self._cache, self._stale_globals
+        if skip and self.skip_unchanged and not self._replaced and (
+                fingerprint(old, cache, stale) ==
+                node_fingerprint(node, cache, stale)):
+            register_identifiers(old, node, f_locals)
+            deferred.skipped.append((old, node, f_locals))
+            self.summary.count('skipped')
+            return
+
+        self.summary.count('visited')
+        if node.identifier:
+            f_locals[node.identifier] = old
+
+        old_children = old.children[:]
+        nodes = [c for n in chain for c in n.children]
+        #: Items of patterns are not created from the nodes of this block
+        items = set()
+        for child in old_children:
+            if isinstance(child, Pattern):
+                items.update(id(item) for item in child.pattern_items())
+        candidates = [c for c in old_children if id(c) not in items]
+        matches, unmatched = self.match_nodes(candidates, nodes)
+        matches = iter(matches)
+
+        #: Base enamldefs populate first, each in their own local scope.
+        #: Keep anything that's not a local scope, such as the observers
+        #: of subscriptions.
+        previous = old._d_storage
+        storage = sortedmap()
+        for key, value in previous.items():
+            if not isinstance(value, sortedmap):
+                storage[key] = value
+        engine = None
+        for n in chain:
+            if n.engine is not None:
+                engine = n.engine
+        #: Engines are applied parents first since children may read them
+        deferred.engines.append((old, engine, previous))
+        targets = []
+        for n in chain:
+            if n is node:
+                scope = f_locals
+                self.update_block_children(n, matches, targets, removed,
+                                           deferred)
+            else:
+                with new_scope(n.scope_key) as scope:
+                    if n.identifier:
+                        scope[n.identifier] = old
+                    self.update_block_children(n, matches, targets, removed,
+                                               deferred)
+                    self.revisit_skipped(scope, removed, deferred)
+            if n.store_locals:
+                storage[n.scope_key] = scope
+
+        old._d_storage = storage
+        if unmatched or targets != old_children:
+            deferred.arranged.append((old, old_children, targets))
+        if unmatched:
+            removed.append((old, unmatched))
+
+    def revisit_skipped(self, scope, removed, deferred):
+        """ Update the subtrees of a block that were skipped as unchanged but
+        use an identifier bound to a node created by this update, since
+        they still refer to the node it replaced. Created nodes are not
+        initialized until they are inserted. This must be called within the
+        local scope of the block once its children were updated.
+
+        """
+        names = {k for k, v in scope.items()
+                 if isinstance(v, Declarative) and not v.is_initialized}
+        if not names:
+            return
+        #: Children of revisited subtrees may be skipped and added again
+        skipped = deferred.skipped
+        i = 0
+        while i < len(skipped):
+            old, node, f_locals = skipped[i]
+            i += 1
+            if f_locals is scope and node_uses_names(node, names,
+                                                     self._cache):
+                self.update_from_compiler_node(old, node, removed, deferred,
+                                               skip=False)
+
+    def revisit_skipped_instances(self, removed):
+        """ Update the subtrees that were skipped as unchanged while diffing
+        instances but use an identifier of a new child that was inserted,
+        since they still refer to the node it replaced.
+
+        """
+        inserted = self._inserted
+        if not inserted:
+            return
+        cache = self._cache
+        found = {}
+
+        def is_inserted(obj):
+            key = id(obj)
+            result = found.get(key)
+            if result is None:
+                parent = obj.parent
+                result = found[key] = key in inserted or (
+                    parent is not None and is_inserted(parent))
+            return result
+
+        def uses_inserted(new):
+            if new._d_storage:
+                names = {k for k, v in scope_names(new._d_storage).items()
+                         if isinstance(v, Declarative) and is_inserted(v)}
+                if names and uses_names(new._d_engine, names, cache):
+                    return True
+            return any(uses_inserted(c) for c in new.children
+                       if isinstance(c, Declarative))
+
+        #: Children of revisited subtrees may be skipped and added again
+        skipped = self._skipped
+        i = 0
+        while i < len(skipped):
+            old, new = skipped[i]
+            i += 1
+            if uses_inserted(new):
+                self.update_node(old, new, removed, skip=False)
+
+    def is_unchanged(self, old, new):
+        """ Check whether the subtrees of old and new have the same
+        fingerprint and can be skipped.
+
+        """
+        if not self.skip_unchanged or self._replaced:
+            return False
+        cache, stale = self._cache, self._stale_globals
+        return fingerprint(old, cache, stale) == fingerprint(new, cache, stale)
+
+    def update_node(self, old, new, removed, skip=True):
+        """ Update a node and recursively update its children.
+
+        Parameters
+        -----------
+        old: Declarative
+            The existing view instance that needs to be updated
+        new: Declarative
+            The new view instance that should be used for updating
+        removed: list
+            List of (parent, children) tuples of children that should be
+            destroyed after the update completes
+        skip: bool
+            Whether the subtree may be skipped if it's unchanged
+
+        """
+        if skip and self.is_unchanged(old, new):
+            self._skipped.append((old, new))
+            self.summary.count('skipped')
+            return
+
+        self.summary.count('visited')
         #: Update attrs, funcs, and bindings of this node
         self.update_attrs(old, new)
         self.update_funcs(old, new)
         self.update_bindings(old, new)
+        self.update_children(old, new, removed)
 
-        #: Walk all children and find ones that "match"
-        old_count, new_count = len(old.children), len(new.children)
+    def update_children(self, old, new, removed):
+        """ Add, move, update, or remove children of the node.
 
+        Inserts and moves are applied with one `insert_children` call per
+        contiguous run of children instead of one per child.
+
+        Parameters
+        -----------
+        old: Declarative
+            The existing view instance that needs to be updated
+        new: Declarative
+            The new view instance that should be used for updating
+        removed: list
+            List of (parent, children) tuples the children of old that
+            were not matched are added to
+
+        """
+        #: Match up old and new children
         old_children = old.children[:]
+        new_children = new.children[:]
+        matches, unmatched = self.match_children(old_children, new_children)
+
+        #: Update matched children
+        for new_child, old_child in zip(new_children, matches):
+            if old_child is not None:
+                self.update_node(old_child, new_child, removed)
+
+        targets = [old_child if old_child is not None else new_child
+                   for new_child, old_child in zip(new_children, matches)]
+        self._inserted.update(id(new_child) for new_child, old_child
+                              in zip(new_children, matches)
+                              if old_child is None)
+        self.arrange_children(old, old_children, targets)
+
+        if unmatched:
+            removed.append((old, unmatched))
+
+    def arrange_children(self, parent, old_children, targets):
+        """ Move and insert children so the children of parent are ordered
+        as in targets (ignoring any children that will be removed).
+
+        Children in the longest run that is already in order stay put,
+        everything else is moved or inserted with one `insert_children`
+        call per contiguous run.
+
+        Parameters
+        -----------
+        parent: Declarative
+            The node whose children are arranged
+        old_children: list
+            The current children of the parent
+        targets: list
+            The children in the order they should be in
+
+        """
+        positions = {id(c): i for i, c in enumerate(old_children)}
+        kept = [i for i, c in enumerate(targets) if id(c) in positions]
+        stable = longest_increasing_subsequence(
+            [positions[id(targets[i])] for i in kept])
+        stable = {kept[i] for i in stable}
 
-        #: Add or remove any children
-        for i, new_child in enumerate(new.children):
-            name = new_child.__class__.__name__
-            matches = [c for c in old_children if name==c.__class__.__name__]
+        moved = sum(1 for i in kept if i not in stable)
+        self.summary.count('moved', moved)
+        self.summary.count('inserted', len(targets) - len(kept))
 
-            if matches:
-                #: Update child
-                #: TODO: We should pick the BEST one from this list
-                #: based on some "matching" criteria (such as matching ref name or params)
-                old_child = matches[0]
-                old_children.remove(old_child)
-                #: Update existing child
-                self.update(old_child, new_child)
+        #: Go in reverse so each run can be placed directly before the
+        #: child following it
+        run = []
+        before = None
+        for i in reversed(range(len(targets))):
+            child = targets[i]
+            if i in stable:
+                if run:
+                    run.reverse()
+                    parent.insert_children(before, run)
+                    run = []
+                before = child
+                continue
+            run.append(child)
+        if run:
+            run.reverse()
+            parent.insert_children(before, run)
+
+    def destroy_children(self, removed):
+        """ Destroy children that were removed during an update.
+
+        Children are detached from each parent in a single pass before
+        being destroyed, instead of each destroy removing itself from the
+        parent's children list.
+
+        Parameters
+        -----------
+        removed: list
+            List of (parent, children) tuples
+
+        """
+        for parent, children in removed:
+            if parent.is_destroyed:
+                continue
+            ids = {id(c) for c in children}
+            parent._children = [c for c in parent._children
+                                if id(c) not in ids]
+            for c in children:
+                if c._parent is parent:
+                    c._parent = None
+                    c.parent_changed(parent, None)
+                    parent.child_removed(c)
 
+        for parent, children in removed:
+            self.summary.count('destroyed', len(children))
+            for c in children:
+                if not c.is_destroyed:
+                    c.destroy()
+
+    def update_block_children(self, node, matches, targets, removed,
+                              deferred):
+        """ Update or create the children of a compiler node within the
+        current local scope.
+
+        Parameters
+        -----------
+        node: DeclarativeNode
+            The compiler node whose children are updated
+        matches: iterator
+            Iterator yielding the matching old child (or None) for each
+            child node
+        targets: list
+            List the resulting children are appended to
+        removed: list
+            List of (parent, children) tuples of children that should be
+            destroyed after the update completes
+        deferred: DeferredUpdates
+            Updates to apply once the local scopes are complete
+
+        """
+        for child_node in node.children:
+            old_child = next(matches)
+            if old_child is None:
+                targets.append(child_node(None))
+                self.summary.count('created')
             else:
-                #: New child, insert in place
-                old.insert_children(i, [new_child])
+                self.update_from_compiler_node(old_child, child_node,
+                                               removed, deferred)
+                if isinstance(old_child, Pattern):
+                    #: Pattern items stay in front of their pattern
+                    targets.extend(old_child.pattern_items())
+                targets.append(old_child)
+
+    def match_children(self, old_children, new_children):
+        """ Find which of the old children each new child should update.
 
-        #: Destroy any removed children
+        Children are matched by their declared identifier or `name`, then
+        by class and subtree fingerprint, then by class in the order they
+        appear. Lookups use hash maps so this is
+        linear in the number of children.
+
+        Parameters
+        -----------
+        old_children: list
+            The children of the existing view
+        new_children: list
+            The children of the new view
+
+        Returns
+        -------
+        result: tuple
+            A tuple of (matches, removed) where matches is a list with the
+            matching old child (or None) for each new child and removed
+            is a list of old children that were not matched.
+
+        """
+        old_ids = child_identifiers(old_children)
+        new_ids = child_identifiers(new_children)
+        cache, stale = self._cache, self._stale_globals
+        return match_keys(old_children,
+                          [child_key(c, old_ids) for c in old_children],
+                          [child_key(c, new_ids) for c in new_children],
+                          lambda c: fingerprint(c, cache, stale),
+                          lambda i: fingerprint(new_children[i], cache,
+                                                stale))
+
+    def match_nodes(self, old_children, nodes):
+        """ Find which of the old children each compiler node should update.
+
+        Parameters
+        -----------
+        old_children: list
+            The children of the existing view
+        nodes: list
+            The DeclarativeNodes the new children would be created from
+
+        Returns
+        -------
+        result: tuple
+            A tuple of (matches, removed), see `match_children`.
+
+        """
+        old_ids = child_identifiers(old_children)
+        old_keys = []
         for c in old_children:
-            if not c.is_destroyed:
-                c.destroy()
+            cls = class_key(c.__class__)
+            name = old_ids.get(id(c))
+            old_keys.append(((cls, name) if name else None, cls))
+        new_keys = []
+        for node in nodes:
+            cls = node.klass.__name__
+            new_keys.append(((cls, node.identifier) if node.identifier
+                             else None, cls))
+        cache, stale = self._cache, self._stale_globals
+        return match_keys(old_children, old_keys, new_keys,
+                          lambda c: fingerprint(c, cache, stale),
+                          lambda i: node_fingerprint(nodes[i], cache, stale))
 
     def update_attrs(self, old, new):
         """ Update any `attr` members.
@@ -216,18 +1467,43 @@ class Hotswapper(autoreload.Autoreloader):
                 The new view instance that should be used for updating
 
         """
-        #: Copy the Expression Engine
-        if new._d_engine:
-            old._d_engine = new._d_engine
-            engine = old._d_engine
+        #: The local scopes were replaced so every identifier now refers to
+        #: a node of the new view
+        stale = scope_names(new._d_storage) if new._d_storage else ()
+        self.update_engine(old, new._d_engine, stale)
 
-            #: Rerun any read expressions which should trigger
-            #: any dependent writes
-            for k in engine._handlers.keys():
-                try:
-                    engine.update(old, k)
-                except:
-                    pass
+    def update_engine(self, old, engine, stale=()):
+        """ Replace the expression engine of a node and rerun the read
+        expressions that changed or depend on something that changed.
 
+            Parameters
+            -----------
+            old: Declarative
+                The existing view instance that needs to be updated
+            engine: ExpressionEngine
+                The new expression engine
+            stale: iterable
+                Names in the local scope that now refer to a different
+                object. Expressions using them are rerun, as are any using
+                globals of the reloaded modules.
 
+        """
+        if not engine:
+            return
+        previous = old._d_engine
+        old._d_engine = engine
+        if self._stale_globals:
+            stale = self._stale_globals.union(stale)
+        if previous is engine and not stale:
+            return
 
+        #: Rerun any read expressions which should trigger
+        #: any dependent writes
+        for k in changed_bindings(previous, engine, stale, self._cache):
+            self.summary.count('rerun')
+            try:
+                engine.update(old, k)
+            except Exception as e:
+                self.errors.append((old, k, e))
+                print("[hotswap update of %s.%s failed: %s]" % (
+                    old, k, traceback.format_exc(10)))
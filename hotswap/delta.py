@@ -0,0 +1,173 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Binary deltas between versions of a payload, used to send only what changed
+in a module to remote apps.
+
+A delta is a list of operations. A tuple of (offset, length) copies length
+bytes of the base starting offset bytes after the end of the previous copy,
+bytes are inserted as is. Relative offsets are mostly small or zero so the
+delta compresses well.
+
+'''
+import hashlib
+
+#: Size of the blocks of the base that are matched
+BLOCK_SIZE = 32
+
+#: Modulus of the rolling checksum
+MOD = 1 << 16
+
+
+def digest(data):
+    """ Get the digest used to identify a version of a payload """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def common_prefix(a, b):
+    """ Get the length of the common prefix of two byte strings """
+    a, b = memoryview(a), memoryview(b)
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b, limit):
+    """ Get the length of the common suffix of two byte strings, up to
+    limit bytes.
+
+    """
+    a, b = memoryview(a), memoryview(b)
+    n, m = len(a), len(b)
+    lo, hi = 0, min(n, m, limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[n-mid:n-lo] == b[m-mid:m-lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def checksum(block):
+    """ Compute the rolling checksum of a block as the (a, b) sums of
+    rsync's weak checksum.
+
+    """
+    a = b = 0
+    n = len(block)
+    for i, x in enumerate(block):
+        a += x
+        b += (n - i) * x
+    return a % MOD, b % MOD
+
+
+def make_delta(base, data, block_size=BLOCK_SIZE):
+    """ Compute the delta that turns base into data.
+
+    The common prefix and suffix are copied directly. The rest of data is
+    scanned with a rolling checksum for blocks that also occur in base so
+    moved code is copied instead of sent again.
+
+    Parameters
+    -----------
+    base: bytes
+        The version both ends have
+    data: bytes
+        The new version
+    block_size: int
+        Size of the blocks of base that are matched
+
+    Returns
+    -------
+    ops: list
+        The delta operations, see `apply_delta`
+
+    """
+    ops = []
+    #: End of the last copy in base
+    end_of_copy = [0]
+
+    def copy(offset, length):
+        last = end_of_copy[0]
+        if ops and isinstance(ops[-1], tuple) and offset == last:
+            ops[-1] = (ops[-1][0], ops[-1][1] + length)
+        else:
+            ops.append((offset - last, length))
+        end_of_copy[0] = offset + length
+
+    prefix = common_prefix(base, data)
+    suffix = common_suffix(base, data, min(len(base), len(data)) - prefix)
+    if prefix:
+        copy(0, prefix)
+
+    start, end = prefix, len(data) - suffix
+    if end - start >= block_size:
+        index = {}
+        for offset in range(0, len(base) - block_size + 1, block_size):
+            key = checksum(base[offset:offset+block_size])
+            index.setdefault(key, []).append(offset)
+
+        bs = block_size
+        base_view, data_view = memoryview(base), memoryview(data)
+        literal = i = start
+        a, b = checksum(data[i:i+bs])
+        while True:
+            match = None
+            offsets = index.get((a, b))
+            if offsets is not None:
+                block = data[i:i+bs]
+                for offset in offsets:
+                    if base[offset:offset+bs] == block:
+                        match = offset
+                        break
+            if match is not None:
+                if literal < i:
+                    ops.append(data[literal:i])
+                #: Extend the match as far as possible
+                length = bs + common_prefix(base_view[match+bs:],
+                                            data_view[i+bs:end])
+                copy(match, length)
+                i += length
+                literal = i
+                if i + bs > end:
+                    break
+                a, b = checksum(data[i:i+bs])
+                continue
+            if i + bs >= end:
+                break
+            #: Roll the checksum one byte forward
+            out, new = data[i], data[i+bs]
+            a = (a - out + new) % MOD
+            b = (b - bs * out + a) % MOD
+            i += 1
+        start = literal
+
+    if start < end:
+        ops.append(data[start:end])
+    if suffix:
+        copy(len(base) - suffix, suffix)
+    return ops
+
+
+def apply_delta(base, ops):
+    """ Apply the delta operations to the base and return the new data """
+    chunks = []
+    end = 0
+    for op in ops:
+        if isinstance(op, tuple):
+            start = end + op[0]
+            end = start + op[1]
+            chunks.append(base[start:end])
+        else:
+            chunks.append(op)
+    return b''.join(chunks)
@@ -0,0 +1,205 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Import dependency graph used to reload dependents of a changed module.
+
+'''
+import dis
+import sys
+import types
+from importlib.util import resolve_name
+from atom.api import Atom, Dict, Typed
+
+
+def module_code(module):
+    """ Get the module level code object of a module from its loader.
+
+    For python modules this normally reads the cached bytecode. Enaml
+    importers use the `__enamlcache__` when it's current.
+
+    """
+    loader = getattr(module, '__loader__', None)
+    get_code = getattr(loader, 'get_code', None)
+    if get_code is None:
+        return None
+    try:
+        try:
+            code = get_code(module.__name__)
+        except TypeError:
+            #: Enaml importers take no arguments
+            code = get_code()
+    except Exception:
+        return None
+    if isinstance(code, tuple):
+        #: Enaml importers return (code, path)
+        code = code[0]
+    return code if isinstance(code, types.CodeType) else None
+
+
+def find_imports(module):
+    """ Find the names of the modules imported at the module level.
+
+    The IMPORT_NAME instructions of the module code are used so this works
+    for both `.py` and `.enaml` modules. If the code is not available the
+    module namespace is inspected instead.
+
+    Parameters
+    -----------
+    module: module
+        The module to inspect
+
+    Returns
+    -------
+    names: set
+        Set of fully qualified module names the module may depend on. This
+        includes `package.name` for `from package import name` since name
+        may be a submodule.
+
+    """
+    names = set()
+    code = module_code(module)
+    if code is None:
+        for obj in list(module.__dict__.values()):
+            if isinstance(obj, types.ModuleType):
+                names.add(obj.__name__)
+            else:
+                name = getattr(obj, '__module__', None)
+                if isinstance(name, str):
+                    names.add(name)
+        return names
+
+    package = getattr(module, '__package__', None) or ''
+    consts = [None, None]
+    for instr in dis.get_instructions(code):
+        if instr.opname == 'LOAD_CONST':
+            consts = [consts[1], instr.argval]
+            continue
+        if instr.opname == 'IMPORT_NAME':
+            level, fromlist = consts
+            name = instr.argval
+            if isinstance(level, int) and level > 0:
+                try:
+                    name = resolve_name('.'*level + name, package)
+                except (ImportError, ValueError):
+                    name = None
+            if name:
+                names.add(name)
+                if fromlist:
+                    for attr in fromlist:
+                        if attr != '*':
+                            names.add('{}.{}'.format(name, attr))
+        consts = [None, None]
+    return names
+
+
+class DependencyGraph(Atom):
+    """ A graph of the imports between indexed modules.
+
+    Modules are scanned lazily, only when dependents are requested, and
+    rescanned after they're reloaded.
+
+    """
+    #: Module name -> set of module names it imports
+    imports = Dict()
+
+    #: Module name -> set of module names that import it
+    dependents = Dict()
+
+    #: Module names that need to be (re)scanned
+    stale = Typed(set, ())
+
+    def invalidate(self, modname):
+        """ Mark the module to be scanned again next time it's needed """
+        self.stale.add(modname)
+
+    def remove(self, modname):
+        """ Remove the module from the graph """
+        self.stale.discard(modname)
+        for name in self.imports.pop(modname, ()):
+            deps = self.dependents.get(name)
+            if deps is not None:
+                deps.discard(modname)
+
+    def add(self, modname, imports):
+        """ Set the imports of a module """
+        self.remove(modname)
+        self.imports[modname] = imports
+        for name in imports:
+            self.dependents.setdefault(name, set()).add(modname)
+
+    def refresh(self, tracked):
+        """ Scan any stale modules.
+
+        Parameters
+        -----------
+        tracked: container
+            Names of the modules that are tracked. Imports of any other
+            modules are ignored.
+
+        """
+        stale = self.stale
+        while stale:
+            modname = stale.pop()
+            module = sys.modules.get(modname)
+            if module is None or modname not in tracked:
+                self.remove(modname)
+                continue
+            self.add(modname, {name for name in find_imports(module)
+                               if name in tracked and name != modname})
+
+    def affected(self, modnames, include=None):
+        """ Return the given modules along with all modules that depend on
+        them, directly or indirectly.
+
+        Parameters
+        -----------
+        modnames: iterable
+            Names of the modules that changed
+        include: callable or None
+            Filter called with a module name that returns whether that
+            dependent should be included.
+
+        """
+        result = set(modnames)
+        todo = list(result)
+        dependents = self.dependents
+        while todo:
+            for name in dependents.get(todo.pop(), ()):
+                if name in result:
+                    continue
+                if include is not None and not include(name):
+                    continue
+                result.add(name)
+                todo.append(name)
+        return result
+
+    def order(self, modnames):
+        """ Sort the modules so each module comes after the modules it
+        imports. Import cycles are broken at the first module reached.
+
+        """
+        pending = set(modnames)
+        imports = self.imports
+        result = []
+        for root in sorted(pending):
+            if root not in pending:
+                continue
+            visiting = {root}
+            stack = [(root, iter(sorted(imports.get(root, ()))))]
+            while stack:
+                name, deps = stack[-1]
+                for dep in deps:
+                    if dep in pending and dep not in visiting:
+                        visiting.add(dep)
+                        stack.append((dep, iter(sorted(imports.get(dep, ())))))
+                        break
+                else:
+                    stack.pop()
+                    visiting.discard(name)
+                    pending.discard(name)
+                    result.append(name)
+        return result
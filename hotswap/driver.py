@@ -0,0 +1,187 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Drive a Hotswapper from an asyncio event loop.
+
+'''
+import asyncio
+import traceback
+from atom.api import Atom, Float, Instance, List, Typed, Value
+from enaml.application import Application, deferred_call
+from .core import Hotswapper
+from .watcher import ChangeBatcher
+
+
+class AsyncDriver(Atom):
+    """ Watches for changes from an asyncio event loop and swaps them into
+    a view.
+
+    When the watcher has a file descriptor (inotify) the loop waits on it
+    with `add_reader` instead of polling. Reloads and updates run on the
+    enaml application's event loop using `deferred_call` when there is an
+    application, otherwise directly on the asyncio loop.
+
+    Example
+    -----------
+
+    hotswap = Hotswapper(watch=True, debounce=0.1)
+    driver = AsyncDriver(hotswap=hotswap, view=view)
+    driver.start()
+
+    #: In a test
+    reloaded = await driver.next_swap()
+
+    """
+    #: The hotswapper used to reload and update the view
+    hotswap = Instance(Hotswapper)
+
+    #: The view to update
+    view = Value()
+
+    #: Seconds between checks if the watcher cannot be waited on
+    interval = Float(0.5)
+
+    #: The task running `watch`
+    task = Typed(asyncio.Task)
+
+    #: Futures waiting for the next swap
+    waiters = List()
+
+    def start(self):
+        """ Start watching in a task on the running loop """
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.watch())
+        return self.task
+
+    def stop(self):
+        """ Stop watching """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for future in self.waiters:
+            if not future.done():
+                future.cancel()
+        self.waiters = []
+
+    def next_swap(self):
+        """ Return a future resolved with the names of the reloaded modules
+        the next time the view is updated.
+
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        return future
+
+    def call(self, func, *args):
+        """ Call func on the enaml application's event loop and return a
+        future with the result.
+
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            try:
+                result = func(*args)
+            except Exception as e:
+                loop.call_soon_threadsafe(resolve, None, e)
+            else:
+                loop.call_soon_threadsafe(resolve, result, None)
+
+        if Application.instance() is None:
+            loop.call_soon(run)
+        else:
+            deferred_call(run)
+        return future
+
+    async def update(self):
+        """ Reload any changed modules and update the view. If that fails
+        the futures waiting for the next swap get the error.
+
+        Returns
+        -------
+        reloaded: list
+            The names of the modules that were reloaded
+
+        """
+        try:
+            reloaded = await self.call(self.hotswap.poll, self.view)
+        except Exception as e:
+            waiters, self.waiters = self.waiters, []
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        if reloaded:
+            #: The view is replaced if it was migrated
+            if self.hotswap.summary.view is not None:
+                self.view = self.hotswap.summary.view
+            waiters, self.waiters = self.waiters, []
+            for future in waiters:
+                if not future.done():
+                    future.set_result(reloaded)
+        return reloaded
+
+    async def watch(self):
+        """ Wait for changes and update the view until cancelled. Errors
+        are reported and watching continues.
+
+        """
+        loop = asyncio.get_running_loop()
+        watcher = self.hotswap._reloader.watcher
+        fd = watcher.fileno() if watcher is not None else None
+        readable = asyncio.Event()
+
+        def on_readable():
+            #: Stop listening until the events are read by the next check,
+            #: otherwise this is called on every loop iteration
+            loop.remove_reader(fd)
+            readable.set()
+
+        try:
+            while True:
+                if fd is None:
+                    timeout = self.interval
+                    if isinstance(watcher, ChangeBatcher):
+                        remaining = watcher.remaining()
+                        if remaining is not None:
+                            timeout = min(remaining, timeout)
+                else:
+                    #: Paths that are stat polled never make fd readable
+                    timeout = self.interval if watcher.polling() else None
+                    if isinstance(watcher, ChangeBatcher):
+                        remaining = watcher.remaining()
+                        if remaining is not None:
+                            timeout = min(remaining, timeout or remaining)
+                    readable.clear()
+                    loop.add_reader(fd, on_readable)
+                try:
+                    if timeout is None:
+                        await readable.wait()
+                    else:
+                        await asyncio.wait_for(readable.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                if fd is not None:
+                    loop.remove_reader(fd)
+                try:
+                    await self.update()
+                except Exception:
+                    #: Keep watching so the next change can fix it
+                    print("[hotswap watch of %s failed: %s]" % (
+                        self.view, traceback.format_exc(10)))
+        finally:
+            if fd is not None:
+                loop.remove_reader(fd)
@@ -0,0 +1,160 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+An index of loaded modules and their source files.
+
+'''
+import os
+import sys
+from atom.api import Atom, Dict, Instance, List, Typed
+from . import openpy
+from .scope import Scope
+
+
+class ModuleIndex(Atom):
+    """ Maps module names to resolved source files and back.
+
+    The index is updated incrementally as modules are added to or removed
+    from sys.modules so a check only needs dictionary lookups instead of
+    resolving every module's `__file__` each time.
+
+    """
+    #: Source extension types
+    source_exts = List(default=['.py'])
+
+    #: Module name -> absolute source filename
+    filenames = Dict()
+
+    #: Absolute source filename -> list of module names loaded from it
+    files = Dict()
+
+    #: Module names with no reloadable source (builtins, extensions, etc.)
+    #: or that are out of scope
+    ignored = Typed(set, ())
+
+    #: Limits the indexed modules, others are ignored
+    scope = Instance(Scope)
+
+    def resolve(self, module):
+        """ Resolve the source filename of a module.
+
+        Parameters
+        -----------
+        module: module
+            The module to resolve
+
+        Returns
+        -------
+        filename: str or None
+            The absolute path to the source or None if the module cannot
+            be reloaded.
+
+        """
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            return None
+
+        if getattr(module, '__name__', None) in ['__mp_main__', '__main__']:
+            # we cannot reload(__main__) or reload(__mp_main__)
+            return None
+
+        path, ext = os.path.splitext(filename)
+
+        if ext.lower() in self.source_exts:
+            py_filename = filename
+        else:
+            try:
+                py_filename = openpy.source_from_cache(filename)
+            except ValueError:
+                return None
+
+        return os.path.abspath(py_filename)
+
+    def get(self, modname):
+        """ Get the source filename of the module, indexing it if needed """
+        try:
+            return self.filenames[modname]
+        except KeyError:
+            if modname in self.ignored:
+                return None
+        return self.add(modname)
+
+    def add(self, modname, module=None):
+        """ Add a module to the index.
+
+        Parameters
+        -----------
+        modname: str
+            The module name
+        module: module or None
+            The module, if None it's looked up in sys.modules
+
+        Returns
+        -------
+        filename: str or None
+            The resolved source filename
+
+        """
+        if module is None:
+            module = sys.modules.get(modname)
+        filename = self.resolve(module) if module is not None else None
+        if filename is not None and self.scope is not None:
+            if not self.scope.match(modname, filename):
+                filename = None
+        if filename is None:
+            self.ignored.add(modname)
+            return None
+        self.remove(modname)
+        self.filenames[modname] = filename
+        self.files.setdefault(filename, []).append(modname)
+        return filename
+
+    def remove(self, modname):
+        """ Remove a module from the index """
+        self.ignored.discard(modname)
+        filename = self.filenames.pop(modname, None)
+        if filename is None:
+            return
+        names = self.files.get(filename)
+        if names is not None:
+            if modname in names:
+                names.remove(modname)
+            if not names:
+                del self.files[filename]
+
+    def update(self, added=(), removed=()):
+        """ Update the index with the modules that were added to or removed
+        from sys.modules.
+
+        Returns
+        -------
+        indexed: list
+            List of (modname, filename) tuples of added modules that have
+            reloadable sources.
+
+        """
+        for modname in removed:
+            self.remove(modname)
+        indexed = []
+        for modname in added:
+            filename = self.add(modname)
+            if filename is not None:
+                indexed.append((modname, filename))
+        return indexed
+
+    def diff(self):
+        """ Compare the index against sys.modules.
+
+        Returns
+        -------
+        result: tuple
+            Tuple of (added, removed) sets of module names.
+
+        """
+        current = set(sys.modules)
+        known = self.ignored.union(self.filenames)
+        return current - known, known - current
@@ -0,0 +1,185 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Migrate live instances of atom classes whose members changed on reload.
+
+'''
+import gc
+import weakref
+from atom.api import Atom, Int, Typed
+from atom.datastructures.api import sortedmap
+
+
+#: Old class -> reloaded class, for atom classes whose member layout
+#: changed. Instances of the old class cannot use the new members since
+#: the number of slots of an atom instance is fixed when it's created.
+layout_changes = weakref.WeakKeyDictionary()
+
+
+def member_layout(cls):
+    """ Get the slot layout of an atom class as a dict of member name to
+    slot index.
+
+    """
+    return {name: m.index for name, m in cls.members().items()}
+
+
+def record_layout_change(old, new):
+    """ Record that the members of a reloaded atom class changed """
+    layout_changes[old] = new
+    InstanceMigrator.generation += 1
+
+
+def is_reshaped(cls):
+    """ Check if instances of cls must be migrated before they can use
+    the members of the reloaded class.
+
+    """
+    return cls in layout_changes
+
+
+def replace_references(replacements, ignore=()):
+    """ Replace references to the old objects with their new ones in the
+    lists, dicts, local scopes and atom members referring to them.
+
+    The referrers of all old objects are found with a single gc scan.
+
+    Parameters
+    -----------
+    replacements: dict
+        Mapping of each object being replaced to the object replacing it
+    ignore: iterable
+        Referrers to leave alone
+
+    Returns
+    -------
+    count: int
+        Number of references replaced
+
+    """
+    if not replacements:
+        return 0
+    count = 0
+    skip = {id(r) for r in ignore}
+    skip.add(id(replacements))
+    new_by_id = {id(old): new for old, new in replacements.items()}
+    for ref in gc.get_referrers(*replacements):
+        if id(ref) in skip:
+            continue
+        if isinstance(ref, list):
+            for i, value in enumerate(ref):
+                new = new_by_id.get(id(value))
+                if new is not None:
+                    ref[i] = new
+                    count += 1
+        elif isinstance(ref, (dict, sortedmap)):
+            for key, value in list(ref.items()):
+                new = new_by_id.get(id(value))
+                if new is not None:
+                    ref[key] = new
+                    count += 1
+        elif isinstance(ref, Atom):
+            for member in type(ref).members().values():
+                new = new_by_id.get(id(member.get_slot(ref)))
+                if new is not None:
+                    member.set_slot(ref, new)
+                    count += 1
+    return count
+
+
+class InstanceMigrator(Atom):
+    """ Moves live instances of reloaded atom classes whose members changed
+    into instances of the new class.
+
+    A new instance is created without calling `__init__`, the values of the
+    members the classes share are copied over, and references to the old
+    instance in lists, dicts, local scopes and atom members are replaced.
+
+    Instances are found with a single gc scan which is only repeated after
+    another layout change is recorded.
+
+    """
+    #: Incremented every time a layout change is recorded
+    generation = 0
+
+    #: Generation of the last scan
+    scanned = Int(-1)
+
+    #: Instances found by the last scan
+    instances = Typed(list, ())
+
+    #: Old instance -> new instance of the last migration
+    migrated = Typed(dict, ())
+
+    def find_instances(self):
+        """ Find the live instances of any classes whose layout changed.
+        The result is cached until another change is recorded.
+
+        """
+        if self.scanned == InstanceMigrator.generation:
+            return self.instances
+        self.scanned = InstanceMigrator.generation
+        classes = set(layout_changes.keys())
+        if not classes:
+            self.instances = []
+        else:
+            self.instances = [obj for obj in gc.get_objects()
+                              if type(obj) in classes]
+        return self.instances
+
+    def migrate_instance(self, obj, cls):
+        """ Create an instance of cls with the member values of obj.
+
+        Parameters
+        -----------
+        obj: Atom
+            The instance to migrate
+        cls: AtomMeta
+            The class to migrate it to
+
+        Returns
+        -------
+        new: Atom
+            The new instance. References to obj are not replaced.
+
+        """
+        new = cls.__new__(cls)
+        old_members = type(obj).members()
+        for name, member in cls.members().items():
+            old_member = old_members.get(name)
+            if old_member is None:
+                continue
+            value = old_member.get_slot(obj)
+            if value is not None:
+                member.set_slot(new, value)
+        return new
+
+    def migrate(self):
+        """ Migrate all live instances of classes whose layout changed.
+
+        Returns
+        -------
+        migrated: dict
+            Mapping of each old instance to the new instance replacing it
+
+        """
+        instances = self.find_instances()
+        migrated = {}
+        for obj in instances:
+            cls = layout_changes.get(type(obj))
+            if cls is not None:
+                migrated[obj] = self.migrate_instance(obj, cls)
+
+        #: Replace references once every new instance exists so references
+        #: between migrated instances are replaced as well
+        replace_references(migrated, (instances, self.instances))
+
+        for obj in migrated:
+            layout_changes.pop(type(obj), None)
+        self.instances = []
+        self.migrated = migrated
+        return migrated
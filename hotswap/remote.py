@@ -0,0 +1,641 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Push compiled code of changed modules to an app running in another process,
+such as an enaml-native app on an emulator or device.
+
+Messages are marshalled tuples, compressed with zlib and prefixed with their
+length. Marshal is not safe against malicious data so the server should
+only be exposed on a trusted network, by default it only listens on the
+loopback interface.
+
+Clients acknowledge each version of a module they receive. Once a version
+was acknowledged later versions are sent as a delta against it. If the
+client cannot apply a delta it asks for the full version again.
+
+'''
+import os
+import sys
+import zlib
+import struct
+import select
+import socket
+import marshal
+import threading
+import traceback
+from atom.api import Atom, Dict, Float, Instance, Int, List, Typed, Value
+import enaml
+from .autoreload import reload_code
+from .compiler import CodeCache, cache_tag, compile_source
+from .core import Hotswapper
+from .delta import apply_delta, digest, make_delta
+from .summary import SwapSummary
+from .watcher import Watcher, create_watcher
+
+
+#: Length prefix of each message
+HEADER = struct.Struct('!I')
+
+#: Largest message accepted
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+#: Address used when none is given
+DEFAULT_ADDRESS = ('127.0.0.1', 8797)
+
+#: Number of versions of each module kept to apply deltas to
+MAX_VERSIONS = 3
+
+#: Marshal format of the code sent. Newer formats use references to
+#: earlier objects, their indices shift after any change to a module which
+#: makes the deltas much larger.
+MARSHAL_VERSION = 2
+
+
+def encode_message(message):
+    """ Marshal, compress and length prefix a message """
+    data = zlib.compress(marshal.dumps(message), 1)
+    return HEADER.pack(len(data)) + data
+
+
+def read_exact(sock, size):
+    """ Read exactly size bytes from the socket or raise EOFError """
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, message):
+    """ Send a message over the socket """
+    sock.sendall(encode_message(message))
+
+
+def recv_message(sock):
+    """ Receive a message from the socket.
+
+    Raises
+    -------
+    EOFError:
+        If the connection was closed
+    ValueError:
+        If the message is too large or cannot be decoded
+
+    """
+    size, = HEADER.unpack(read_exact(sock, HEADER.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError("Message of %s bytes is too large" % size)
+    return marshal.loads(zlib.decompress(read_exact(sock, size)))
+
+
+def create_socket(address):
+    """ Create a socket for the address, a (host, port) tuple for TCP or a
+    path for a Unix socket.
+
+    """
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def compiler_tags():
+    """ Tags of the compilers used for each source type. Code can only be
+    sent to a client using the same ones.
+
+    """
+    return {ext: cache_tag('module' + ext) for ext in ('.py', '.enaml')}
+
+
+def module_name(root, filename):
+    """ Get the name of the module loaded from filename relative to the
+    root directory on sys.path.
+
+    """
+    path = os.path.splitext(os.path.relpath(filename, root))[0]
+    parts = path.split(os.sep)
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts)
+
+
+class HotswapServer(Atom):
+    """ Runs on the development machine. Watches the sources under the
+    roots, compiles the ones that change and sends their code to the
+    connected clients.
+
+    Clients using a different python or enaml compiler are sent the
+    sources instead and compile them themselves.
+
+    Example
+    -----------
+
+    server = HotswapServer(roots=['src'])
+    server.start()
+
+    """
+    #: Address to listen on, a (host, port) tuple or a Unix socket path
+    address = Value(DEFAULT_ADDRESS)
+
+    #: Directories on the app's sys.path to serve modules from
+    roots = List()
+
+    #: Source extension types
+    source_exts = List(default=['.py', '.enaml'])
+
+    #: Watcher reporting changed sources
+    watcher = Instance(Watcher)
+
+    #: Cache of the compiled code
+    code_cache = Typed(CodeCache, ())
+
+    #: Source filename -> module name
+    files = Dict()
+
+    #: Sources changed since the server started, these are sent to
+    #: clients when they connect
+    modified = Typed(set, ())
+
+    #: Listening socket
+    listener = Value()
+
+    #: Connected client sockets -> whether code can be sent to them or
+    #: None until the client said hello
+    clients = Dict()
+
+    #: Payloads smaller than this are always sent in full
+    delta_threshold = Int(1024)
+
+    #: Client -> {filename: (digest, payload)} of the last version of each
+    #: module the client acknowledged. Deltas are made against these.
+    acked = Dict()
+
+    #: Client -> {filename: {digest: payload}} of versions sent but not
+    #: acknowledged yet
+    unacked = Dict()
+
+    #: Number of bytes sent to clients
+    bytes_sent = Int()
+
+    #: Seconds between checks for changes when serving from a thread
+    interval = Float(0.2)
+
+    #: Thread running `serve`
+    thread = Typed(threading.Thread)
+
+    #: Set to stop serving
+    stopped = Typed(threading.Event, ())
+
+    def _default_watcher(self):
+        return create_watcher()
+
+    def scan(self):
+        """ Find the sources under the roots and start watching them """
+        for root in self.roots:
+            root = os.path.abspath(root)
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames
+                               if not d.startswith(('.', '__'))]
+                for name in filenames:
+                    if os.path.splitext(name)[1] not in self.source_exts:
+                        continue
+                    filename = os.path.join(dirpath, name)
+                    if filename not in self.files:
+                        self.files[filename] = module_name(root, filename)
+                        self.watcher.watch(filename)
+
+    def listen(self):
+        """ Scan the roots and start listening for clients. If a port of
+        zero was given the address is updated with the one assigned.
+
+        """
+        self.scan()
+        address = self.address
+        sock = create_socket(address)
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(5)
+        if not isinstance(address, str):
+            self.address = sock.getsockname()[:2]
+        self.listener = sock
+
+    def start(self):
+        """ Listen and serve clients from a background thread """
+        if self.listener is None:
+            self.listen()
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.serve,
+                                       name='hotswap-server', daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        """ Accept clients and push changes until stopped """
+        while not self.stopped.is_set():
+            self.serve_once(self.interval)
+
+    def serve_once(self, timeout=0):
+        """ Handle any pending connections and messages, then push any
+        changed modules.
+
+        Returns
+        -------
+        modnames: list
+            Names of the modules that were sent
+
+        """
+        sockets = [self.listener] + list(self.clients)
+        try:
+            readable, _, _ = select.select(sockets, [], [], timeout)
+        except (OSError, ValueError):
+            readable = []
+        for sock in readable:
+            if sock is self.listener:
+                client, _ = sock.accept()
+                self.clients[client] = None
+            else:
+                self.receive(sock)
+        return self.check()
+
+    def receive(self, client):
+        """ Handle a message from a client """
+        try:
+            kind, payload = recv_message(client)
+        except (OSError, EOFError, ValueError, TypeError):
+            self.disconnect(client)
+            return
+        if kind == 'hello':
+            self.clients[client] = payload.get('tags') == compiler_tags()
+            self.acked[client] = {}
+            self.unacked[client] = {}
+            if self.modified:
+                self.push(self.modified, [client])
+        elif kind == 'ack':
+            unacked = self.unacked.get(client, {})
+            acked = self.acked.get(client, {})
+            for filename, key in payload:
+                data = unacked.get(filename, {}).pop(key, None)
+                if data is not None:
+                    acked[filename] = (key, data)
+        elif kind == 'resend':
+            acked = self.acked.get(client, {})
+            for filename in payload:
+                acked.pop(filename, None)
+            self.push([f for f in payload if f in self.files], [client])
+
+    def disconnect(self, client):
+        """ Close the connection to a client """
+        self.clients.pop(client, None)
+        self.acked.pop(client, None)
+        self.unacked.pop(client, None)
+        try:
+            client.close()
+        except OSError:
+            pass
+
+    def check(self):
+        """ Send the code of any modules changed since the last check to
+        the clients.
+
+        """
+        changed = [f for f in self.watcher.changes() if f in self.files]
+        self.modified.update(changed)
+        if not changed or not self.clients:
+            return []
+        return self.push(changed)
+
+    def push(self, filenames, clients=None):
+        """ Send the modules of the given files to the clients.
+
+        Parameters
+        -----------
+        filenames: iterable
+            The source files to send
+        clients: list or None
+            The client sockets to send to, by default all of them
+
+        Returns
+        -------
+        modnames: list
+            Names of the modules that were sent
+
+        """
+        if clients is None:
+            clients = list(self.clients)
+        clients = [c for c in clients if self.clients.get(c) is not None]
+        codes, sources, modnames = [], [], []
+        #: Only compile if a client can use the code
+        compile = any(self.clients[c] for c in clients)
+        for filename in sorted(filenames):
+            try:
+                with open(filename, 'rb') as f:
+                    source = f.read()
+            except OSError:
+                continue
+            modname = self.files[filename]
+            if compile:
+                try:
+                    code = self.code_cache.get(filename, source)
+                except Exception:
+                    #: Still send the others, the client keeps the old version
+                    print("[hotswap compile of %s failed: %s]" % (
+                        filename, traceback.format_exc(0)))
+                    continue
+                codes.append((modname, filename,
+                              marshal.dumps(code, MARSHAL_VERSION)))
+            sources.append((modname, filename, source))
+            modnames.append(modname)
+
+        #: Deltas are shared by clients that acknowledged the same version
+        deltas = {}
+        for client in clients:
+            if self.clients[client]:
+                kind, items = 'code', codes
+            else:
+                kind, items = 'source', sources
+            message = encode_message((kind, [
+                self.encode(client, modname, filename, payload, deltas)
+                for modname, filename, payload in items]))
+            try:
+                client.sendall(message)
+            except OSError:
+                self.disconnect(client)
+                continue
+            self.bytes_sent += len(message)
+        return modnames
+
+    def encode(self, client, modname, filename, payload, deltas):
+        """ Get the item sent to a client for a module. If the client
+        acknowledged a previous version and the delta against it is smaller
+        than the payload, the payload is replaced by a tuple of
+        (base digest, digest, delta).
+
+        """
+        key = digest(payload)
+        versions = self.unacked[client].setdefault(filename, {})
+        versions.pop(key, None)
+        versions[key] = payload
+        while len(versions) > MAX_VERSIONS:
+            del versions[next(iter(versions))]
+
+        base = self.acked[client].get(filename)
+        if base is None or len(payload) < self.delta_threshold:
+            return (modname, filename, payload)
+        ops = deltas.get((base[0], key))
+        if ops is None:
+            ops = deltas[(base[0], key)] = make_delta(base[1], payload)
+        if len(marshal.dumps(ops)) >= len(payload):
+            return (modname, filename, payload)
+        return (modname, filename, (base[0], key, ops))
+
+    def close(self):
+        """ Stop serving and close all connections """
+        self.stopped.set()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        for client in list(self.clients):
+            self.disconnect(client)
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+        self.watcher.close()
+
+
+class HotswapClient(Atom):
+    """ Runs in the app. Receives the code of changed modules from a
+    `HotswapServer`, reloads the modules with it and updates the view.
+
+    Only modules the app already imported are reloaded, along with any
+    modules importing them. Call `poll` from a timer on the app's event loop
+    or wait on `fileno` and call it when readable.
+
+    Example
+    -----------
+
+    client = HotswapClient(address=('10.0.2.2', 8797), view=view)
+    client.connect()
+    timer.timeout.connect(client.poll)
+
+    """
+    #: Address of the server, a (host, port) tuple or a Unix socket path
+    address = Value(DEFAULT_ADDRESS)
+
+    #: The hotswapper used to reload modules and update the view
+    hotswap = Instance(Hotswapper)
+
+    #: The view to update
+    view = Value()
+
+    #: Connection to the server
+    socket = Value()
+
+    #: Seconds to wait when connecting
+    timeout = Float(10)
+
+    #: Tags of the compilers used by the app, see `compiler_tags`
+    tags = Dict()
+
+    #: Number of modules received
+    received = Int()
+
+    #: Module name -> last code received for it. Dependents of a changed
+    #: module are reloaded with it instead of their local source.
+    codes = Dict()
+
+    #: Filename -> {digest: payload} of the last versions received, deltas
+    #: are applied to these
+    versions = Dict()
+
+    #: Errors raised reloading modules as (modname, exception) tuples
+    errors = List()
+
+    def _default_hotswap(self):
+        return Hotswapper()
+
+    def _default_tags(self):
+        return compiler_tags()
+
+    def connect(self):
+        """ Connect to the server and tell it which compilers are used """
+        sock = create_socket(self.address)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        sock.settimeout(None)
+        self.socket = sock
+        send_message(sock, ('hello', {'tags': dict(self.tags)}))
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def poll(self, timeout=0):
+        """ Apply any messages received from the server.
+
+        Parameters
+        -----------
+        timeout: float or None
+            Seconds to wait for a message, None waits until one arrives
+
+        Returns
+        -------
+        reloaded: list
+            The names of the modules that were reloaded
+
+        """
+        reloaded = []
+        while self.socket is not None:
+            readable, _, _ = select.select([self.socket], [], [], timeout)
+            if not readable:
+                break
+            try:
+                kind, payload = recv_message(self.socket)
+            except (OSError, EOFError, ValueError, TypeError):
+                self.close()
+                break
+            reloaded.extend(self.receive(kind, payload))
+            timeout = 0
+        return reloaded
+
+    def receive(self, kind, payload):
+        """ Handle a message from the server """
+        self.errors = []
+        if kind not in ('code', 'source'):
+            return []
+        modules, acks, resend = [], [], []
+        cache = self.hotswap._reloader.code_cache
+        for modname, filename, data in payload:
+            data = self.decode(filename, data, acks, resend)
+            if data is None:
+                continue
+            try:
+                if kind == 'code':
+                    code = marshal.loads(data)
+                elif cache is not None:
+                    code = cache.get(filename, data)
+                else:
+                    code = compile_source(data, filename)
+            except Exception as e:
+                self.report(modname, e)
+                continue
+            modules.append((modname, code))
+        try:
+            if acks:
+                send_message(self.socket, ('ack', acks))
+            if resend:
+                send_message(self.socket, ('resend', resend))
+        except OSError:
+            self.close()
+        self.received += len(modules)
+        return self.apply(modules)
+
+    def decode(self, filename, data, acks, resend):
+        """ Get the payload of a module, applying it if it's a delta. If
+        the delta cannot be applied the file is added to resend and None is
+        returned, otherwise it is added to the acknowledged versions.
+
+        """
+        versions = self.versions.setdefault(filename, {})
+        if isinstance(data, tuple):
+            base_key, key, ops = data
+            base = versions.get(base_key)
+            if base is None:
+                resend.append(filename)
+                return None
+            data = apply_delta(base, ops)
+            if digest(data) != key:
+                resend.append(filename)
+                return None
+        else:
+            key = digest(data)
+        versions.pop(key, None)
+        versions[key] = data
+        while len(versions) > MAX_VERSIONS:
+            del versions[next(iter(versions))]
+        acks.append((filename, key))
+        return data
+
+    def report(self, modname, error):
+        self.errors.append((modname, error))
+        print("[hotswap remote reload of %s failed: %s]" % (
+            modname, traceback.format_exc(10)))
+
+    def apply(self, modules):
+        """ Reload the modules with the received code, then any modules
+        that import them, and update the view.
+
+        Parameters
+        -----------
+        modules: list
+            List of (modname, code) tuples
+
+        Returns
+        -------
+        reloaded: list
+            The names of the modules that were reloaded
+
+        """
+        hotswap = self.hotswap
+        reloader = hotswap._reloader
+        hotswap.post_execute()
+        changed = [m for m, code in modules if m in sys.modules]
+        codes = self.codes
+        codes.update(modules)
+        if not changed:
+            return []
+
+        summary = SwapSummary()
+        reloader.summary = summary
+        graph = reloader.graph
+        with summary.timed('graph'):
+            graph.refresh(reloader.tracked_modules())
+            modnames = graph.order(graph.affected(changed,
+                                                  reloader.is_reloadable))
+        reloaded = []
+        with summary.timed('reload'), enaml.imports():
+            for modname in modnames:
+                module = sys.modules.get(modname)
+                if module is None:
+                    continue
+                try:
+                    if modname in codes:
+                        reload_code(module, codes[modname],
+                                    reloader.old_objects, summary,
+                                    reloader.changed_globals)
+                    else:
+                        reloader.reload_module(module)
+                except Exception as e:
+                    self.report(modname, e)
+                    continue
+                reloaded.append(modname)
+                graph.invalidate(modname)
+        summary.count('reloaded', len(reloaded))
+
+        hotswap._reloaded.update(reloaded)
+        if reloaded and self.view is not None:
+            self.view = hotswap.update(self.view, summary=summary).view
+        return reloaded
+
+    def close(self):
+        """ Disconnect from the server """
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
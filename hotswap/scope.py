@@ -0,0 +1,147 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Limit the modules that are checked for changes to the app's own sources.
+
+'''
+import os
+import re
+from fnmatch import translate
+from atom.api import Atom, List, Typed, Value
+
+#: Marks the end of a prefix in a trie
+END = ''
+
+
+def make_trie(prefixes):
+    """ Build a trie of nested dicts from lists of components """
+    trie = {}
+    for parts in prefixes:
+        node = trie
+        for part in parts:
+            node = node.setdefault(part, {})
+        node[END] = True
+    return trie
+
+
+def has_prefix(trie, parts):
+    """ Check whether a prefix in the trie starts the list of components """
+    node = trie
+    for part in parts:
+        if END in node:
+            return True
+        node = node.get(part)
+        if node is None:
+            return False
+    return END in node
+
+
+def split_path(path):
+    """ Split a path into its normalized components """
+    path = os.path.normcase(os.path.abspath(path))
+    return [p for p in path.split(os.sep) if p]
+
+
+def compile_globs(patterns):
+    """ Compile the glob patterns into one regex or None if empty """
+    if not patterns:
+        return None
+    return re.compile('|'.join(translate(os.path.normcase(p))
+                               for p in patterns))
+
+
+class Scope(Atom):
+    """ Selects the modules the reloader watches by their source path and
+    package.
+
+    A module is in scope if it is in one of the roots or packages (or
+    neither are given), its source matches one of the include globs (if
+    any) and it matches none of the exclude globs. Globs are matched
+    against the absolute path of the source, ex. `*/tests/*`.
+
+    The roots and packages are compiled into prefix tries so matching a
+    module is a lookup per path or name component.
+
+    """
+    #: Directories whose sources are in scope
+    roots = List()
+
+    #: Package names whose modules are in scope, including subpackages
+    packages = List()
+
+    #: Globs the source path must match one of
+    include = List()
+
+    #: Globs the source path must not match
+    exclude = List()
+
+    #: Compiled trie of the roots
+    root_trie = Typed(dict)
+
+    #: Compiled trie of the packages
+    package_trie = Typed(dict)
+
+    #: Compiled include and exclude patterns
+    include_re = Value()
+    exclude_re = Value()
+
+    def _default_root_trie(self):
+        return make_trie(split_path(root) for root in self.roots)
+
+    def _default_package_trie(self):
+        return make_trie(name.split('.') for name in self.packages)
+
+    def _default_include_re(self):
+        return compile_globs(self.include)
+
+    def _default_exclude_re(self):
+        return compile_globs(self.exclude)
+
+    def _observe_roots(self, change):
+        if change['type'] != 'create':
+            del self.root_trie
+
+    def _observe_packages(self, change):
+        if change['type'] != 'create':
+            del self.package_trie
+
+    def _observe_include(self, change):
+        if change['type'] != 'create':
+            del self.include_re
+
+    def _observe_exclude(self, change):
+        if change['type'] != 'create':
+            del self.exclude_re
+
+    def match(self, modname, filename):
+        """ Check whether the module is in scope.
+
+        Parameters
+        -----------
+        modname: str
+            The module name
+        filename: str
+            The absolute path of the module's source
+
+        Returns
+        -------
+        result: bool
+            Whether the module should be watched
+
+        """
+        if self.roots or self.packages:
+            if not (has_prefix(self.package_trie, modname.split('.')) or
+                    has_prefix(self.root_trie, split_path(filename))):
+                return False
+        if self.include or self.exclude:
+            path = os.path.normcase(filename)
+            include, exclude = self.include_re, self.exclude_re
+            if include is not None and not include.match(path):
+                return False
+            if exclude is not None and exclude.match(path):
+                return False
+        return True
@@ -0,0 +1,173 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+A persistent snapshot of the change keys and hashes of source files.
+
+The file is a header followed by fixed size records sorted by a hash of the
+path, so it can be memory mapped and looked up with a binary search without
+parsing it when the app starts.
+
+'''
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from atom.api import Atom, Int, Str, Typed, Value
+
+#: Magic, version and number of records
+HEADER = struct.Struct('!8sII')
+
+#: Path hash, mtime in ns, size, inode and source digest (zeros if unknown)
+RECORD = struct.Struct('!8sqqQ16s')
+
+MAGIC = b'HSWPSNAP'
+
+VERSION = 1
+
+NO_DIGEST = b'\0' * 16
+
+
+def path_hash(filename):
+    """ Get the key of the record of a file """
+    return hashlib.blake2b(os.fsencode(filename), digest_size=8).digest()
+
+
+class Snapshot(Atom):
+    """ Change keys and source digests of files saved by a previous run.
+
+    Loading only maps the file, records are read when they are looked up.
+
+    """
+    #: Path of the snapshot file
+    path = Str()
+
+    #: Mapped contents of the file or None
+    data = Value()
+
+    #: Number of records in the file
+    count = Int()
+
+    #: Filename -> (change key, digest) updated since the file was loaded
+    entries = Typed(dict, ())
+
+    def load(self):
+        """ Map the snapshot file. A missing or invalid file is treated as
+        an empty snapshot.
+
+        """
+        self.close()
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        if len(data) >= HEADER.size:
+            magic, version, count = HEADER.unpack_from(data)
+            size = HEADER.size + count * RECORD.size
+            if magic == MAGIC and version == VERSION and len(data) == size:
+                self.data = data
+                self.count = count
+                return
+        data.close()
+
+    def close(self):
+        """ Unmap the snapshot file """
+        if self.data is not None:
+            self.data.close()
+        self.data = None
+        self.count = 0
+
+    def find(self, key):
+        """ Find the offset of the record with the given path hash in the
+        mapped file or return None.
+
+        """
+        data = self.data
+        if data is None:
+            return None
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            k = data[offset:offset+8]
+            if k == key:
+                return offset
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, filename):
+        """ Get the saved state of a file.
+
+        Parameters
+        -----------
+        filename: str
+            The absolute path of the source file
+
+        Returns
+        -------
+        result: tuple or None
+            A tuple of the change key (see SourceProvider.change_key) and
+            the source digest, which is None if it was not saved, or None if
+            the file is not in the snapshot.
+
+        """
+        entry = self.entries.get(filename)
+        if entry is not None:
+            return entry
+        offset = self.find(path_hash(filename))
+        if offset is None:
+            return None
+        _, mtime, size, ino, digest = RECORD.unpack_from(self.data, offset)
+        return (mtime, size, ino), (None if digest == NO_DIGEST else digest)
+
+    def update(self, filename, key, digest=None):
+        """ Set the state of a file, it's written by the next save """
+        self.entries[filename] = (tuple(key), digest)
+
+    def save(self):
+        """ Write the records of the file and any updates to the snapshot
+        file and map it again.
+
+        """
+        records = {}
+        data = self.data
+        if data is not None:
+            end = HEADER.size + self.count * RECORD.size
+            for offset in range(HEADER.size, end, RECORD.size):
+                record = data[offset:offset+RECORD.size]
+                records[record[:8]] = record
+        for filename, (key, digest) in self.entries.items():
+            h = path_hash(filename)
+            records[h] = RECORD.pack(h, key[0], key[1], key[2],
+                                     digest or NO_DIGEST)
+        tmp = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            #: Write a temporary file first so other processes never map
+            #: a partially written snapshot
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+                for h in sorted(records):
+                    f.write(records[h])
+            #: A mapped file cannot be replaced on windows
+            self.close()
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print("[hotswap snapshot save to %s failed: %s]" % (self.path, e))
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            if self.data is None:
+                self.load()
+            return
+        self.entries.clear()
+        self.load()
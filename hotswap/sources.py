@@ -0,0 +1,57 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Access to the change keys and contents of source files.
+
+'''
+import os
+from atom.api import Atom
+
+
+class SourceProvider(Atom):
+    """ Provides the change keys and contents of source files to the
+    reloader and watchers.
+
+    The default reads them from the filesystem. Subclasses can serve them
+    from elsewhere, for example from memory in tests (see
+    `hotswap.testing.MemorySources`).
+
+    """
+
+    def change_key(self, filename):
+        """ Get a key that is different whenever the file was modified.
+
+        The key is built from the mtime in nanoseconds, the size and the
+        inode, so an edit within the timestamp granularity of the
+        filesystem is still seen if the size changed or the file was
+        replaced by an atomic save. Keys should only be compared for
+        equality.
+
+        Raises
+        -------
+        OSError:
+            If the file does not exist
+
+        """
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def read(self, filename):
+        """ Read the contents of a file as bytes.
+
+        Raises
+        -------
+        OSError:
+            If the file does not exist
+
+        """
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def exists(self, filename):
+        """ Check whether the file exists """
+        return os.path.isfile(filename)
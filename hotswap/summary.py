@@ -0,0 +1,66 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Timings and counts of what a reload or swap did.
+
+'''
+from time import perf_counter
+from contextlib import contextmanager
+from atom.api import Atom, Typed, Value
+
+
+class SwapSummary(Atom):
+    """ Records how long each phase of a check or update took and counts
+    of the work done, such as modules reloaded or nodes visited.
+
+    Phases may be nested, for example the `patch` phase of superreload is
+    part of the `reload` phase, so the timings do not add up to a total.
+
+    """
+    #: Phase name -> seconds spent in it
+    timings = Typed(dict, ())
+
+    #: Counter name -> count
+    counts = Typed(dict, ())
+
+    #: The view that was updated. If its class was migrated this is the
+    #: new instance which replaced the one passed to the update.
+    view = Value()
+
+    def count(self, key, n=1):
+        """ Increment a counter """
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def add_time(self, phase, seconds):
+        """ Add the seconds to the time spent in the phase """
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, phase):
+        """ Time the block and add it to the phase """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, perf_counter() - start)
+
+    def merge(self, other):
+        """ Add the timings and counts of another summary to this one """
+        for phase, seconds in other.timings.items():
+            self.add_time(phase, seconds)
+        for key, n in other.counts.items():
+            self.count(key, n)
+
+    def as_dict(self):
+        """ Return the summary as a dict that can be serialized to json """
+        return {'timings': dict(self.timings), 'counts': dict(self.counts)}
+
+    def __repr__(self):
+        timings = ', '.join('%s=%.2fms' % (k, v*1000)
+                            for k, v in self.timings.items())
+        counts = ', '.join('%s=%s' % (k, v) for k, v in self.counts.items())
+        return '<SwapSummary %s; %s>' % (timings, counts)
@@ -0,0 +1,288 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+A headless harness to run hotswap scenarios without a display, files on
+disk or sleeping for mtimes to change.
+
+'''
+import os
+import sys
+import errno
+import types
+from importlib.util import spec_from_loader
+from atom.api import Atom, Bool, Dict, Float, List, Str, Typed
+import enaml
+from .compiler import CodeCache
+from .core import EnamlReloader, Hotswapper
+from .sources import SourceProvider
+from .watcher import ChangeBatcher, PollingWatcher
+
+
+#: Code cache used by harnesses that were not given one
+SHARED_CODE_CACHE = CodeCache(limit=0)
+
+
+class VirtualClock(Atom):
+    """ A clock that only moves when it's advanced. It can be used as the
+    clock of a `ChangeBatcher`.
+
+    """
+    #: Current time in seconds
+    now = Float(1.0)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds=1.0):
+        """ Move the clock forward and return the new time """
+        self.now += seconds
+        return self.now
+
+
+class MemorySources(SourceProvider):
+    """ Sources kept in memory. Each write advances the clock by a tick
+    and uses it as the file's mtime so every change is seen by the reloader.
+
+    """
+    #: Clock used for the mtimes
+    clock = Typed(VirtualClock, ())
+
+    #: Seconds the clock is advanced by each write
+    tick = Float(0.001)
+
+    #: Filename -> (mtime, source bytes)
+    files = Dict()
+
+    def write(self, filename, source):
+        """ Set the source of a file.
+
+        Parameters
+        -----------
+        filename: str
+            The absolute path of the file
+        source: str or bytes
+            The new source
+
+        """
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        self.files[filename] = (self.clock.advance(self.tick), source)
+
+    def touch(self, filename):
+        """ Update the mtime of a file without changing its source """
+        self.write(filename, self.read(filename))
+
+    def remove(self, filename):
+        """ Delete a file """
+        self.files.pop(filename, None)
+
+    def _get(self, filename):
+        try:
+            return self.files[filename]
+        except KeyError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    filename)
+
+    def change_key(self, filename):
+        mtime, source = self._get(filename)
+        return (int(mtime * 1e9), len(source), 0)
+
+    def read(self, filename):
+        return self._get(filename)[1]
+
+    def exists(self, filename):
+        return filename in self.files
+
+
+class MemoryLoader(object):
+    """ Loader of modules created by the harness. It gives the dependency
+    graph access to the code of the current source.
+
+    """
+    def __init__(self, sources, cache, filename):
+        self.sources = sources
+        self.cache = cache
+        self.filename = filename
+
+    def get_source(self, fullname):
+        return self.sources.read(self.filename).decode('utf-8')
+
+    def get_code(self, fullname):
+        return self.cache.get(self.filename, self.sources.read(self.filename))
+
+
+class Harness(Atom):
+    """ Runs hotswap scenarios headless and without sleeping.
+
+    Modules are loaded from in-memory sources and the reloader uses a
+    virtual clock for their mtimes so an edit is picked up by the very next
+    `swap`. Views can be any `Declarative` tree, no toolkit is needed. This
+    makes each scenario take milliseconds so they can also be used to catch
+    performance regressions using the recorded `summaries`.
+
+    Example
+    -----------
+
+    with Harness() as harness:
+        module = harness.load('my_view', SOURCE)
+        view = harness.view('my_view')
+        harness.edit('my_view', EDITED_SOURCE)
+        harness.swap(view)
+
+    """
+    #: Clock used for the source mtimes and batching
+    clock = Typed(VirtualClock, ())
+
+    #: In-memory sources of the modules
+    sources = Typed(MemorySources)
+
+    #: Directory the module filenames are made up in, nothing is written
+    root = Str()
+
+    #: Use a polling watcher over the sources instead of checking the
+    #: loaded modules
+    watch = Bool()
+
+    #: Batch changes for this many seconds of the virtual clock
+    debounce = Float()
+
+    #: Cache of the compiled sources, by default shared by all harnesses
+    #: so each scenario only compiles the sources it did not see yet
+    code_cache = Typed(CodeCache)
+
+    #: The hotswapper under test
+    hotswap = Typed(Hotswapper)
+
+    #: Names of the modules loaded by the harness
+    modules = List()
+
+    #: Summary of each swap
+    summaries = List()
+
+    def _default_code_cache(self):
+        return SHARED_CODE_CACHE
+
+    def _default_sources(self):
+        return MemorySources(clock=self.clock)
+
+    def _default_root(self):
+        return os.path.join(os.path.abspath(os.sep), '__hotswap_harness__')
+
+    def _default_hotswap(self):
+        watcher = None
+        if self.watch or self.debounce:
+            watcher = PollingWatcher(sources=self.sources)
+        if self.debounce:
+            watcher = ChangeBatcher(watcher=watcher, quiet=self.debounce,
+                                    clock=self.clock)
+        #: Only the modules loaded by the harness are reloadable so the
+        #: rest of sys.modules is never checked or scanned for imports
+        reloader = EnamlReloader(check_all=False, watcher=watcher,
+                                 sources=self.sources,
+                                 code_cache=self.code_cache)
+        return Hotswapper('1', _reloader=reloader)
+
+    def filename(self, modname, ext='.enaml'):
+        """ Get the made up filename of a module """
+        return os.path.join(self.root, *modname.split('.')) + ext
+
+    def load(self, modname, source, ext='.enaml'):
+        """ Create a module from the source and add it to sys.modules.
+
+        Parameters
+        -----------
+        modname: str
+            Name of the module. The parent package must be loaded already.
+        source: str
+            The module source
+        ext: str
+            The file extension, `.enaml` or `.py`
+
+        Returns
+        -------
+        module: module
+            The loaded module
+
+        """
+        reloader = self.hotswap._reloader
+        filename = self.filename(modname, ext)
+        self.sources.write(filename, source)
+        loader = MemoryLoader(self.sources, self.code_cache, filename)
+        code = loader.get_code(modname)
+        module = types.ModuleType(modname)
+        module.__file__ = filename
+        module.__loader__ = loader
+        module.__spec__ = spec_from_loader(modname, loader, origin=filename)
+        module.__spec__.has_location = True
+        sys.modules[modname] = module
+        try:
+            with enaml.imports():
+                exec(code, module.__dict__)
+        except Exception:
+            del sys.modules[modname]
+            raise
+        self.modules.append(modname)
+        reloader.update_index([modname])
+        reloader.mark_module_reloadable(modname)
+        return module
+
+    def module(self, modname):
+        """ Get a module loaded by the harness """
+        return sys.modules[modname]
+
+    def edit(self, modname, source, ext='.enaml'):
+        """ Change the source of a loaded module """
+        self.sources.write(self.filename(modname, ext), source)
+
+    def touch(self, modname, ext='.enaml'):
+        """ Change the mtime of a module without changing its source """
+        self.sources.touch(self.filename(modname, ext))
+
+    def advance(self, seconds):
+        """ Move the virtual clock forward, for example past the debounce
+        window.
+
+        """
+        self.clock.advance(seconds)
+
+    def view(self, modname, name='Main', **kwargs):
+        """ Create and initialize a declarative from a loaded module """
+        view = getattr(self.module(modname), name)(**kwargs)
+        view.initialize()
+        return view
+
+    def swap(self, view):
+        """ Reload the changed modules and update the view with them.
+
+        Returns
+        -------
+        reloaded: list
+            The names of the modules that were reloaded
+
+        """
+        reloaded = self.hotswap.poll(view)
+        if reloaded:
+            self.summaries.append(self.hotswap.summary)
+        return reloaded
+
+    def close(self):
+        """ Remove the loaded modules and stop watching """
+        reloader = self.hotswap._reloader
+        for modname in reversed(self.modules):
+            sys.modules.pop(modname, None)
+        reloader.update_index(removed=self.modules)
+        for modname in self.modules:
+            reloader.modules.pop(modname, None)
+        self.modules = []
+        if reloader.watcher is not None:
+            reloader.watcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
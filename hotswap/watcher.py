@@ -0,0 +1,470 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Watchers used by the ModuleReloader to find out which source files changed
+without having to stat every module in sys.modules on each check.
+
+'''
+import os
+import sys
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import threading
+from time import monotonic
+from collections import deque
+from atom.api import Atom, Callable, Dict, Float, Instance, Int, Typed, Value
+from .sources import SourceProvider
+
+
+class Watcher(Atom):
+    """ Base class for a file watcher backend.
+
+    Changed paths are pushed into the `queue` as they are detected and
+    consumed with `changes()`. By default the watched paths are stat polled,
+    backends that receive change events only poll the paths they cannot
+    watch otherwise.
+
+    """
+    #: Absolute paths being watched
+    paths = Typed(set, ())
+
+    #: Last seen change key of each stat polled path
+    keys = Dict()
+
+    #: Provides the change keys of the stat polled paths
+    sources = Typed(SourceProvider, ())
+
+    #: Changed paths that have not been consumed yet
+    queue = Typed(deque, ())
+
+    #: Seconds to wait between polls when running in a thread
+    interval = Float(0.2)
+
+    #: Guards the queue when polling from a thread
+    lock = Value(factory=threading.Lock)
+
+    #: Background polling thread started with `start`
+    thread = Typed(threading.Thread)
+
+    #: Set to stop the background thread
+    stopped = Typed(threading.Event, ())
+
+    def watch(self, path):
+        """ Start watching the given path for changes
+
+        Parameters
+        -----------
+        path: str
+            Absolute path of the file to watch
+
+        """
+        self.paths.add(path)
+        self.track(path)
+
+    def unwatch(self, path):
+        """ Stop watching the given path """
+        self.paths.discard(path)
+        self.keys.pop(path, None)
+
+    def track(self, path):
+        """ Stat poll the path by recording its current change key """
+        try:
+            self.keys[path] = self.sources.change_key(path)
+        except OSError:
+            self.keys[path] = None
+
+    def polling(self):
+        """ Check whether any paths are stat polled, in which case the
+        watcher has to be polled even if it has a file descriptor.
+
+        """
+        return bool(self.keys)
+
+    def poll(self):
+        """ Push any paths that changed since the last poll into the queue.
+
+        """
+        keys, sources = self.keys, self.sources
+        for path in list(keys):
+            try:
+                key = sources.change_key(path)
+            except OSError:
+                key = None
+            if key != keys[path]:
+                keys[path] = key
+                self.queue.append(path)
+
+    def changes(self):
+        """ Poll and return the set of paths that changed since the last
+        call.
+
+        """
+        with self.lock:
+            self.poll()
+            changed = set()
+            queue = self.queue
+            while queue:
+                changed.add(queue.popleft())
+        return changed
+
+    def fileno(self):
+        """ Return a file descriptor that becomes readable when changes are
+        available or None if the watcher has to be polled.
+
+        """
+        return None
+
+    def wait(self, timeout):
+        """ Block until changes may be available or the timeout elapsed """
+        self.stopped.wait(timeout)
+
+    def start(self, callback):
+        """ Poll in a background thread and call the callback with the
+        list of changed paths as soon as they are detected. The paths stay
+        queued so they are still returned by `changes`.
+
+        The callback is invoked from the background thread.
+
+        """
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, args=(callback,),
+                                       name='hotswap-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the background thread """
+        thread = self.thread
+        if thread is None:
+            return
+        self.stopped.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        self.thread = None
+
+    def _run(self, callback):
+        queue = self.queue
+        while not self.stopped.is_set():
+            with self.lock:
+                n = len(queue)
+                self.poll()
+                changed = [queue[i] for i in range(n, len(queue))]
+            if changed:
+                try:
+                    callback(changed)
+                except Exception:
+                    pass  # The callback reports its own errors
+            self.wait(self.interval)
+
+    def close(self):
+        """ Release any resources held by the watcher """
+        self.stop()
+        self.paths.clear()
+        self.keys.clear()
+        self.queue.clear()
+
+
+class PollingWatcher(Watcher):
+    """ A watcher that falls back to stat polling the watched paths.
+
+    This is still O(watched files) but only touches paths the reloader
+    registered instead of every module in sys.modules.
+
+    """
+
+
+class ChangeBatcher(Watcher):
+    """ Wraps another watcher and coalesces the changes it reports into
+    batches.
+
+    Changes are only returned by `changes()` once no new change was seen
+    for the `quiet` window, so the several writes an editor does per save
+    or the files saved by a refactor are reloaded together.
+
+    """
+    #: The watcher reporting the changes
+    watcher = Instance(Watcher)
+
+    #: Seconds without changes before a batch is released
+    quiet = Float(0.1)
+
+    #: Release the batch after this many seconds even if changes keep
+    #: coming in. Zero means no limit.
+    max_delay = Float(2.0)
+
+    #: Returns the current time in seconds
+    clock = Callable(monotonic)
+
+    #: Paths changed in the current batch
+    pending = Typed(set, ())
+
+    #: Time the first and last change of the batch was seen
+    first = Float()
+    last = Float()
+
+    def watch(self, path):
+        self.paths.add(path)
+        self.watcher.watch(path)
+
+    def unwatch(self, path):
+        self.paths.discard(path)
+        self.watcher.unwatch(path)
+
+    def polling(self):
+        return self.watcher.polling()
+
+    def poll(self):
+        changed = self.watcher.changes()
+        if not changed:
+            return
+        now = self.clock()
+        if not self.pending:
+            self.first = now
+        self.last = now
+        self.pending.update(changed)
+
+    def fileno(self):
+        return self.watcher.fileno()
+
+    def remaining(self):
+        """ Seconds until the current batch may be released or None if
+        there are no pending changes.
+
+        """
+        if not self.pending:
+            return None
+        now = self.clock()
+        remaining = self.quiet - (now - self.last)
+        if self.max_delay > 0:
+            remaining = min(remaining, self.max_delay - (now - self.first))
+        return max(remaining, 0)
+
+    def ready(self):
+        """ Check whether the current batch should be released """
+        if not self.pending:
+            return False
+        now = self.clock()
+        if now - self.last >= self.quiet:
+            return True
+        return 0 < self.max_delay <= now - self.first
+
+    def changes(self):
+        """ Poll and return the batch of changed paths once the changes
+        settled, otherwise return an empty set.
+
+        """
+        with self.lock:
+            self.poll()
+            if not self.ready():
+                return set()
+            changed = self.pending
+            self.pending = set()
+        return changed
+
+    def start(self, callback):
+        """ Start the wrapped watcher's thread. The callback receives the
+        changes as they happen, not batched.
+
+        """
+        self.watcher.start(callback)
+
+    def stop(self):
+        self.watcher.stop()
+
+    def close(self):
+        super(ChangeBatcher, self).close()
+        self.pending.clear()
+        self.watcher.close()
+
+
+#: inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+#: Events that may indicate a file's contents changed. Editors that save
+#: atomically rename a temp file over the original so IN_MOVED_TO is needed.
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB
+
+#: Size of the fixed part of struct inotify_event
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher(Watcher):
+    """ A watcher using Linux's inotify to receive change events for the
+    directories containing the watched files.
+
+    Directories are watched instead of files so atomic saves (write to a
+    temp file then rename) are still picked up. Files in directories that
+    cannot be watched, for example because they were removed, are stat
+    polled until their directory can be watched again.
+
+    """
+    #: The inotify file descriptor
+    fd = Int(-1)
+
+    #: Watch descriptor to directory
+    wds = Dict()
+
+    #: Directory to watch descriptor
+    dirs = Dict()
+
+    #: libc handle, shared by all instances
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        """ Check whether inotify can be used on this system """
+        if cls._libc is None:
+            cls._libc = _load_libc() or False
+        return bool(cls._libc)
+
+    def __init__(self, *args, **kwargs):
+        super(InotifyWatcher, self).__init__(*args, **kwargs)
+        if not self.available():
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout):
+        """ Wait until inotify has events to read """
+        if self.fd < 0:
+            return super(InotifyWatcher, self).wait(timeout)
+        try:
+            select.select([self.fd], [], [], timeout)
+        except (OSError, ValueError):
+            pass
+
+    def watch(self, path):
+        self.paths.add(path)
+        directory = os.path.dirname(path)
+        if directory not in self.dirs and not self.add_watch(directory):
+            #: Directory is gone or unreadable
+            self.track(path)
+
+    def add_watch(self, directory):
+        """ Watch the directory and return whether that succeeded """
+        if self.fd < 0:
+            return False
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                          IN_WATCH_MASK)
+        if wd < 0:
+            return False
+        self.dirs[directory] = wd
+        self.wds[wd] = directory
+        return True
+
+    def poll(self):
+        if self.fd < 0:
+            return
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                break
+            if not data:
+                break
+            self._parse_events(data)
+        if self.keys:
+            self._poll_unwatched()
+
+    def _poll_unwatched(self):
+        """ Stat poll the paths whose directory is not watched and stop
+        polling them once it can be watched again.
+
+        """
+        keys = self.keys
+        directories = {os.path.dirname(path) for path in keys}
+        watched = {d for d in directories
+                   if d in self.dirs or self.add_watch(d)}
+        #: Changes made before the watch was added are only seen by stat
+        super(InotifyWatcher, self).poll()
+        for path in list(keys):
+            if os.path.dirname(path) in watched:
+                del keys[path]
+
+    def _parse_events(self, data):
+        """ Parse a buffer of inotify_event structs and queue any watched
+        paths they refer to.
+
+        """
+        paths, queue, wds = self.paths, self.queue, self.wds
+        offset, size = 0, len(data)
+        while offset < size:
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                #: Events were dropped, assume everything changed
+                queue.extend(paths)
+                continue
+            if mask & IN_IGNORED:
+                #: The directory was removed, poll its files until it's
+                #: created again. They're gone so any file found then is
+                #: reported as changed.
+                directory = wds.pop(wd, None)
+                if directory is not None:
+                    self.dirs.pop(directory, None)
+                    for path in paths:
+                        if os.path.dirname(path) == directory:
+                            self.keys[path] = None
+                continue
+            directory = wds.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if path in paths:
+                queue.append(path)
+
+    def close(self):
+        super(InotifyWatcher, self).close()
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.wds.clear()
+        self.dirs.clear()
+
+
+def create_watcher():
+    """ Create the best watcher available for this platform """
+    if InotifyWatcher.available():
+        return InotifyWatcher()
+    return PollingWatcher()
@@ -0,0 +1,43 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Fixtures and helpers shared by the tests.
+
+'''
+import os
+import sys
+import pytest
+from pathlib import Path
+from textwrap import dedent
+
+
+@pytest.fixture
+def package(tmp_path):
+    """ Add a temporary directory to sys.path and clean up any modules
+    imported from it afterwards.
+
+    """
+    sys.path.insert(0, str(tmp_path))
+    yield tmp_path
+    sys.path.remove(str(tmp_path))
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None) or ''
+        if filename.startswith(str(tmp_path)):
+            del sys.modules[name]
+
+
+def write_module(path, source):
+    """ Write the source and bump the mtime past the previous one so the
+    change is always seen, even for edits within the same second which
+    bytecode caches cannot tell apart.
+
+    """
+    path = Path(path)
+    previous = path.stat().st_mtime if path.exists() else 0
+    path.write_text(dedent(source))
+    st = path.stat()
+    os.utime(str(path), (st.st_atime, max(st.st_mtime, previous) + 10))
@@ -0,0 +1,134 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Hotswap scenarios run with the headless harness. Each one checks the
+counts of the work done so they also catch performance regressions.
+
+'''
+import pytest
+from textwrap import dedent
+from hotswap.testing import Harness
+
+
+HEADER = """
+from enaml.core.api import Declarative
+
+enamldef Item(Declarative):
+    attr text = ""
+
+"""
+
+VIEW = HEADER + """
+enamldef Main(Declarative): view:
+    attr title = "main"
+    Item: a:
+        text = "a"
+    Item: b:
+        text = "b"
+    Item: c:
+        text = "c"
+"""
+
+
+@pytest.fixture
+def harness():
+    with Harness() as harness:
+        yield harness
+
+
+def texts(view):
+    return [c.text for c in view.children]
+
+
+SCENARIOS = {
+    'none': (VIEW, ['a', 'b', 'c'], {'created': 0}),
+    'text': (VIEW.replace('"b"', '"b2"'), ['a', 'b2', 'c'], {'created': 0}),
+    'insert': (VIEW + '    Item:\n        text = "d"\n',
+               ['a', 'b', 'c', 'd'], {'created': 1}),
+    'remove': (VIEW.replace('    Item: c:\n        text = "c"\n', ''),
+               ['a', 'b'], {'destroyed': 1}),
+}
+
+
+@pytest.mark.parametrize('edit', sorted(SCENARIOS))
+def test_scenario(harness, edit):
+    source, expected, counts = SCENARIOS[edit]
+    harness.load('hs_harness_view', VIEW)
+    view = harness.view('hs_harness_view')
+    children = list(view.children)
+
+    harness.edit('hs_harness_view', source)
+    assert harness.swap(view) == ['hs_harness_view']
+    assert texts(view) == expected
+    #: Existing nodes are kept
+    assert view.children[:2] == children[:2]
+    summary = harness.summaries[-1]
+    for key, n in counts.items():
+        assert summary.counts.get(key, 0) == n
+
+
+def test_unchanged(harness):
+    harness.load('hs_harness_view', VIEW)
+    view = harness.view('hs_harness_view')
+    assert harness.swap(view) == []
+    assert harness.summaries == []
+
+
+def test_dependents(harness):
+    harness.load('hs_harness_util', dedent("""
+    def label(x):
+        return 'item %s' % x
+    """), ext='.py')
+    harness.load('hs_harness_view', HEADER + dedent("""
+    from hs_harness_util import label
+
+    enamldef Main(Declarative): view:
+        Item:
+            text = label(1)
+    """))
+    view = harness.view('hs_harness_view')
+    assert texts(view) == ['item 1']
+
+    harness.edit('hs_harness_util', dedent("""
+    def label(x):
+        return 'label %s' % x
+    """), ext='.py')
+    reloaded = harness.swap(view)
+    assert reloaded == ['hs_harness_util', 'hs_harness_view']
+    assert texts(view) == ['label 1']
+
+
+def test_debounce():
+    with Harness(debounce=0.5) as harness:
+        harness.load('hs_harness_view', VIEW)
+        view = harness.view('hs_harness_view')
+        harness.edit('hs_harness_view', VIEW.replace('"a"', '"a2"'))
+        assert harness.swap(view) == []
+
+        #: Another change within the window delays the batch
+        harness.advance(0.4)
+        harness.edit('hs_harness_view', VIEW.replace('"a"', '"a3"'))
+        assert harness.swap(view) == []
+        harness.advance(0.4)
+        assert harness.swap(view) == []
+        harness.advance(0.2)
+        assert harness.swap(view) == ['hs_harness_view']
+        assert texts(view) == ['a3', 'b', 'c']
+
+
+def test_syntax_error(harness, capsys):
+    harness.load('hs_harness_view', VIEW)
+    view = harness.view('hs_harness_view')
+    harness.edit('hs_harness_view', VIEW + '    Item:\n  text = \n')
+    assert harness.swap(view) == []
+    assert 'autoreload of hs_harness_view failed' in capsys.readouterr().out
+    assert texts(view) == ['a', 'b', 'c']
+
+    #: Fixing it reloads again
+    harness.edit('hs_harness_view', VIEW.replace('"c"', '"c2"'))
+    assert harness.swap(view) == ['hs_harness_view']
+    assert texts(view) == ['a', 'b', 'c2']
@@ -0,0 +1,510 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Headless tests of the module reloader (no Qt required).
+
+'''
+import os
+import sys
+import shutil
+import pytest
+from hotswap.autoreload import ModuleReloader
+from hotswap.watcher import InotifyWatcher, PollingWatcher
+from conftest import write_module
+
+
+WATCHERS = [PollingWatcher]
+if InotifyWatcher.available():
+    WATCHERS.append(InotifyWatcher)
+
+
+@pytest.mark.parametrize('watcher_cls', WATCHERS)
+def test_watcher_check(package, watcher_cls):
+    write_module(package / 'hs_leaf.py', """
+        def value():
+            return 1
+    """)
+    write_module(package / 'hs_other.py', "x = 1\n")
+    import hs_leaf
+    import hs_other
+    value = hs_leaf.value
+
+    reloader = ModuleReloader(watcher=watcher_cls())
+    assert os.path.abspath(hs_leaf.__file__) in reloader.index.files
+
+    write_module(package / 'hs_leaf.py', """
+        def value():
+            return 2
+    """)
+    assert reloader.changed_modules() == ['hs_leaf']
+
+    write_module(package / 'hs_leaf.py', """
+        def value():
+            return 3
+    """)
+    reloader.check()
+    assert value() == 3
+    assert reloader.changed_modules() == []
+    reloader.watcher.close()
+
+
+@pytest.mark.parametrize('watcher_cls', WATCHERS)
+def test_recreated_directory(tmp_path, watcher_cls):
+    directory = tmp_path / 'hs_pkg'
+    directory.mkdir()
+    path = directory / 'mod.py'
+    write_module(path, "x = 1\n")
+    watcher = watcher_cls()
+    watcher.watch(str(path))
+    try:
+        assert watcher.changes() == set()
+        shutil.rmtree(str(directory))
+        watcher.changes()
+
+        #: The file is found when the directory is created again
+        directory.mkdir()
+        write_module(path, "x = 2\n")
+        assert watcher.changes() == {str(path)}
+        if watcher_cls is InotifyWatcher:
+            assert str(directory) in watcher.dirs
+            assert not watcher.polling()
+
+        write_module(path, "x = 3\n")
+        assert watcher.changes() == {str(path)}
+    finally:
+        watcher.close()
+
+
+def test_index_updates(package):
+    write_module(package / 'hs_indexed.py', "x = 1\n")
+    reloader = ModuleReloader()
+    assert 'hs_indexed' not in reloader.index.filenames
+
+    import hs_indexed
+    reloader.update_index(*reloader.index.diff())
+    filename = os.path.abspath(hs_indexed.__file__)
+    assert reloader.index.filenames['hs_indexed'] == filename
+    assert reloader.index.files[filename] == ['hs_indexed']
+    assert 'hs_indexed' in reloader.modules_mtimes
+    assert 'sys' in reloader.index.ignored
+
+    del sys.modules['hs_indexed']
+    reloader.update_index(*reloader.index.diff())
+    assert 'hs_indexed' not in reloader.index.filenames
+    assert filename not in reloader.index.files
+
+
+def test_reload_dependents(package):
+    sys._hs_reloaded = reloaded = []
+    log = "import sys\nsys._hs_reloaded.append(__name__)\n"
+    write_module(package / 'hs_base.py', log + "def value():\n    return 1\n")
+    write_module(package / 'hs_mid.py', log + "from hs_base import value\n")
+    write_module(package / 'hs_top.py', log + "import hs_mid\n"
+                                              "value = hs_mid.value()\n")
+    write_module(package / 'hs_unrelated.py', log)
+    import hs_top
+    import hs_unrelated
+    reloader = ModuleReloader()
+    del reloaded[:]
+
+    write_module(package / 'hs_base.py', log + "def value():\n    return 2\n")
+    reloader.check()
+    assert reloaded == ['hs_base', 'hs_mid', 'hs_top']
+    assert hs_top.value == 2
+    assert reloader.graph.dependents['hs_base'] == {'hs_mid'}
+    #: The imports of the stdlib are not scanned
+    assert 'textwrap' in reloader.index.filenames
+    assert 'textwrap' not in reloader.graph.imports
+    assert 'hs_unrelated' in reloader.graph.imports
+    del sys._hs_reloaded
+
+
+def test_hash_skips_touch(package):
+    write_module(package / 'hs_touched.py', "x = 1\n")
+    import hs_touched
+    hs_touched.x = 2
+    reloader = ModuleReloader(use_hash=True)
+
+    #: Only the mtime changes
+    write_module(package / 'hs_touched.py', "x = 1\n")
+    reloader.check()
+    assert hs_touched.x == 2
+    assert reloader.stats['unchanged'] == 1
+
+    write_module(package / 'hs_touched.py', "x = 3\n")
+    reloader.check()
+    assert hs_touched.x == 3
+    assert reloader.stats['reloaded'] == 1
+
+
+def test_object_registry():
+    import gc
+    from hotswap.autoreload import ObjectRegistry
+
+    class Obj(object):
+        pass
+
+    registry = ObjectRegistry(limit=2)
+    a, b, c = Obj(), Obj(), Obj()
+    for obj in (a, a, b):
+        registry.add(('mod', 'name'), obj)
+    assert registry.get(('mod', 'name')) == [a, b]
+    registry.add(('mod', 'name'), c)
+    assert registry.get(('mod', 'name')) == [b, c]
+
+    registry.add(('mod', 'other'), a)
+    assert registry.stats() == {'keys': 2, 'objects': 3}
+    del a
+    gc.collect()
+    assert ('mod', 'other') not in registry
+    registry.clear('mod')
+    assert registry.stats() == {'keys': 0, 'objects': 0}
+
+
+def test_registry_stays_flat(package):
+    import gc
+    source = "class A(object):\n    def value(self):\n        return %i\n"
+    write_module(package / 'hs_many.py', source % -1)
+    import hs_many
+    instance = hs_many.A()
+    reloader = ModuleReloader()
+    for i in range(20):
+        write_module(package / 'hs_many.py', source % i)
+        reloader.check()
+    assert instance.value() == 19
+    gc.collect()
+    #: Classes no longer used by anything are dropped
+    assert reloader.old_objects.stats()['objects'] <= 3
+
+
+def test_code_cache(package, tmp_path_factory):
+    from hotswap.compiler import CodeCache
+    directory = str(tmp_path_factory.mktemp('codes'))
+    source = "def value():\n    return %i\n"
+    write_module(package / 'hs_cached.py', source % 1)
+    import hs_cached
+    value = hs_cached.value
+    reloader = ModuleReloader(code_cache=CodeCache(directory=directory))
+
+    write_module(package / 'hs_cached.py', source % 2)
+    reloader.check()
+    assert value() == 2
+    assert hs_cached.__file__.endswith('hs_cached.py')
+
+    #: Reverting the edit reuses the code compiled earlier
+    write_module(package / 'hs_cached.py', source % 1)
+    reloader.check()
+    write_module(package / 'hs_cached.py', source % 2)
+    reloader.check()
+    assert value() == 2
+    cache = reloader.code_cache
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    #: Another process would find it in the directory
+    other = CodeCache(directory=directory)
+    other.get(os.path.abspath(hs_cached.__file__))
+    assert (other.hits, other.misses) == (1, 0)
+
+
+def test_code_cache_enaml(package):
+    import enaml
+    from hotswap.core import EnamlReloader
+    from hotswap.compiler import CodeCache
+    source = """
+        from enaml.core.api import Declarative
+        enamldef Item(Declarative):
+            attr text = "%s"
+    """
+    write_module(package / 'hs_cached_view.enaml', source % "a")
+    with enaml.imports():
+        import hs_cached_view
+    reloader = EnamlReloader(code_cache=CodeCache())
+
+    write_module(package / 'hs_cached_view.enaml', source % "b")
+    reloader.check()
+    assert hs_cached_view.Item().text == "b"
+    assert reloader.code_cache.misses == 1
+
+
+@pytest.mark.parametrize('watcher_cls', WATCHERS)
+def test_precompile(package, watcher_cls, capsys):
+    import time
+    source = "def value():\n    return %s\n"
+    write_module(package / 'hs_early.py', source % 1)
+    import hs_early
+    value = hs_early.value
+    reloader = ModuleReloader(watcher=watcher_cls(interval=0.01))
+    reloader.start_precompiling()
+    precompiler = reloader.precompiler
+    filename = os.path.abspath(hs_early.__file__)
+
+    def compiled():
+        deadline = time.time() + 5
+        while filename not in precompiler.futures:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        precompiler.wait(filename)
+
+    try:
+        #: Syntax errors are reported without reloading
+        write_module(package / 'hs_early.py', source % "(")
+        compiled()
+        assert isinstance(precompiler.errors[filename], SyntaxError)
+        assert 'hotswap compile of' in capsys.readouterr().out
+        assert value() == 1
+
+        write_module(package / 'hs_early.py', source % 2)
+        compiled()
+        assert not precompiler.errors
+        misses = reloader.code_cache.misses
+        reloader.check()
+        assert value() == 2
+        assert reloader.code_cache.misses == misses
+    finally:
+        reloader.stop_precompiling()
+        reloader.watcher.close()
+
+
+def test_bulk_compile(package):
+    sys._hs_reloaded = reloaded = []
+    log = "import sys\nsys._hs_reloaded.append(__name__)\n"
+    write_module(package / 'hs_bulk_a.py', log + "value = 1\n")
+    write_module(package / 'hs_bulk_b.py', log + "from hs_bulk_a import value\n")
+    write_module(package / 'hs_bulk_c.py', log + "import hs_bulk_b\n")
+    import hs_bulk_c
+    reloader = ModuleReloader(bulk_compile=2, max_workers=2)
+    del reloaded[:]
+
+    write_module(package / 'hs_bulk_a.py', log + "value = 2\n")
+    write_module(package / 'hs_bulk_c.py', log + "import hs_bulk_b\n"
+                                                 "value = hs_bulk_b.value\n")
+    reloader.check()
+    assert reloaded == ['hs_bulk_a', 'hs_bulk_b', 'hs_bulk_c']
+    assert hs_bulk_c.value == 2
+    assert reloader.stats['compiled'] == 3
+    assert reloader.code_cache.hits == 3
+    assert reloader.code_cache.misses == 0
+
+    #: The pool is reused by the next bulk compile
+    pool = reloader.compile_pool
+    write_module(package / 'hs_bulk_a.py', log + "value = 3\n")
+    reloader.check()
+    assert hs_bulk_c.value == 3
+    assert reloader.compile_pool is pool
+    reloader.close()
+    assert reloader.compile_pool is None
+    del sys._hs_reloaded
+
+
+def test_change_batcher(package):
+    from hotswap.watcher import ChangeBatcher
+    now = [0.0]
+    write_module(package / 'hs_batch_a.py', "x = 1\n")
+    write_module(package / 'hs_batch_b.py', "y = 1\n")
+    import hs_batch_a
+    import hs_batch_b
+    batcher = ChangeBatcher(watcher=PollingWatcher(), quiet=0.5,
+                            max_delay=5, clock=lambda: now[0])
+    reloader = ModuleReloader(watcher=batcher)
+
+    write_module(package / 'hs_batch_a.py', "x = 2\n")
+    assert reloader.check() == []
+    now[0] = 0.3
+    write_module(package / 'hs_batch_b.py', "y = 2\n")
+    assert reloader.check() == []
+    now[0] = 0.7
+    assert reloader.check() == []
+    assert hs_batch_a.x == 1
+
+    #: Both are reloaded together once nothing changed for the window
+    now[0] = 0.8
+    assert sorted(reloader.check()) == ['hs_batch_a', 'hs_batch_b']
+    assert (hs_batch_a.x, hs_batch_b.y) == (2, 2)
+
+    #: Changes that keep coming in are released after max_delay
+    for i in range(6):
+        now[0] = 1 + i
+        write_module(package / 'hs_batch_a.py', "x = %i\n" % (i + 3))
+        reloaded = reloader.check()
+    assert reloaded == ['hs_batch_a']
+
+
+def test_same_second_edits(package, monkeypatch):
+    """ Edits that keep the mtime are seen if the size or inode changed and
+    are not imported from the stale bytecode cache.
+
+    """
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    path = package / 'hs_quick.py'
+    path.write_text("x = 1\n")
+    st = os.stat(str(path))
+    import hs_quick
+    reloader = ModuleReloader()
+
+    def save(source):
+        #: Atomic save that keeps the mtime
+        tmp = package / 'hs_quick.tmp'
+        tmp.write_text(source)
+        os.utime(str(tmp), ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(str(tmp), str(path))
+
+    save("x = 22\n")
+    assert reloader.check() == ['hs_quick']
+    assert hs_quick.x == 22
+
+    #: Same size and mtime, only the inode differs
+    save("x = 33\n")
+    assert reloader.check() == ['hs_quick']
+    assert hs_quick.x == 33
+    assert reloader.stale_bytecode == set()
+
+    assert reloader.check() == []
+
+
+def test_snapshot(package, tmp_path_factory):
+    """ Startup does not stat the modules, the first check compares them
+    against the snapshot of the previous run.
+
+    """
+    from atom.api import List
+    from hotswap.snapshot import Snapshot
+    from hotswap.sources import SourceProvider
+
+    class CountingSources(SourceProvider):
+        reads = List()
+
+        def read(self, filename):
+            self.reads.append(os.path.basename(filename))
+            return super(CountingSources, self).read(filename)
+
+    path = str(tmp_path_factory.mktemp('snapshot') / 'snapshot.bin')
+    for name in ('hs_snap_a', 'hs_snap_b', 'hs_snap_c'):
+        (package / (name + '.py')).write_text("x = 1\n")
+    import hs_snap_a
+    import hs_snap_b
+    import hs_snap_c
+
+    reloader = ModuleReloader(snapshot=Snapshot(path=path), use_hash=True)
+    assert not reloader.modules_mtimes
+    assert reloader.check() == []
+    assert reloader.snapshot.count >= 3
+    reloader.snapshot.close()
+
+    #: Changed while the app was not running, it was imported as is
+    write_module(package / 'hs_snap_b.py', "x = 22\n")
+    st = os.stat(str(package / 'hs_snap_b.py'))
+    os.utime(str(package / 'hs_snap_b.py'), (st.st_atime, st.st_mtime - 100))
+
+    sources = CountingSources()
+    reloader = ModuleReloader(snapshot=Snapshot(path=path), use_hash=True,
+                              sources=sources)
+    assert not reloader.modules_mtimes
+
+    #: Changed after the app started but before the first check
+    write_module(package / 'hs_snap_a.py', "x = 2\n")
+    assert reloader.check() == ['hs_snap_a']
+    assert hs_snap_a.x == 2
+    assert hs_snap_b.x == 1
+    assert reloader.stats['changed_offline'] == 1
+    #: Hashes of unchanged files come from the snapshot
+    assert 'hs_snap_c.py' not in sources.reads
+    assert reloader.check() == []
+
+    #: The snapshot has the new keys
+    filename = os.path.abspath(hs_snap_a.__file__)
+    key = reloader.sources.change_key(filename)
+    snapshot = Snapshot(path=path)
+    snapshot.load()
+    assert snapshot.get(filename)[0] == key
+    snapshot.close()
+
+    #: Later reloads are only saved when the reloader is closed
+    write_module(package / 'hs_snap_a.py', "x = 3\n")
+    assert reloader.check() == ['hs_snap_a']
+    snapshot.load()
+    assert snapshot.get(filename)[0] == key
+    snapshot.close()
+    reloader.close()
+    snapshot.load()
+    assert snapshot.get(filename)[0] == reloader.sources.change_key(filename)
+    assert snapshot.get(filename)[0] != key
+
+
+def test_invalid_snapshot(tmp_path):
+    from hotswap.snapshot import Snapshot
+    path = tmp_path / 'snapshot.bin'
+    path.write_bytes(b'garbage')
+    snapshot = Snapshot(path=str(path))
+    snapshot.load()
+    assert snapshot.get('/missing.py') is None
+    snapshot.update('/missing.py', (1, 2, 3))
+    snapshot.save()
+    assert snapshot.count == 1
+    assert snapshot.get('/missing.py') == ((1, 2, 3), None)
+
+
+def test_lazy(package):
+    (package / 'hs_lazy.py').write_text("x = 1\n")
+    import hs_lazy
+    reloader = ModuleReloader(lazy=True)
+    assert not reloader.modules_mtimes
+
+    write_module(package / 'hs_lazy.py', "x = 22\n")
+    assert reloader.check() == ['hs_lazy']
+    assert hs_lazy.x == 22
+    assert reloader.check() == []
+
+
+def test_scope():
+    from hotswap.scope import Scope
+    root = os.path.abspath('app')
+    scope = Scope(roots=[root], packages=['pkg.sub'],
+                  exclude=['*/tests/*'])
+    assert scope.match('app', os.path.join(root, 'app.py'))
+    assert scope.match('app.views', os.path.join(root, 'views', 'a.py'))
+    assert not scope.match('app', os.path.join(root, 'tests', 'a.py'))
+    assert not scope.match('other', os.path.abspath('application.py'))
+    assert scope.match('pkg.sub', '/site-packages/pkg/sub/__init__.py')
+    assert scope.match('pkg.sub.mod', '/site-packages/pkg/sub/mod.py')
+    assert not scope.match('pkg', '/site-packages/pkg/__init__.py')
+    assert not scope.match('pkg.subway', '/site-packages/pkg/subway.py')
+
+    scope = Scope(include=['*.enaml'])
+    assert scope.match('view', '/app/view.enaml')
+    assert not scope.match('model', '/app/model.py')
+
+    #: Changes are compiled again
+    scope.include = ['*.py']
+    assert scope.match('model', '/app/model.py')
+
+
+def test_scoped_check(package):
+    from hotswap.scope import Scope
+    write_module(package / 'hs_scoped.py', "x = 1\n")
+    write_module(package / 'hs_scoped_skip.py', "x = 1\n")
+    import hs_scoped
+    import hs_scoped_skip
+    scope = Scope(roots=[str(package)], exclude=['*_skip.py'])
+    reloader = ModuleReloader(scope=scope)
+    assert sorted(reloader.index.filenames) == ['hs_scoped']
+
+    write_module(package / 'hs_scoped.py', "x = 2\n")
+    write_module(package / 'hs_scoped_skip.py', "x = 2\n")
+    assert reloader.check() == ['hs_scoped']
+    assert reloader.summary.counts['checked'] == 1
+    assert (hs_scoped.x, hs_scoped_skip.x) == (2, 1)
+
+
+def test_is_library():
+    import json
+    import sysconfig
+    from hotswap.autoreload import is_library
+    assert is_library(json.__file__)
+    assert is_library(pytest.__file__)
+    #: Apps may live under the prefix without being part of it
+    prefix = sysconfig.get_config_var('prefix')
+    assert not is_library(os.path.join(prefix, 'src', 'app', 'main.py'))
@@ -0,0 +1,165 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Loopback tests of pushing code from a HotswapServer to a HotswapClient.
+
+'''
+import os
+import socket
+import pytest
+import enaml
+from hotswap.api import Hotswapper
+from hotswap.delta import apply_delta, make_delta
+from hotswap.remote import HotswapClient, HotswapServer
+from hotswap.watcher import PollingWatcher
+from conftest import write_module
+
+
+VIEW = """
+from enaml.core.api import Declarative
+from hs_remote_util import label
+
+enamldef Item(Declarative):
+    attr text = ""
+
+enamldef Main(Declarative):
+    Item:
+        text = label(%s)
+"""
+
+ADDRESSES = ['tcp']
+if hasattr(socket, 'AF_UNIX'):
+    ADDRESSES.append('unix')
+
+
+@pytest.mark.parametrize('kind', ADDRESSES)
+@pytest.mark.parametrize('compatible', [True, False])
+def test_loopback(package, tmp_path_factory, kind, compatible):
+    write_module(package / 'hs_remote_util.py', """
+    def label(x):
+        return 'item %s' % x
+    """)
+    write_module(package / 'hs_remote_view.enaml', VIEW % 1)
+    with enaml.imports():
+        import hs_remote_view
+    view = hs_remote_view.Main()
+    view.initialize()
+
+    if kind == 'tcp':
+        address = ('127.0.0.1', 0)
+    else:
+        address = str(tmp_path_factory.mktemp('sock') / 'hotswap.sock')
+    server = HotswapServer(address=address, roots=[str(package)],
+                           watcher=PollingWatcher())
+    server.listen()
+    assert server.files[str(package / 'hs_remote_view.enaml')] == \
+        'hs_remote_view'
+
+    #: Changes made before the client connects are sent once it says hello
+    write_module(package / 'hs_remote_view.enaml', VIEW % 2)
+    assert server.serve_once() == []
+
+    client = HotswapClient(address=server.address, hotswap=Hotswapper(),
+                           view=view)
+    if not compatible:
+        #: Clients with other compilers are sent the sources
+        client.tags = {}
+    client.connect()
+    try:
+        server.serve_once(1)
+        server.serve_once(1)
+        assert client.poll(1) == ['hs_remote_view']
+        assert [c.text for c in view.children] == ['item 2']
+
+        #: The dependent view is reloaded too and its bindings are rerun
+        write_module(package / 'hs_remote_util.py', """
+        def label(x):
+            return 'label %s' % x
+        """)
+        assert server.serve_once() == ['hs_remote_util']
+        assert client.poll(1) == ['hs_remote_util', 'hs_remote_view']
+        assert [c.text for c in view.children] == ['label 2']
+        assert client.received == 2
+
+        #: Syntax errors are reported by the server and nothing is sent
+        write_module(package / 'hs_remote_util.py', "def label(x):\n  return (\n")
+        sent = server.serve_once()
+        assert sent == ([] if compatible else ['hs_remote_util'])
+        assert client.poll(1) == []
+        assert len(client.errors) == (0 if compatible else 1)
+        assert [c.text for c in view.children] == ['label 2']
+    finally:
+        client.close()
+        server.close()
+    if kind == 'unix':
+        assert not os.path.exists(address)
+
+
+def big_module(edit=None):
+    return ''.join(
+        'def f%(i)i(x):\n'
+        '    y = x * %(i)i\n'
+        '    z = y + 1\n'
+        '    return z + %(v)s\n\n' % {'i': i, 'v': 'x' if i == edit else i}
+        for i in range(1000))
+
+
+def test_delta(package):
+    write_module(package / 'hs_remote_big.py', big_module())
+    import hs_remote_big
+    server = HotswapServer(address=('127.0.0.1', 0), roots=[str(package)],
+                           watcher=PollingWatcher())
+    server.listen()
+    client = HotswapClient(address=server.address, hotswap=Hotswapper())
+    client.connect()
+    try:
+        server.serve_once(1)
+        server.serve_once(1)
+
+        #: The first version is sent in full
+        write_module(package / 'hs_remote_big.py', big_module(10))
+        server.serve_once()
+        assert client.poll(1) == ['hs_remote_big']
+        full = server.bytes_sent
+        assert full > 10000
+
+        #: Once acknowledged only the delta is sent
+        write_module(package / 'hs_remote_big.py', big_module(500))
+        server.serve_once(1)
+        assert client.poll(1) == ['hs_remote_big']
+        assert server.bytes_sent - full < 500
+        assert hs_remote_big.f500(1) == 500 + 1 + 1
+        assert hs_remote_big.f10(1) == 10 + 1 + 10
+
+        #: If the client lost the base it asks for the full version
+        client.versions.clear()
+        sent = server.bytes_sent
+        write_module(package / 'hs_remote_big.py', big_module(600))
+        server.serve_once(1)
+        assert client.poll(1) == []
+        server.serve_once(1)
+        assert server.bytes_sent - sent > 10000
+        assert client.poll(1) == ['hs_remote_big']
+        assert hs_remote_big.f600(2) == 2 * 600 + 1 + 2
+    finally:
+        client.close()
+        server.close()
+
+
+def test_make_delta():
+    base = b''.join(b'block %04i of the base\n' % i for i in range(200))
+    blocks = base.split(b'\n')
+    #: Edit one line and move another block from the start to the end
+    blocks[100] = b'edited'
+    data = b'\n'.join(blocks[10:] + blocks[:10])
+    ops = make_delta(base, data)
+    assert apply_delta(base, ops) == data
+    literals = [op for op in ops if isinstance(op, bytes)]
+    assert sum(len(op) for op in literals) < 64
+    assert make_delta(base, base) == [(0, len(base))]
+    assert apply_delta(base, make_delta(base, b'')) == b''
+    assert apply_delta(b'', make_delta(b'', data)) == data
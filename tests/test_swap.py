@@ -0,0 +1,761 @@
+'''
+Copyright (c) 2017, Jairus Martin.
+
+Distributed under the terms of the MIT License.
+
+The full license is in the file COPYING.txt, distributed with this software.
+
+Headless tests of updating declarative trees (no Qt required).
+
+'''
+import sys
+import pytest
+import enaml
+from textwrap import dedent
+from hotswap.api import Hotswapper
+from conftest import write_module
+
+
+@pytest.fixture
+def views(tmp_path):
+    """ Import enaml source as a module """
+    sys.path.insert(0, str(tmp_path))
+    names = []
+
+    def load(source, name='hs_views'):
+        (tmp_path / (name + '.enaml')).write_text(dedent(source))
+        names.append(name)
+        with enaml.imports():
+            __import__(name)
+        return sys.modules[name]
+
+    yield load
+    sys.path.remove(str(tmp_path))
+    for name in names:
+        sys.modules.pop(name, None)
+
+
+HEADER = """
+    from enaml.core.api import Declarative
+
+    enamldef Item(Declarative):
+        attr text = ""
+
+    enamldef Other(Declarative):
+        attr text = ""
+
+"""
+
+
+def test_keyed_reorder(views):
+    module = views(HEADER + """
+    enamldef Old(Declarative): view:
+        Item: a:
+            text = "a"
+        Item: b:
+            text = "b"
+        Item: c:
+            text = "c"
+        Other:
+            text = "d"
+
+    enamldef New(Declarative): view:
+        Other:
+            text = "d"
+        Item: c:
+            text = "c2"
+        Item: a:
+            text = "a2"
+        Item: b:
+            text = view.title
+        attr title = "b2"
+    """)
+    old = module.Old()
+    old.initialize()
+    a, b, c, d = old.children
+    new = module.New()
+    new.initialize()
+
+    hotswap = Hotswapper()
+    hotswap.update(old, new)
+    assert old.children == [d, c, a, b]
+    assert [child.text for child in old.children] == ['d', 'c2', 'a2', 'b2']
+    assert not any(child.is_destroyed for child in (a, b, c, d))
+
+
+def test_insert_and_remove(views):
+    module = views(HEADER + """
+    enamldef Old(Declarative):
+        Item:
+            text = "1"
+        Other:
+            text = "2"
+        Item:
+            text = "3"
+
+    enamldef New(Declarative):
+        Item:
+            text = "1"
+        Item:
+            text = "new"
+        Item:
+            text = "3"
+    """)
+    old = module.Old()
+    old.initialize()
+    first, second, third = old.children
+    new = module.New()
+    new.initialize()
+
+    Hotswapper().update(old, new)
+    assert [c.text for c in old.children] == ['1', 'new', '3']
+    assert old.children[0] is first
+    #: Unchanged unnamed items are matched by fingerprint, not position
+    assert old.children[2] is third
+    assert old.children[1] not in (first, second, third)
+    assert second.is_destroyed
+
+
+GROUPS = HEADER + """
+    enamldef Main(Declarative):
+        Other:
+            text = "g1"
+            Item: a:
+                text = "a"
+        Other:
+            text = "g2"
+            Item: b:
+                text = "b"
+        Other:
+            text = "g3"
+            Item: c:
+                text = "c"
+"""
+
+
+@pytest.mark.parametrize('instance', [False, True])
+def test_unnamed_reorder(views, instance):
+    """ Unnamed blocks that moved are matched by their fingerprint """
+    module = views(GROUPS)
+    view = module.Main()
+    view.initialize()
+    g1, g2, g3 = view.children
+    items = [g.children[0] for g in view.children]
+
+    source = GROUPS.split('        Other:')
+    reload_source(module, ''.join(
+        [source[0], '        Other:' + source[3].rstrip() + '\n'] +
+        ['        Other:' + s for s in source[1:3]]))
+    hotswap = Hotswapper()
+    summary = hotswap.update(view, module.Main() if instance else None)
+    assert not hotswap.errors
+    assert view.children == [g3, g1, g2]
+    assert [g.children[0] for g in (g1, g2, g3)] == items
+    assert [g.text for g in view.children] == ['g3', 'g1', 'g2']
+    assert summary.counts['moved'] > 0
+    assert not summary.counts.get('created')
+    assert not summary.counts.get('inserted')
+
+
+def test_batched_insert(views, monkeypatch):
+    module = views(HEADER + """
+    enamldef Old(Declarative):
+        Item:
+            text = "0"
+        Other:
+            text = "gone"
+
+    enamldef New(Declarative):
+        Item:
+            text = "0"
+        Item:
+            text = "1"
+        Item:
+            text = "2"
+        Item:
+            text = "3"
+    """)
+    old = module.Old()
+    old.initialize()
+    other = old.children[1]
+    new = module.New()
+    new.initialize()
+
+    calls = []
+    insert_children = module.Old.insert_children
+
+    def record(self, before, insert):
+        calls.append(len(insert))
+        return insert_children(self, before, insert)
+
+    monkeypatch.setattr(module.Old, 'insert_children', record)
+    Hotswapper().update(old, new)
+    assert calls == [3]
+    assert [c.text for c in old.children] == ['0', '1', '2', '3']
+    assert other.is_destroyed and other.parent is None
+
+
+def test_skip_unchanged(views, monkeypatch):
+    module = views(HEADER + """
+    enamldef Old(Declarative):
+        Item:
+            text = "same"
+            Item:
+                text = "nested"
+        Item:
+            text = "before"
+
+    enamldef New(Declarative):
+        Item:
+            text = "same"
+            Item:
+                text = "nested"
+        Item:
+            text = "after"
+    """)
+    old = module.Old()
+    old.initialize()
+    new = module.New()
+    new.initialize()
+
+    updated = []
+    update_bindings = Hotswapper.update_bindings
+
+    def record(self, old, new):
+        updated.append(old)
+        return update_bindings(self, old, new)
+
+    monkeypatch.setattr(Hotswapper, 'update_bindings', record)
+    Hotswapper().update(old, new)
+    assert updated == [old, old.children[1]]
+    assert old.children[1].text == "after"
+
+
+def test_update_from_node(views, monkeypatch):
+    from enaml.core.enamldef_meta import EnamlDefMeta
+    from hotswap import autoreload
+    module = views(HEADER + """
+    enamldef Main(Declarative): view:
+        attr title = "Hello"
+        Item: a:
+            text << view.title
+        Item: b:
+            text = "b"
+    """)
+    view = module.Main()
+    view.initialize()
+    a, b = view.children
+    assert a.text == "Hello"
+
+    hotswap = Hotswapper()
+    write_module(module.__file__, HEADER + """
+    enamldef Main(Declarative): view:
+        attr title = "New"
+        Item: c:
+            text << a.text + "!"
+        Item: a:
+            text << view.title
+        Other:
+            text << c.text * 2
+    """)
+    with enaml.imports():
+        autoreload.superreload(module)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("A new view should not be created")
+
+    monkeypatch.setattr(EnamlDefMeta, '__call__', fail)
+    hotswap.update(view)
+    #: b lost its identifier so it's reused for c
+    assert view.children[:2] == [b, a]
+    other = view.children[2]
+    assert isinstance(other, module.Other)
+    assert view.title == "New"
+    assert a.text == "New"
+    assert b.text == "New!"
+    assert other.text == "New!New!"
+
+
+def test_selective_bindings(views, monkeypatch):
+    from enaml.core.expression_engine import ExpressionEngine
+    module = views(HEADER + """
+    enamldef Old(Declarative): view:
+        attr title = "t"
+        attr count = 1
+        attr label << title + "!"
+        Item:
+            text = "same"
+
+    enamldef New(Declarative): view:
+        attr title = "t2"
+        attr count = 1
+        attr label << title + "!"
+        Item:
+            text << str(1 / 0)
+    """)
+    old = module.Old()
+    old.initialize()
+    new = module.New()
+    new.initialize()
+
+    updated = []
+    update = ExpressionEngine.update
+
+    def record(self, owner, name):
+        updated.append(name)
+        return update(self, owner, name)
+
+    monkeypatch.setattr(ExpressionEngine, 'update', record)
+    hotswap = Hotswapper()
+    hotswap.update(old, new)
+    #: count is unchanged but label depends on title
+    assert 'count' not in updated
+    assert old.title == "t2"
+    assert old.label == "t2!"
+    assert len(hotswap.errors) == 1
+    node, name, error = hotswap.errors[0]
+    assert name == 'text' and isinstance(error, ZeroDivisionError)
+
+
+ADD_ATTR = """
+    from enaml.core.api import Declarative
+
+    enamldef Item(Declarative):
+        attr text = ""
+
+    enamldef Main(Declarative): view:
+        attr label << it.text + "!"
+        Item: it:
+            text = "a"
+"""
+
+
+def reload_source(module, source):
+    """ Rewrite the module source and superreload it """
+    from hotswap import autoreload
+    write_module(module.__file__, source)
+    with enaml.imports():
+        autoreload.superreload(module)
+
+
+@pytest.mark.parametrize('migrate', [False, True])
+def test_add_attr(views, migrate):
+    module = views(ADD_ATTR)
+    view = module.Main()
+    view.initialize()
+    item = view.children[0]
+    item.name = "kept"
+    assert view.label == "a!"
+
+    reload_source(module, ADD_ATTR.replace(
+        'attr text = ""', 'attr text = ""\n        attr extra = 3'))
+    hotswap = Hotswapper(migrate_instances=migrate)
+    hotswap.update(view)
+    assert not hotswap.errors
+
+    new_item = view.children[0]
+    assert new_item is not item
+    assert new_item.extra == 3
+    assert new_item.parent is view
+    if migrate:
+        #: Values are carried over instead of creating a new item
+        assert new_item.name == "kept"
+        assert hotswap.migrator.migrated[item] is new_item
+    else:
+        assert item.is_destroyed
+    new_item.text = "b"
+    assert view.label == "b!"
+
+
+ROOT_ATTR = HEADER + """
+    enamldef Main(Declarative): view:
+        attr label = "a"
+        Item:
+            text << view.label + "!"
+"""
+
+
+@pytest.mark.parametrize('migrate', [False, True])
+def test_add_root_attr(views, migrate):
+    module = views(ROOT_ATTR)
+    view = module.Main()
+    view.initialize()
+    reload_source(module, ROOT_ATTR.replace(
+        'attr label = "a"', 'attr label = "a"\n        attr extra = 1'
+    ).replace('view.label + "!"', 'view.label + str(view.extra + 1)'))
+    hotswap = Hotswapper(migrate_instances=migrate)
+    summary = hotswap.update(view)
+    if not migrate:
+        #: The view cannot be re-created so the change is reported
+        assert summary.view is view
+        assert summary.counts['errors'] == 1
+        (obj, name, e), = hotswap.errors
+        assert obj is view and isinstance(e, AttributeError)
+        assert view.children[0].text == "a!"
+        return
+
+    #: The child is updated after the migrated view has its new engine
+    assert not hotswap.errors
+    new_view = summary.view
+    assert new_view is not view
+    assert new_view.extra == 1
+    assert new_view.children[0].parent is new_view
+    assert new_view.children[0].text == "a2"
+    new_view.label = "b"
+    assert new_view.children[0].text == "b2"
+
+
+def test_poll_debounced(views, monkeypatch):
+    module = views(ADD_ATTR)
+    view = module.Main()
+    view.initialize()
+    hotswap = Hotswapper(debounce=0.5)
+    batcher = hotswap._reloader.watcher
+    now = [0.0]
+    batcher.clock = lambda: now[0]
+    updated = []
+    monkeypatch.setattr(Hotswapper, 'update',
+                        lambda self, view, **kwargs: updated.append(view))
+
+    write_module(module.__file__, ADD_ATTR.replace('"a"', '"b"'))
+    assert hotswap.poll(view) == []
+    now[0] = 1
+    assert hotswap.poll(view) == ['hs_views']
+    assert updated == [view]
+
+
+def test_async_driver(views):
+    import asyncio
+    from hotswap.api import AsyncDriver
+    module = views(ADD_ATTR)
+    view = module.Main()
+    view.initialize()
+    hotswap = Hotswapper(watch=True, debounce=0.05)
+    driver = AsyncDriver(hotswap=hotswap, view=view, interval=0.01)
+
+    async def run():
+        driver.start()
+        swapped = driver.next_swap()
+        #: Let the driver start waiting before changing the file
+        await asyncio.sleep(0)
+        write_module(module.__file__, ADD_ATTR.replace('"a"', '"b"'))
+        try:
+            return await asyncio.wait_for(swapped, 5)
+        finally:
+            driver.stop()
+
+    assert asyncio.run(run()) == ['hs_views']
+    assert view.children[0].text == "b"
+    hotswap.close()
+
+
+def test_lazy_driver_import():
+    """ asyncio is only imported when the driver is used """
+    import os
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.check_call([sys.executable, '-c', (
+        "import sys, hotswap.api\n"
+        "assert 'asyncio' not in sys.modules\n"
+        "from hotswap.api import AsyncDriver")], cwd=root)
+
+
+def test_close(views):
+    from hotswap.watcher import InotifyWatcher
+    views(ADD_ATTR)
+    hotswap = Hotswapper(watch=True, precompile=True)
+    reloader = hotswap._reloader
+    watcher = reloader.watcher
+    assert watcher.thread is not None
+    hotswap.close()
+    assert watcher.thread is None and not watcher.paths
+    assert reloader.precompiler is None
+    if isinstance(watcher, InotifyWatcher):
+        assert watcher.fd == -1
+
+    #: A lazy hotswapper does not create its reloader to close it
+    lazy = Hotswapper(lazy=True)
+    lazy.close()
+    assert Hotswapper._reloader.get_slot(lazy) is None
+
+
+def test_async_driver_error(views, capsys):
+    """ The driver reports errors to the waiters and keeps watching """
+    import asyncio
+    from hotswap.api import AsyncDriver
+    module = views(ADD_ATTR)
+    view = module.Main()
+    view.initialize()
+    calls = []
+
+    class FailingHotswapper(Hotswapper):
+        def poll(self, view):
+            calls.append(view)
+            if len(calls) == 1:
+                raise RuntimeError("poll failed")
+            return super(FailingHotswapper, self).poll(view)
+
+    hotswap = FailingHotswapper()
+    driver = AsyncDriver(hotswap=hotswap, view=view, interval=0.01)
+
+    async def run():
+        driver.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(driver.next_swap(), 5)
+            swapped = driver.next_swap()
+            write_module(module.__file__, ADD_ATTR.replace('"a"', '"b"'))
+            return await asyncio.wait_for(swapped, 5)
+        finally:
+            driver.stop()
+
+    assert asyncio.run(run()) == ['hs_views']
+    assert view.children[0].text == "b"
+    assert "poll failed" in capsys.readouterr().out
+
+
+def test_summary(views):
+    module = views(HEADER + """
+    enamldef Old(Declarative):
+        Item:
+            text = "same"
+        Item:
+            text = "before"
+        Other:
+            text = "gone"
+
+    enamldef New(Declarative):
+        Item:
+            text = "same"
+        Item:
+            text = "after"
+        Item:
+            text = "new"
+    """)
+    old = module.Old()
+    old.initialize()
+    new = module.New()
+    new.initialize()
+
+    summaries = []
+    hotswap = Hotswapper()
+    hotswap.observe('swapped', lambda change: summaries.append(
+        change['value']))
+    summary = hotswap.update(old, new)
+    assert summaries == [summary]
+    counts = summary.counts
+    assert counts['destroyed'] == 1
+    assert counts['inserted'] == 1
+    assert counts['skipped'] == 1
+    assert counts['rerun'] == 1
+    assert {'diff', 'destroy', 'update'} <= set(summary.timings)
+    assert summary.as_dict()['counts'] == counts
+
+
+def test_lazy(views):
+    from hotswap.core import EnamlReloader
+    module = views(HEADER + """
+    enamldef Main(Declarative):
+        Item:
+            text = "a"
+    """)
+    view = module.Main()
+    view.initialize()
+
+    hotswap = Hotswapper(lazy=True)
+    assert Hotswapper._reloader.get_slot(hotswap) is None
+
+    #: Edits before the first poll are still seen
+    write_module(module.__file__, HEADER + """
+    enamldef Main(Declarative):
+        Item:
+            text = "b"
+    """)
+    assert hotswap.poll(view) == [module.__name__]
+    assert isinstance(hotswap._reloader, EnamlReloader)
+    assert hotswap._reloader.check_all
+    assert view.children[0].text == "b"
+    assert hotswap.poll(view) == []
+
+
+def test_reloaded_helper(views, tmp_path):
+    """ Bindings using a function of a reloaded module are rerun even
+    though their own code did not change.
+
+    """
+    helper = tmp_path / 'hs_helper.py'
+    helper.write_text("def label(x):\n    return 'item %s' % x\n")
+    try:
+        module = views(HEADER + """
+    from hs_helper import label
+
+    enamldef Main(Declarative):
+        Item:
+            text = label(1)
+    """)
+        view = module.Main()
+        view.initialize()
+        assert view.children[0].text == 'item 1'
+        hotswap = Hotswapper()
+
+        write_module(helper, "def label(x):\n    return 'label %s' % x\n")
+        assert sorted(hotswap.poll(view)) == ['hs_helper', 'hs_views']
+        assert view.children[0].text == 'label 1'
+    finally:
+        sys.modules.pop('hs_helper', None)
+
+
+@pytest.mark.parametrize('skip', [True, False])
+def test_reloaded_constant(views, tmp_path, skip):
+    """ Bindings using a constant whose value changed in a reloaded module
+    are rerun.
+
+    """
+    helper = tmp_path / 'hs_helper.py'
+    helper.write_text("LABEL = 'one'\n")
+    try:
+        module = views(HEADER + """
+    from hs_helper import LABEL
+
+    enamldef Main(Declarative):
+        Item:
+            text = LABEL
+        Item:
+            text << LABEL + "!"
+        Item:
+            text = "fixed"
+    """)
+        view = module.Main()
+        view.initialize()
+        assert [c.text for c in view.children] == ['one', 'one!', 'fixed']
+        hotswap = Hotswapper(skip_unchanged=skip)
+
+        write_module(helper, "LABEL = 'two'\n")
+        assert sorted(hotswap.poll(view)) == ['hs_helper', 'hs_views']
+        assert not hotswap.errors
+        assert [c.text for c in view.children] == ['two', 'two!', 'fixed']
+        assert hotswap.summary.counts['rerun'] == 2
+    finally:
+        sys.modules.pop('hs_helper', None)
+
+
+FUNC = HEADER + """
+    enamldef Main(Declarative): view:
+        attr title = "a"
+        func fmt(x):
+            return "F1 " + x
+        Item:
+            text << view.fmt(view.title)
+        Item:
+            text = "fixed"
+"""
+
+
+@pytest.mark.parametrize('skip', [True, False])
+def test_func_body(views, skip):
+    """ Bindings calling a func whose body changed are rerun """
+    module = views(FUNC)
+    view = module.Main()
+    view.initialize()
+    assert view.children[0].text == "F1 a"
+    hotswap = Hotswapper(skip_unchanged=skip)
+
+    write_module(module.__file__, FUNC.replace('"F1 "', '"F2 "'))
+    assert hotswap.poll(view) == ['hs_views']
+    assert not hotswap.errors
+    assert view.children[0].text == "F2 a"
+    assert hotswap.summary.counts['rerun'] == 1
+    view.title = "b"
+    assert view.children[0].text == "F2 b"
+
+
+IDENTIFIERS = HEADER + """
+    enamldef Main(Declarative):
+        Item: a:
+            text = "one"
+        Item: b:
+            text << a.text + "!"
+"""
+
+
+@pytest.mark.parametrize('instance', [False, True])
+def test_replaced_identifier(views, instance):
+    """ Unchanged subtrees using an identifier of a node the update
+    replaced are bound to the new node.
+
+    """
+    module = views(IDENTIFIERS)
+    view = module.Main()
+    view.initialize()
+    b = view.children[1]
+    assert b.text == "one!"
+
+    reload_source(module, IDENTIFIERS.replace('Item: a:', 'Other: a:'))
+    new = None
+    if instance:
+        new = module.Main()
+        new.initialize()
+    hotswap = Hotswapper()
+    hotswap.update(view, new)
+    assert not hotswap.errors
+    a = view.children[0]
+    assert type(a).__name__ == 'Other'
+    assert view.children[1] is b
+    assert hotswap.summary.counts['skipped'] >= 1
+    a.text = "two"
+    assert b.text == "two!"
+
+
+PATTERNS = HEADER + """
+    from enaml.core.api import Conditional, Looper
+
+    enamldef Main(Declarative): view:
+        attr show = True
+        attr values = [1, 2]
+        Item: a:
+            text = "a"
+        Conditional:
+            condition << show
+            Item:
+                text = "shown"
+        Looper:
+            iterable << values
+            Item:
+                text = "item %s" % loop.item
+"""
+
+
+def test_patterns(views):
+    """ Patterns bound to attrs of their ancestors are updated in place and
+    only recreate their items if their body changed.
+
+    """
+    module = views(PATTERNS)
+    view = module.Main()
+    view.initialize()
+    shown, item = view.children[1], view.children[3]
+
+    def texts():
+        return [c.text for c in view.children if hasattr(c, 'text')]
+
+    #: An edit outside of the patterns keeps their items
+    hotswap = Hotswapper()
+    reload_source(module, PATTERNS.replace('"a"', '"a2"'))
+    hotswap.update(view)
+    assert not hotswap.errors
+    assert texts() == ['a2', 'shown', 'item 1', 'item 2']
+    assert view.children[1] is shown and view.children[3] is item
+
+    #: Edits of their bodies and bindings
+    reload_source(module, PATTERNS.replace('"a"', '"a2"').replace(
+        '"shown"', '"shown2"').replace('"item %s"', '"value %s"').replace(
+        'condition << show', 'condition << show and len(values) > 1'))
+    hotswap.update(view)
+    assert not hotswap.errors
+    assert texts() == ['a2', 'shown2', 'value 1', 'value 2']
+    assert shown.is_destroyed and item.is_destroyed
+
+    view.values = [3]
+    assert texts() == ['a2', 'value 3']
+    view.values = [3, 4]
+    assert texts() == ['a2', 'shown2', 'value 3', 'value 4']